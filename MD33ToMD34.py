@@ -20,6 +20,7 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import m3
+import sys
 import argparse
 import os.path
 from typing import Optional
@@ -46,7 +47,7 @@ def structureToMD34(structure: m3.M3Structure):
             raise Exception(field.name, type(value), value)
 
 
-def processModel(mSrc: str, mDest: Optional[str] = None, outDir: Optional[str] = None, skipExisting: bool = False):
+def processModel(mSrc: str, mDest: Optional[str] = None, outDir: Optional[str] = None, skipExisting: bool = False, validation: str = "full"):
     if not outDir:
         outDir = os.path.dirname(mSrc)
     if not mDest:
@@ -61,9 +62,9 @@ def processModel(mSrc: str, mDest: Optional[str] = None, outDir: Optional[str] =
         return
 
     try:
-        model = m3.loadModel(mSrc)
+        model = m3.loadModel(mSrc, validation=validation)
         structureToMD34(model)
-        m3.saveAndInvalidateModel(model, mDest)
+        m3.saveModel(model, mDest, validation=validation)
         print("OK")
     except Exception:
         print("FAIL")
@@ -75,6 +76,12 @@ if __name__ == '__main__':
     parser.add_argument('src', type=str, nargs='+', help='source .m3 file')
     parser.add_argument('-O', '--output-directory', type=str, help='output directory for converted m3 files')
     parser.add_argument('--skip-existing', action='store_true', default=False, help='skip conversion if target field already exists')
+    parser.add_argument('--validation', choices=m3.validationLevels, default="full", help='How thoroughly the models get validated when loading and saving, "none" is faster for trusted files (default: full)')
+    parser.add_argument('--profile', action='store_true', default=False, help='Print the time spent per phase and structure while loading and saving the models')
     args = parser.parse_args()
+    if args.profile:
+        m3.enableProfiling()
     for src in args.src:
-        processModel(src, None, args.output_directory, args.skip_existing)
+        processModel(src, None, args.output_directory, args.skip_existing, args.validation)
+    if args.profile:
+        sys.stderr.write(m3.disableProfiling().formatTable(10))
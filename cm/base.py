@@ -63,6 +63,13 @@ contentImportPresetList = [
     # (M3ImportContentPreset.Custom, "Custom", "Customize what's being imported"),
 ]
 
+# The reference fields of the m3 model which the presets need, the other fields don't get decoded (see m3.loadModel):
+meshMaterialsModelFields = ["vertices", "divisions", "boneLookup", "bones", "materialReferences"] + list(shared.m3MaterialFieldNames.values())
+contentImportPresetToModelFieldsMap = {
+    M3ImportContentPreset.MeshMaterialsVG: meshMaterialsModelFields,
+    M3ImportContentPreset.MeshMaterials: meshMaterialsModelFields,
+}
+
 
 class M3ImportContent(bpy.types.PropertyGroup):
     mesh: bpy.props.BoolProperty(
@@ -47,6 +47,8 @@ class ChangeLogCreator:
                     self.log("File modified at %s" % time.ctime(currentModelModificationTime))
                     currentModel = m3.loadModel(self.modelFileName)
                     self.changedAnimationIds = 0
+                    self.previousReferenceGraph = m3.getReferenceGraphOf(previousModel)
+                    self.currentReferenceGraph = m3.getReferenceGraphOf(currentModel)
                     self.compareM3Structures(previousModel, currentModel, "model")
                     if self.changedAnimationIds > 0:
                         self.log("%d animation ids have changed!" % self.changedAnimationIds)
@@ -78,6 +80,8 @@ class ChangeLogCreator:
                 previousLength = len(previousFieldContent)
                 if len(currentFieldContent) != previousLength:
                     self.log("The length of %s changed from %d to %d" % (fieldPath, previousLength, currentLength))
+                elif self.haveUnchangedSections(previousFieldContent, currentFieldContent):
+                    pass
                 else:
                     elementIndex = 0
                     for previousElement, currentElement in zip(previousFieldContent, currentFieldContent):
@@ -98,6 +102,29 @@ class ChangeLogCreator:
                     else:
                         self.changedAnimationIds += 1
 
+    def haveUnchangedSections(self, previousObjects, currentObjects):
+        """Tells if the objects got loaded from sections with equal bytes, which reference only sections with equal bytes
+
+        Since the bytes contain the indices of the referenced sections, these have the same index in both models."""
+        previousSectionIndex = self.previousReferenceGraph.getSectionIndexOf(previousObjects)
+        currentSectionIndex = self.currentReferenceGraph.getSectionIndexOf(currentObjects)
+        if previousSectionIndex is None or currentSectionIndex is None:
+            return False
+        sectionIndexPairs = [(previousSectionIndex, currentSectionIndex)]
+        for sectionIndex in self.previousReferenceGraph.getReachableSectionIndices(previousSectionIndex):
+            if sectionIndex != previousSectionIndex:
+                sectionIndexPairs.append((sectionIndex, sectionIndex))
+        previousSections = self.previousReferenceGraph.sections
+        currentSections = self.currentReferenceGraph.sections
+        for previousSectionIndex, currentSectionIndex in sectionIndexPairs:
+            if currentSectionIndex >= len(currentSections):
+                return False
+            previousSection = previousSections[previousSectionIndex]
+            currentSection = currentSections[currentSectionIndex]
+            if previousSection.structureDescription is not currentSection.structureDescription or previousSection.rawBytes != currentSection.rawBytes:
+                return False
+        return True
+
     def log(self, message):
         self.logFile.write(str(message) + "\n")
         print(message)
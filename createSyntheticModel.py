@@ -0,0 +1,332 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import m3
+import sys
+import argparse
+import math
+import random
+import time
+
+# The same structure versions the exporter uses for MODL version 23
+structureVersionMap = {
+    "MODL": 23, "SEQS": 1, "LAYR": 22, "MAT_": 15, "PAR_": 12, "BONE": 1, "IREF": 0, "DIV_": 2, "REGN": 3, "BAT_": 1, "MSEC": 1,
+    "MATM": 0, "STG_": 0, "STC_": 4, "STS_": 0, "SD3V": 0, "SD4Q": 0, "BNDS": 0, "BNDSV0AnimationReference": 0,
+    "AnimationReferenceHeader": 0, "Vector3AnimationReference": 0, "QuaternionAnimationReference": 0,
+    "UInt32AnimationReference": 0, "Matrix44": 0, "VEC4": 0, "VEC3": 0, "QUAT": 0, "VertexFormat0x182007d": 0}
+
+# Number of bones the vertices of a region are weighted to at most
+maxBonesPerRegion = 8
+
+
+class SyntheticModelCreator:
+    """Creates valid MD34 models with a given number of vertices, regions, bones, sequences and so on
+
+    The content is made up, but deterministic for a seed: The vertices of a region form a grid which is bound to a
+    few bones and each sequence animates the location and rotation of the bones in its transformation collections."""
+
+    def __init__(self, seed=0, keysPerAnimation=10):
+        self.random = random.Random(seed)
+        self.keysPerAnimation = keysPerAnimation
+        self.nextAnimId = 0x100
+
+    def createInstanceOf(self, structureName):
+        return m3.structures[structureName].getVersion(structureVersionMap[structureName]).createInstance()
+
+    def createUniqueAnimId(self):
+        animId = self.nextAnimId
+        self.nextAnimId += 1
+        return animId
+
+    def createAnimHeader(self, interpolationType=1):
+        animHeader = self.createInstanceOf("AnimationReferenceHeader")
+        animHeader.interpolationType = interpolationType
+        animHeader.animFlags = 0
+        animHeader.animId = self.createUniqueAnimId()
+        return animHeader
+
+    def createVector3(self, x, y, z):
+        v = self.createInstanceOf("VEC3")
+        v.x = x
+        v.y = y
+        v.z = z
+        return v
+
+    def createQuaternion(self, x, y, z, w):
+        q = self.createInstanceOf("QUAT")
+        q.x = x
+        q.y = y
+        q.z = z
+        q.w = w
+        return q
+
+    def createVector4(self, x, y, z, w):
+        v = self.createInstanceOf("VEC4")
+        v.x = x
+        v.y = y
+        v.z = z
+        v.w = w
+        return v
+
+    def createBoundings(self, radius):
+        boundings = self.createInstanceOf("BNDS")
+        boundings.minBorder = self.createVector3(-radius, -radius, -radius)
+        boundings.maxBorder = self.createVector3(radius, radius, radius)
+        boundings.radius = radius
+        return boundings
+
+    def createBone(self, boneIndex, parentIndex):
+        bone = self.createInstanceOf("BONE")
+        bone.name = "Bone%03d" % boneIndex
+        bone.flags = 0
+        bone.setNamedBit("flags", "real", True)
+        bone.setNamedBit("flags", "skinned", True)
+        bone.parent = parentIndex
+        bone.location = self.createInstanceOf("Vector3AnimationReference")
+        bone.location.header = self.createAnimHeader()
+        bone.location.initValue = self.createVector3(0.0, 0.0, 1.0 if parentIndex >= 0 else 0.0)
+        bone.location.nullValue = self.createVector3(0.0, 0.0, 0.0)
+        bone.rotation = self.createInstanceOf("QuaternionAnimationReference")
+        bone.rotation.header = self.createAnimHeader()
+        bone.rotation.initValue = self.createQuaternion(0.0, 0.0, 0.0, 1.0)
+        bone.rotation.nullValue = self.createQuaternion(0.0, 0.0, 0.0, 1.0)
+        bone.scale = self.createInstanceOf("Vector3AnimationReference")
+        bone.scale.header = self.createAnimHeader()
+        bone.scale.initValue = self.createVector3(1.0, 1.0, 1.0)
+        bone.scale.nullValue = self.createVector3(1.0, 1.0, 1.0)
+        bone.ar1 = self.createInstanceOf("UInt32AnimationReference")
+        bone.ar1.header = self.createAnimHeader(interpolationType=0)
+        bone.ar1.initValue = 1
+        bone.ar1.nullValue = 0
+        return bone
+
+    def createRestPosition(self, boneIndex, parentIndex):
+        restPosition = self.createInstanceOf("IREF")
+        matrix = self.createInstanceOf("Matrix44")
+        matrix.x = self.createVector4(1.0, 0.0, 0.0, 0.0)
+        matrix.y = self.createVector4(0.0, 1.0, 0.0, 0.0)
+        matrix.z = self.createVector4(0.0, 0.0, 1.0, 0.0)
+        matrix.w = self.createVector4(0.0, 0.0, -float(boneIndex), 1.0)
+        restPosition.matrix = matrix
+        return restPosition
+
+    def initBones(self, model, numberOfBones):
+        for boneIndex in range(numberOfBones):
+            # Some chains of bones, which start at the root bone:
+            parentIndex = -1 if boneIndex == 0 else max(0, boneIndex - 1 - self.random.randrange(3))
+            model.bones.append(self.createBone(boneIndex, parentIndex))
+            model.absoluteInverseBoneRestPositions.append(self.createRestPosition(boneIndex, parentIndex))
+
+    def initMesh(self, model, numberOfVertices, numberOfRegions):
+        division = self.createInstanceOf("DIV_")
+        msec = self.createInstanceOf("MSEC")
+        msec.bounding = self.createInstanceOf("BNDSV0AnimationReference")
+        msec.bounding.header = self.createAnimHeader(interpolationType=0)
+        msec.bounding.initValue = self.createBoundings(10.0)
+        msec.bounding.nullValue = self.createBoundings(0.0)
+        division.msec.append(msec)
+        model.divisions.append(division)
+        model.boundings = self.createBoundings(10.0)
+        if numberOfVertices == 0 or numberOfRegions == 0 or len(model.bones) == 0:
+            model.numberOfBonesToCheckForSkin = 0
+            return
+
+        model.setNamedBit("flags", "hasMesh", True)
+        model.vFlags = 0x182007d
+        vertexDescription = m3.structures["VertexFormat0x182007d"].getVersion(structureVersionMap["VertexFormat0x182007d"])
+        vertices = []
+        for regionIndex in range(numberOfRegions):
+            firstVertexIndex = numberOfVertices * regionIndex // numberOfRegions
+            regionVertexCount = numberOfVertices * (regionIndex + 1) // numberOfRegions - firstVertexIndex
+            if regionVertexCount > 0x10000:
+                raise Exception("A region can have at most %d vertices, use more regions" % 0x10000)
+            regionBoneIndices = sorted(self.random.sample(range(len(model.bones)), min(maxBonesPerRegion, len(model.bones))))
+            firstBoneLookupIndex = len(model.boneLookup)
+            model.boneLookup.extend(regionBoneIndices)
+
+            gridWidth = max(1, int(math.ceil(math.sqrt(regionVertexCount))))
+            for regionVertexIndex in range(regionVertexCount):
+                row, column = divmod(regionVertexIndex, gridWidth)
+                vertex = vertexDescription.createInstance()
+                vertex.position = self.createVector3(float(column), float(row), float(regionIndex) + self.random.uniform(-0.5, 0.5))
+                vertex.boneWeight0 = 255
+                vertex.boneLookupIndex0 = row * len(regionBoneIndices) // gridWidth
+                vertex.normal.z = 1.0
+                vertex.sign = 1.0
+                vertex.uv0.x = column * 2048 // gridWidth
+                vertex.uv0.y = row * 2048 // gridWidth
+                vertex.tangent.x = 1.0
+                vertices.append(vertex)
+
+            firstFaceVertexIndexIndex = len(division.faces)
+            for regionVertexIndex in range(regionVertexCount):
+                row, column = divmod(regionVertexIndex, gridWidth)
+                below = regionVertexIndex + gridWidth
+                if column + 1 < gridWidth and below + 1 < regionVertexCount:
+                    division.faces.extend((regionVertexIndex, regionVertexIndex + 1, below, regionVertexIndex + 1, below + 1, below))
+
+            region = self.createInstanceOf("REGN")
+            region.firstVertexIndex = firstVertexIndex
+            region.numberOfVertices = regionVertexCount
+            region.firstFaceVertexIndexIndex = firstFaceVertexIndexIndex
+            region.numberOfFaceVertexIndices = len(division.faces) - firstFaceVertexIndexIndex
+            region.numberOfBones = len(regionBoneIndices)
+            region.firstBoneLookupIndex = firstBoneLookupIndex
+            region.numberOfBoneLookupIndices = len(regionBoneIndices)
+            region.rootBoneIndex = regionBoneIndices[0]
+            region.numberOfBoneWeightPairsPerVertex = 1
+            division.regions.append(region)
+
+            batch = self.createInstanceOf("BAT_")
+            batch.regionIndex = regionIndex
+            batch.materialReferenceIndex = regionIndex % len(model.materialReferences) if len(model.materialReferences) > 0 else 0
+            division.objects.append(batch)
+
+        model.numberOfBonesToCheckForSkin = max(model.boneLookup) + 1
+        model.vertices = vertexDescription.instancesToBytes(vertices)
+
+    def initMaterials(self, model, numberOfMaterials):
+        materialDescription = m3.structures["MAT_"].getVersion(structureVersionMap["MAT_"])
+        layerFieldNames = [field.name for field in materialDescription.fields
+                           if isinstance(field, m3.StructureReferenceField) and field.historyOfReferencedStructures.name == "LAYR"]
+        for materialIndex in range(numberOfMaterials):
+            material = self.createInstanceOf("MAT_")
+            material.name = "Material%03d" % materialIndex
+            for layerFieldName in layerFieldNames:
+                layer = self.createInstanceOf("LAYR")
+                if layerFieldName == "diffuseLayer":
+                    layer.imagePath = "Assets\\Textures\\Synthetic%03d_Diffuse.dds" % materialIndex
+                setattr(material, layerFieldName, [layer])
+            model.standardMaterials.append(material)
+            materialReference = self.createInstanceOf("MATM")
+            materialReference.materialType = 1  # standard material
+            materialReference.materialIndex = materialIndex
+            model.materialReferences.append(materialReference)
+
+    def initParticles(self, model, numberOfParticleSystems):
+        for particleSystemIndex in range(numberOfParticleSystems):
+            particleSystem = self.createInstanceOf("PAR_")
+            particleSystem.boneIndex = particleSystemIndex % len(model.bones) if len(model.bones) > 0 else 0
+            particleSystem.materialReferenceIndex = particleSystemIndex % len(model.materialReferences) if len(model.materialReferences) > 0 else 0
+            particleSystem.indexPlusHighestIndex = numberOfParticleSystems - 1 + particleSystemIndex
+            particleSystem.trailingParticlesIndex = -1
+            model.particles.append(particleSystem)
+
+    def createLocationAnimation(self, durationInMS):
+        animation = self.createInstanceOf("SD3V")
+        animation.frames = [durationInMS * keyIndex // self.keysPerAnimation for keyIndex in range(self.keysPerAnimation)]
+        animation.flags = 0
+        animation.fend = durationInMS
+        animation.keys = [self.createVector3(self.random.uniform(-1, 1), self.random.uniform(-1, 1), 1.0) for keyIndex in range(self.keysPerAnimation)]
+        return animation
+
+    def createRotationAnimation(self, durationInMS):
+        animation = self.createInstanceOf("SD4Q")
+        animation.frames = [durationInMS * keyIndex // self.keysPerAnimation for keyIndex in range(self.keysPerAnimation)]
+        animation.flags = 0
+        animation.fend = durationInMS
+        animation.keys = []
+        for keyIndex in range(self.keysPerAnimation):
+            angle = 2.0 * math.pi * keyIndex / self.keysPerAnimation
+            animation.keys.append(self.createQuaternion(0.0, 0.0, math.sin(angle / 2), math.cos(angle / 2)))
+        return animation
+
+    def initSequences(self, model, numberOfSequences, stcsPerSequence):
+        animIdsToSTSIndexMap = {}
+        for sequenceIndex in range(numberOfSequences):
+            durationInMS = 1000 + 250 * self.random.randrange(8)
+            sequence = self.createInstanceOf("SEQS")
+            sequence.name = "Sequence%03d" % sequenceIndex
+            sequence.animStartInMS = 0
+            sequence.animEndInMS = durationInMS
+            sequence.boundingSphere = self.createBoundings(10.0)
+            model.sequences.append(sequence)
+
+            group = self.createInstanceOf("STG_")
+            group.name = sequence.name
+            model.sequenceTransformationGroups.append(group)
+            for stcIndex in range(stcsPerSequence):
+                collection = self.createInstanceOf("STC_")
+                collection.name = "%s_%d" % (sequence.name, stcIndex)
+                # The bones get distributed over the collections of the sequence:
+                animatedBones = model.bones[stcIndex::stcsPerSequence]
+                for bone in animatedBones:
+                    collection.animIds.append(bone.location.header.animId)
+                    collection.animRefs.append(0x20000 + len(collection.sd3v))
+                    collection.sd3v.append(self.createLocationAnimation(durationInMS))
+                    collection.animIds.append(bone.rotation.header.animId)
+                    collection.animRefs.append(0x30000 + len(collection.sd4q))
+                    collection.sd4q.append(self.createRotationAnimation(durationInMS))
+                animIds = tuple(sorted(collection.animIds))
+                stsIndex = animIdsToSTSIndexMap.get(animIds)
+                if stsIndex is None:
+                    stsIndex = len(model.sts)
+                    sts = self.createInstanceOf("STS_")
+                    sts.animIds = list(animIds)
+                    model.sts.append(sts)
+                    animIdsToSTSIndexMap[animIds] = stsIndex
+                collection.stsIndex = stsIndex
+                collection.stsIndexCopy = stsIndex
+                group.stcIndices.append(len(model.sequenceTransformationCollections))
+                model.sequenceTransformationCollections.append(collection)
+        for bone in model.bones:
+            if numberOfSequences > 0 and stcsPerSequence > 0:
+                bone.location.header.animFlags = 6
+                bone.rotation.header.animFlags = 6
+
+    def createModel(self, vertices=1000, regions=1, bones=10, sequences=2, stcsPerSequence=1, particleSystems=0, materials=1):
+        model = self.createInstanceOf("MODL")
+        model.modelName = "Synthetic.m3"
+        self.initBones(model, bones)
+        self.initMaterials(model, materials)
+        self.initMesh(model, vertices, regions)
+        self.initParticles(model, particleSystems)
+        self.initSequences(model, sequences, stcsPerSequence)
+        model.uniqueUnknownNumber = self.createUniqueAnimId()
+        return model
+
+
+def createSyntheticModel(seed=0, keysPerAnimation=10, **counts):
+    """Returns a new model, see SyntheticModelCreator.createModel for the counts which can be specified"""
+    return SyntheticModelCreator(seed, keysPerAnimation).createModel(**counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Create a valid m3 model with made up content, e.g. for benchmarks')
+    parser.add_argument('outputFile', help="name of the m3 file to create")
+    parser.add_argument('--vertices', type=int, default=1000, help='number of vertices (default: 1000)')
+    parser.add_argument('--regions', type=int, default=1, help='number of regions the vertices get split into (default: 1)')
+    parser.add_argument('--bones', type=int, default=10, help='number of bones (default: 10)')
+    parser.add_argument('--sequences', type=int, default=2, help='number of sequences (default: 2)')
+    parser.add_argument('--stcs-per-sequence', type=int, default=1, help='number of transformation collections per sequence (default: 1)')
+    parser.add_argument('--keys', type=int, default=10, help='number of keys per animation (default: 10)')
+    parser.add_argument('--particle-systems', type=int, default=0, help='number of particle systems (default: 0)')
+    parser.add_argument('--materials', type=int, default=1, help='number of standard materials (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the made up values (default: 0)')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    model = createSyntheticModel(
+        seed=args.seed, keysPerAnimation=args.keys, vertices=args.vertices, regions=args.regions, bones=args.bones,
+        sequences=args.sequences, stcsPerSequence=args.stcs_per_sequence, particleSystems=args.particle_systems, materials=args.materials)
+    m3.saveAndInvalidateModel(model, args.outputFile)
+    t1 = time.time()
+    sys.stderr.write("Created %s in %.2f s\n" % (args.outputFile, t1 - t0))
@@ -26,6 +26,13 @@ from sys import stderr
 import struct
 import copy
 import sys
+import os
+import io
+import hashlib
+import marshal
+import importlib.util
+import time
+from mmap import mmap as MemoryMappedFile, ACCESS_READ
 
 
 def increaseToValidSectionSize(size):
@@ -39,10 +46,19 @@ def increaseToValidSectionSize(size):
 
 
 class Section:
-    """Has fields indexEntry and structureDescription and sometimes also the fields rawBytes and content """
+    """Has fields indexEntry and structureDescription and sometimes also the fields rawBytes and content
+
+    When the changes of a loaded model get tracked, modified tells if the content of the section got changed.
+    modifiedRecords contains the records which got changed, or is None if the list itself got changed.
+    The section of a loaded model has the ReferenceGraph of all sections as referenceGraph, see loadModel."""
 
     def __init__(self):
         self.timesReferenced = 0
+        self.modified = False
+        self.modifiedRecords = set()
+        self.emptyReferencedObjects = []
+        self.loadedSections = None
+        self.referenceGraph = None
 
     def __str__(self):
         return 'Section %s timesReferenced=%d %sV%s' % (
@@ -63,8 +79,8 @@ class Section:
     def determineContentField(self, checkExpectedValue):
         self.content = self.structureDescription.createInstances(buffer=self.rawBytes, count=self.indexEntry.repetitions, checkExpectedValue=checkExpectedValue)
 
-    def determineFieldRawBytes(self):
-        minRawBytes = self.determineRawBytesWithData()
+    def determineFieldRawBytes(self, indexMaker=None):
+        minRawBytes = self.determineRawBytesWithData(indexMaker)
         if len(minRawBytes) != self.bytesRequiredForContent():
             raise Exception("Section size calculation failed: Expected %s but was %s for %s; content: %s" % (self.bytesRequiredForContent(), len(minRawBytes), self.structureDescription.structureName, minRawBytes))
         sectionSize = increaseToValidSectionSize(len(minRawBytes))
@@ -77,37 +93,185 @@ class Section:
                 rawBytes[i] = 0xaa
             self.rawBytes = rawBytes
 
-    def determineRawBytesWithData(self):
-        return self.structureDescription.instancesToBytes(self.content)
+    def determineRawBytesWithData(self, indexMaker=None):
+        return self.structureDescription.instancesToBytes(self.content, indexMaker)
 
     def bytesRequiredForContent(self):
         return self.structureDescription.countBytesRequiredForInstances(self.content)
 
     def resolveReferences(self, sections):
-        if not self.structureDescription.isPrimitive:
+        if self.structureDescription.hasReferences:
+            resolveReferencesOf = self.structureDescription.resolveReferencesOf
             for object in self.content:
-                object.resolveReferences(sections)
+                resolveReferencesOf(object, sections)
+
+    def markRecordAsModified(self, record):
+        self.modified = True
+        if self.modifiedRecords is not None:
+            self.modifiedRecords.add(record)
+
+    def markContentAsModified(self):
+        self.modified = True
+        self.modifiedRecords = None
+
+    def trackChanges(self):
+        """Lets the objects of the section mark it as modified when they get changed, see loadModel"""
+        content = self.content
+        if isinstance(content, list) and not self.structureDescription.isPrimitive and not isinstance(content, LazySectionList):
+            self.structureDescription.trackInstances(content, self)
+
+
+def importNumpy():
+    """Returns the numpy module or None if it is not installed
+
+    numpy is only needed for the optional numpy array support, so it gets imported on first use and
+    importing m3 doesn't take longer because of it."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def isNumpyArray(value):
+    # Without an imported numpy there can't be any numpy arrays
+    numpy = sys.modules.get("numpy")
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+class TrackedList(list):
+    """A list which marks the section it got loaded from as modified when it gets changed
+
+    loadModel(..., trackChanges=True) uses them for the content of sections, see saveModel."""
+    __slots__ = ("m3Section",)
+
+    def __init__(self, content=(), m3Section=None):
+        list.__init__(self, content)
+        self.m3Section = m3Section
+
+
+def createModificationTrackingListMethod(methodName):
+    listMethod = getattr(list, methodName)
+
+    def modificationTrackingListMethod(self, *args, **kwargs):
+        try:
+            self.m3Section.markContentAsModified()
+        except AttributeError:
+            pass  # not loaded from a section or e.g. a copy which has not been initialized yet
+        return listMethod(self, *args, **kwargs)
+    modificationTrackingListMethod.__name__ = methodName
+    return modificationTrackingListMethod
+
+
+for methodName in [
+        "__setitem__", "__delitem__", "__iadd__", "__imul__",
+        "append", "extend", "insert", "pop", "remove", "sort", "reverse", "clear"]:
+    setattr(TrackedList, methodName, createModificationTrackingListMethod(methodName))
+
+
+class LazySectionList(TrackedList):
+    """A list which decodes the content of a section when it gets accessed for the first time
+
+    loadModel(..., lazy=True) uses one of them per section instead of the decoded content.
+    When it gets decoded, the references of its objects get resolved to further lazy lists.
+    The length is known without decoding the section."""
+    __slots__ = ("section", "sections", "checkExpectedValue")
+
+    def __init__(self, section, sections, checkExpectedValue, trackChanges=False):
+        TrackedList.__init__(self, (), section if trackChanges else None)
+        self.section = section
+        self.sections = sections
+        self.checkExpectedValue = checkExpectedValue
+
+    def materialize(self):
+        section = self.section
+        if section is None:
+            return
+        if profile is not None:
+            startTime = time.perf_counter()
+        content = section.structureDescription.createInstances(section.rawBytes, section.indexEntry.repetitions, self.checkExpectedValue)
+        if profile is not None:
+            profile.addSection("decode", section, startTime, len(section.rawBytes))
+        self.section = None
+        list.extend(self, content)
+        if profile is not None:
+            startTime = time.perf_counter()
+        section.resolveReferences(self.sections)
+        if profile is not None:
+            profile.addSection("resolve", section, startTime, 0)
+        self.sections = None
+        if self.m3Section is not None and not section.structureDescription.isPrimitive:
+            section.structureDescription.trackInstances(content, section)
+
+    def __len__(self):
+        section = self.section
+        if section is not None:
+            return section.indexEntry.repetitions
+        return list.__len__(self)
+
+
+def createMaterializingListMethod(methodName):
+    listMethod = getattr(TrackedList, methodName)
+
+    def materializingListMethod(self, *args, **kwargs):
+        self.materialize()
+        for argument in args:
+            if isinstance(argument, LazySectionList):
+                argument.materialize()
+        return listMethod(self, *args, **kwargs)
+    materializingListMethod.__name__ = methodName
+    return materializingListMethod
+
+
+for methodName in [
+        "__getitem__", "__setitem__", "__delitem__", "__iter__", "__reversed__", "__contains__", "__repr__",
+        "__eq__", "__ne__", "__lt__", "__le__", "__gt__", "__ge__", "__add__", "__iadd__", "__mul__", "__rmul__", "__imul__",
+        "append", "extend", "insert", "pop", "remove", "index", "count", "sort", "reverse", "clear", "copy"]:
+    setattr(LazySectionList, methodName, createMaterializingListMethod(methodName))
 
 
 primitiveFieldTypeSizes = {"uint32": 4, "int32": 4, "uint16": 2, "int16": 2, "uint8": 1, "int8": 1, "float": 4, "tag": 4, "fixed8": 1}
 primitiveFieldTypeFormats = {"uint32": "I", "int32": "i", "uint16": "H", "int16": "h", "uint8": "B", "int8": "b", "float": "f", "tag": "4s", "fixed8": "B"}
+primitiveFieldTypeNumpyFormats = {"uint32": "<u4", "int32": "<i4", "uint16": "<u2", "int16": "<i2", "uint8": "u1", "int8": "i1", "float": "<f4", "tag": "S4", "fixed8": "u1"}
 intTypes = {"uint32", "int32", "uint16", "int16", "uint8", "int8"}
 
 structureNamesOfPrimitiveTypes = set(["CHAR", "U8__", "REAL", "I16_", "U16_", "I32_", "U32_", "FLAG"])
 
+generatedFunctionNames = {
+    "assignFields", "readInstances", "writeInstance", "writeInstances", "writeInstanceReferencing", "writeInstancesReferencing",
+    "introduceIndexReferencesOf", "collectIndexReferencesOf", "resolveReferencesOf", "trackInstances",
+    "hasValidStructure", "hasValidContent"}
+
+validationLevels = ("none", "structural", "full")
+
 
 class M3StructureHistory:
-    "Describes the history of a structure with a specific name"
+    """Describes the history of a structure with a specific name
+
+    When allFields is None, the fields get created from fieldDataMaps on first use.
+    Descriptions of the versions get created on demand; use validateSchema to check all of them."""
 
-    def __init__(self, name, versionToSizeMap, allFields):
+    def __init__(self, name, versionToSizeMap, allFields, fieldDataMaps=None, structures=None):
         self.name = name
         self.versionToSizeMap = versionToSizeMap
-        self.allFields = allFields
+        if allFields is not None:
+            self.allFields = allFields
+        self.fieldDataMaps = fieldDataMaps
+        self.structures = structures
         self.versionToStructureDescriptionMap = {}
         self.isPrimitive = self.name in structureNamesOfPrimitiveTypes
-        # Create all to check sizes:
-        for version in versionToSizeMap:
-            self.getVersion(version)
+
+    def __getattr__(self, name):
+        if name == "allFields":
+            self.allFields = [createField(self.structures, self.name, fieldDataMap) for fieldDataMap in self.fieldDataMaps]
+            return self.allFields
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def validate(self):
+        """Creates the descriptions of all versions to check their sizes"""
+        for version in self.versionToSizeMap:
+            for fmagic in ("MD34", "MD33"):
+                self.getVersion(version, fmagic)
 
     def createStructureDescription(self, version, usedFields, specifiedSize, fmagic):
         finalFields = []
@@ -122,12 +286,16 @@ class M3StructureHistory:
                         newDescription = newStructureHistory.getVersion(0, fmagic)
                         field.referenceStructureDescription = newDescription
                         field.size = newDescription.size
+                        field.structFormatString = newDescription.structFormatString
+                        field.valueCount = newDescription.valueCount
                 elif self.name == 'MODL' and field.name == 'tightHitTest':
                     field = copy.copy(field)
                     newStructureHistory = structures[field.structureDescription.structureName]
                     newDescription = newStructureHistory.getVersion(1, fmagic)
                     field.structureDescription = newDescription
                     field.size = newDescription.size
+                    field.structFormatString = newDescription.structFormatString
+                    field.valueCount = newDescription.valueCount
                 finalFields.append(field)
         else:
             finalFields = usedFields
@@ -153,6 +321,16 @@ class M3StructureHistory:
             self.versionToStructureDescriptionMap[fmagic + '_' + str(version)] = structure
         return structure
 
+    def getVersionOfNumpyDtype(self, dtype):
+        """Returns the version the dtype has been created for or the newest version with an equal dtype or None"""
+        if dtype.metadata is not None and dtype.metadata.get("structureName") == self.name:
+            return self.getVersion(dtype.metadata["structureVersion"])
+        for version in sorted(self.versionToSizeMap, reverse=True):
+            structureDescription = self.getVersion(version)
+            if structureDescription.numpyDtype == dtype:
+                return structureDescription
+        return None
+
     def getNewestVersion(self):
         newestVersion = None
         for version in self.versionToSizeMap.keys():
@@ -197,31 +375,148 @@ class M3StructureDescription:
                 raise Exception("%s contains in version %s multiple fields with the name %s" % (structureName, structureVersion, field.name))
             nameToFieldMap[field.name] = field
         self.nameToFieldMap = nameToFieldMap
+        self.initStructFormat()
+        self.structureClass = createStructureClass(self)
+
+    def __getattr__(self, name):
+        # The generated functions get created when one of them is needed for the first time
+        if name in generatedFunctionNames:
+            self.generateFunctions()
+            return self.__dict__[name]
+        if name == "numpyDtype":
+            self.numpyDtype = self.createNumpyDtype()
+            return self.numpyDtype
+        if name == "referenceStruct":
+            self.referenceStruct = struct.Struct("<" + self.createReferenceStructFormatString())
+            return self.referenceStruct
+        if name == "referenceFieldPaths":
+            self.referenceFieldPaths = self.createReferenceFieldPaths()
+            return self.referenceFieldPaths
+        if name == "trackedStructureClass":
+            self.trackedStructureClass = createTrackedStructureClass(self)
+            return self.trackedStructureClass
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+    def initStructFormat(self):
+        """Combines the formats of all fields, including embedded structures and references, into one struct.Struct"""
+        structFormatString = ""
+        valueCount = 0
+        hasReferences = False
+        for field in self.fields:
+            structFormatString += field.structFormatString
+            valueCount += field.valueCount
+            if isinstance(field, ReferenceField):
+                hasReferences = True
+            elif isinstance(field, EmbeddedStructureField) and field.structureDescription.hasReferences:
+                hasReferences = True
+        self.structFormatString = structFormatString
+        self.structFormat = struct.Struct("<" + structFormatString)
+        self.valueCount = valueCount
+        self.hasReferences = hasReferences
+        assert self.structFormat.size == self.size
+
+    def generateFunctions(self):
+        generator = StructureFunctionGenerator(self)
+        functions = generator.generate()
+        self.generatedSource = generator.source
+        self.assignFields = functions["assignFields"]
+        self.readInstances = functions["readInstances"]
+        self.writeInstance = functions["writeInstance"]
+        self.writeInstances = functions["writeInstances"]
+        self.writeInstanceReferencing = functions["writeInstanceReferencing"]
+        self.writeInstancesReferencing = functions["writeInstancesReferencing"]
+        self.introduceIndexReferencesOf = functions["introduceIndexReferences"]
+        self.collectIndexReferencesOf = functions["collectIndexReferences"]
+        self.resolveReferencesOf = functions["resolveReferences"]
+        self.trackInstances = functions["trackInstances"]
+        self.hasValidStructure = functions["hasValidStructure"]
+        self.hasValidContent = functions["hasValidContent"]
+
+    def createNumpyDtype(self):
+        """Creates a numpy dtype with the memory layout of the structure
+
+        Fixed8 values stay raw uint8 values and tags raw 4 byte strings. Since versions can have the same layout,
+        the structure name and version are stored as dtype metadata.
+        Returns None for CHAR and for structures with references, since they are no plain records."""
+        np = importNumpy()
+        if np is None:
+            raise Exception("numpy is required to represent %sV%s instances as numpy arrays" % (self.structureName, self.structureVersion))
+        if self.hasReferences or self.structureName == "CHAR":
+            return None
+        metadata = {"structureName": self.structureName, "structureVersion": self.structureVersion}
+        if self.isPrimitive:
+            return np.dtype(self.fields[0].numpyFormat(), metadata=metadata)
+        names = []
+        formats = []
+        offsets = []
+        offset = 0
+        for field in self.fields:
+            names.append(field.name)
+            formats.append(field.numpyFormat())
+            offsets.append(offset)
+            offset += field.size
+        return np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": self.size}, metadata=metadata)
+
+    def createArray(self, buffer, count):
+        """Returns a numpy array of count instances which uses the memory of buffer without copying it
+
+        The array is read only if the buffer is, e.g. for bytes objects and memory mapped files."""
+        return importNumpy().frombuffer(buffer, dtype=self.numpyDtype, count=count)
+
+    def createReferenceStructFormatString(self):
+        """Returns a struct format, which unpacks only the entries and index values of the references"""
+        formatString = ""
+        for field in self.fields:
+            if isinstance(field, ReferenceField):
+                formatString += "II%dx" % (field.size - 8)
+            elif isinstance(field, EmbeddedStructureField) and field.structureDescription.hasReferences:
+                formatString += field.structureDescription.createReferenceStructFormatString()
+            else:
+                formatString += "%dx" % field.size
+        return formatString
+
+    def createReferenceFieldPaths(self, prefix=""):
+        """Returns the paths of the reference fields in the order of the values unpacked by referenceStruct, like name or layer.imagePath"""
+        fieldPaths = []
+        for field in self.fields:
+            if isinstance(field, ReferenceField):
+                fieldPaths.append(prefix + field.name)
+            elif isinstance(field, EmbeddedStructureField) and field.structureDescription.hasReferences:
+                fieldPaths.extend(field.structureDescription.createReferenceFieldPaths(prefix + field.name + "."))
+        return fieldPaths
+
+    def getReferencedSectionIndices(self, buffer, count):
+        """Returns the sorted indices of the sections referenced by count instances in the buffer, without decoding them"""
+        referencedSectionIndices = set()
+        for values in self.referenceStruct.iter_unpack(memoryview(buffer)[:count * self.size]):
+            for valueIndex in range(0, len(values), 2):
+                if values[valueIndex] != 0:
+                    referencedSectionIndices.add(values[valueIndex + 1])
+        return sorted(referencedSectionIndices)
+
+    def allocateInstance(self):
+        """Creates an instance without initializing its fields"""
+        instance = self.structureClass.__new__(self.structureClass)
+        instance.structureDescription = self
+        return instance
 
     def createInstance(self, buffer=None, offset=0, checkExpectedValue=True):
-        return M3Structure(self, buffer, offset, checkExpectedValue)
+        return self.structureClass(self, buffer, offset, checkExpectedValue)
 
     def createInstances(self, buffer, count, checkExpectedValue=True):
         if self.isPrimitive:
             if self.structureName == "CHAR":
-                return buffer[:count - 1].decode("ASCII", "replace")
+                return str(buffer[:count - 1], "ASCII", "replace")
             elif self.structureName == "U8__":
                 return bytearray(buffer[:count])
             else:
-                structFormat = self.fields[0].structFormat
-                list = []
-                for offset in range(0, count * self.size, self.size):
-                    bytesOfOneEntry = buffer[offset:(offset + self.size)]
-                    intValue = structFormat.unpack(bytesOfOneEntry)[0]
-                    list.append(intValue)
-                return list
+                arrayFormat = struct.Struct("<%d%s" % (count, self.structFormatString))
+                return list(arrayFormat.unpack_from(buffer, 0))
         else:
-            list = []
-            instanceOffset = 0
-            for i in range(count):
-                list.append(self.createInstance(buffer=buffer, offset=instanceOffset, checkExpectedValue=checkExpectedValue))
-                instanceOffset += self.size
-            return list
+            try:
+                return self.readInstances(buffer, count, checkExpectedValue)
+            except struct.error as e:
+                raise Exception('failed to unpack %s instances of %sV%s' % (count, self.structureName, self.structureVersion), e)
 
     def dumpOffsets(self):
         offset = 0
@@ -240,41 +535,91 @@ class M3StructureDescription:
         else:
             raise Exception("Can't measure the length of %s which is a %s" % (instances, self.structureName))
 
-    def validateInstance(self, instance, instanceName):
-        for field in self.fields:
+    def validateInstance(self, instance, instanceName, validateReferencedObjects=True, level="full"):
+        """Raises an exception if the instance is invalid, see validateInstances"""
+        self.validateInstances((instance,), instanceName, validateReferencedObjects, level, isList=False)
+
+    def validateInstances(self, instances, instancesName, validateReferencedObjects=True, level="full", isList=True):
+        """Raises an exception if one of the instances is invalid
+
+        With validateReferencedObjects=False the objects in referenced lists don't get validated.
+        level is one of validationLevels: "none" checks nothing, "structural" only the types of references, tags and
+        bytes and "full" also the values of all fields. The instances get checked at once by the generated functions
+        hasValidStructure or hasValidContent; only if they find a problem the fields get checked one by one to report it."""
+        if level == "full":
+            if self.hasValidContent(instances, validateReferencedObjects):
+                return
+        elif level == "structural":
+            if self.hasValidStructure(instances, validateReferencedObjects):
+                return
+        elif level == "none":
+            return
+        else:
+            raise Exception("Unknown validation level %s, expected one of %s" % (level, validationLevels))
+        for instanceIndex, instance in enumerate(instances):
+            instanceName = "%s[%d]" % (instancesName, instanceIndex) if isList else instancesName
+            self.validateFields(instance, instanceName, self.fields, validateReferencedObjects, level)
+
+    def validateFields(self, instance, instanceName, fields, validateReferencedObjects=True, level="full"):
+        """Checks the given fields of the instance one by one and raises an exception for the first invalid one"""
+        for field in fields:
             try:
                 fieldContent = getattr(instance, field.name)
             except AttributeError:
                 raise Exception("%s does not have a field called %s" % (instanceName, field.name))
-                raise
-            field.validateContent(fieldContent, instanceName + "." + field.name)
+            if level != "full" and isinstance(field, PrimitiveField):
+                continue
+            if isinstance(field, (StructureReferenceField, EmbeddedStructureField)):
+                field.validateContent(fieldContent, instanceName + "." + field.name, validateReferencedObjects, level)
+            else:
+                field.validateContent(fieldContent, instanceName + "." + field.name)
 
     def hasField(self, fieldName):
         return fieldName in self.nameToFieldMap
 
-    def instancesToBytes(self, instances):
+    def instancesToBytes(self, instances, indexMaker=None):
+        """Returns the bytes of the instances
+
+        If indexMaker is given, the index references of reference fields get taken from it, see saveModel"""
         if self.structureName == "CHAR":
             if type(instances) != str:
                 raise Exception("Expected a string but it was a %s" % type(instances))
             return instances.encode("ASCII") + b'\x00'
+        elif isNumpyArray(instances):
+            if instances.dtype != self.numpyDtype:
+                raise Exception("Expected an array of %s but it was an array of %s" % (self.numpyDtype, instances.dtype))
+            return bytearray(instances.tobytes())
         elif self.structureName == "U8__":
             if type(instances) != bytes and type(instances) != bytearray:
                 raise Exception("Expected a byte array but it was a %s" % type(instances))
             return instances
         else:
             rawBytes = bytearray(self.size * len(instances))
-            offset = 0
+            self.writeInstancesToBuffer(instances, rawBytes, 0, indexMaker)
+            return rawBytes
 
-            if self.isPrimitive:
-                structFormat = self.fields[0].structFormat
-                for value in instances:
-                    structFormat.pack_into(rawBytes, offset, value)
-                    offset += self.size
-            else:
+    def writeInstancesToBuffer(self, instances, buffer, offset, indexMaker=None):
+        """Writes the instances like instancesToBytes at offset into buffer and returns the number of written bytes"""
+        if self.structureName == "CHAR" or self.structureName == "U8__" or isNumpyArray(instances):
+            rawBytes = self.instancesToBytes(instances)
+            buffer[offset:offset + len(rawBytes)] = rawBytes
+            return len(rawBytes)
+
+        if self.isPrimitive:
+            arrayFormat = struct.Struct("<%d%s" % (len(instances), self.structFormatString))
+            arrayFormat.pack_into(buffer, offset, *instances)
+        elif indexMaker is not None and self.hasReferences:
+            self.writeInstancesReferencing(instances, buffer, offset, indexMaker)
+        else:
+            try:
+                self.writeInstances(instances, buffer, offset)
+            except struct.error:
+                # Write instance by instance to find out which field is the cause:
                 for value in instances:
-                    value.writeToBuffer(rawBytes, offset)
+                    value.writeToBuffer(buffer, offset)
                     offset += self.size
-            return rawBytes
+                raise
+        return self.size * len(instances)
 
     def countBytesRequiredForInstances(self, instances):
         if self.structureName == "CHAR":
@@ -282,7 +627,316 @@ class M3StructureDescription:
         return self.size * self.countInstances(instances)
 
 
+def reportUnexpectedValue(structureDescription, field, buffer, offset, checkExpectedValue):
+    """Lets the field itself raise the exception about the unexpected value"""
+    field.readFromBuffer(structureDescription.allocateInstance(), buffer, offset, checkExpectedValue)
+    raise Exception("Field %s of %s (V. %d) has an unexpected value" % (field.name, structureDescription.structureName, structureDescription.structureVersion))
+
+
+class StructureFunctionGenerator:
+    """Generates functions which read, write and link all fields of a structure description inline
+
+    Embedded structures and references get flattened, so that a record can be processed
+    with a single struct call and without dispatching to the field objects."""
+
+    def __init__(self, structureDescription):
+        self.structureDescription = structureDescription
+        self.namespace = {
+            "memoryview": memoryview,
+            "bytesToTag": TagField.bytesToTag,
+            "tagToBytes": TagField.tagToBytes,
+            "fixed8ToFloat": Fixed8Field.intToFloat,
+            "floatToFixed8": Fixed8Field.floatToInt,
+            "M3Structure": M3Structure,
+            "isNumpyArray": isNumpyArray,
+            "floatTypeSet": frozenset([float]),
+            "intTypeSet": frozenset([int]),
+            "reportUnexpectedValue": reportUnexpectedValue,
+            "structFormat": structureDescription.structFormat,
+        }
+        self.constantIdToNameMap = {}
+        self.nestedVariableCounter = 0
+        self.source = None
+
+    def constant(self, value):
+        name = self.constantIdToNameMap.get(id(value))
+        if name is None:
+            name = "c%d" % len(self.constantIdToNameMap)
+            self.constantIdToNameMap[id(value)] = name
+            self.namespace[name] = value
+        return name
+
+    def nextNestedVariable(self):
+        self.nestedVariableCounter += 1
+        return "n%d" % self.nestedVariableCounter
+
+    @staticmethod
+    def nestedDescriptionOf(field):
+        if isinstance(field, EmbeddedStructureField):
+            return field.structureDescription
+        elif isinstance(field, ReferenceField):
+            return field.referenceStructureDescription
+        return None
+
+    def addReadLines(self, structureDescription, instanceVariable, valueIndex, byteOffset, lines, checkLines):
+        for field in structureDescription.fields:
+            if not field.name.isidentifier():
+                raise Exception("The field name %s of %s is not a valid identifier" % (field.name, structureDescription.structureName))
+            nestedDescription = self.nestedDescriptionOf(field)
+            if nestedDescription is not None:
+                nestedVariable = self.nextNestedVariable()
+                lines.append("%s = new(%s)" % (nestedVariable, self.constant(nestedDescription.structureClass)))
+                lines.append("%s.structureDescription = %s" % (nestedVariable, self.constant(nestedDescription)))
+                self.addReadLines(nestedDescription, nestedVariable, valueIndex, byteOffset, lines, checkLines)
+                lines.append("%s.%s = %s" % (instanceVariable, field.name, nestedVariable))
+            else:
+                valueVariable = "v%d" % valueIndex
+                condition = field.unexpectedValueCondition(valueVariable, self.constant(getattr(field, "expectedValue", None)))
+                if condition is not None:
+                    checkLines.append("if %s:" % condition)
+                    checkLines.append("    reportUnexpectedValue(%s, %s, buffer, offset + %d, checkExpectedValue)" % (self.constant(structureDescription), self.constant(field), byteOffset))
+                lines.append("%s.%s = %s" % (instanceVariable, field.name, field.readExpression(valueVariable)))
+            valueIndex += field.valueCount
+            byteOffset += field.size
+
+    def addWriteLines(self, structureDescription, instanceVariable, lines, expressions, referencing=False):
+        """With referencing=True the index references get looked up with indexMaker instead of being stored in the fields"""
+        for field in structureDescription.fields:
+            attributeExpression = "%s.%s" % (instanceVariable, field.name)
+            nestedDescription = self.nestedDescriptionOf(field)
+            if nestedDescription is not None:
+                nestedVariable = self.nextNestedVariable()
+                if referencing and isinstance(field, ReferenceField):
+                    lines.append("%s = indexMaker.getExistingIndexReferenceTo(%s, %s)" % (nestedVariable, attributeExpression, self.constant(nestedDescription)))
+                else:
+                    lines.append("%s = %s" % (nestedVariable, attributeExpression))
+                self.addWriteLines(nestedDescription, nestedVariable, lines, expressions, referencing)
+            else:
+                expressions.append(field.writeExpression(attributeExpression))
+
+    def addReferenceLines(self, structureDescription, instanceVariable, methodName, argumentName, lines):
+        for field in structureDescription.fields:
+            if isinstance(field, ReferenceField):
+                lines.append("%s.%s(%s, %s)" % (self.constant(field), methodName, instanceVariable, argumentName))
+            elif isinstance(field, EmbeddedStructureField) and field.structureDescription.hasReferences:
+                nestedVariable = self.nextNestedVariable()
+                lines.append("%s = %s.%s" % (nestedVariable, instanceVariable, field.name))
+                self.addReferenceLines(field.structureDescription, nestedVariable, methodName, argumentName, lines)
+
+    def addTrackLines(self, structureDescription, instanceVariable, lines):
+        for field in structureDescription.fields:
+            if isinstance(field, EmbeddedStructureField):
+                nestedVariable = self.nextNestedVariable()
+                lines.append("%s = %s.%s" % (nestedVariable, instanceVariable, field.name))
+                lines.append("%s.m3Owner = instance" % nestedVariable)
+                self.addTrackLines(field.structureDescription, nestedVariable, lines)
+            elif isinstance(field, ReferenceField):
+                # Empty lists and byte arrays don't belong to a section, so the section of the owner must check them.
+                # Fields of a model loaded with fields=[...] can also still contain index references.
+                lines.append("referencedObjects = %s.%s" % (instanceVariable, field.name))
+                lines.append("if referencedObjects is not None and not isinstance(referencedObjects, M3Structure) and len(referencedObjects) == 0:")
+                lines.append("    emptyReferencedObjects.append(referencedObjects)")
+        lines.append("%s.__class__ = %s" % (instanceVariable, self.constant(structureDescription.trackedStructureClass)))
+
+    def addValidationLines(self, structureDescription, instanceVariable, lines, fullValidation):
+        """Adds lines which return False if an instance is invalid; they get only executed in a try block for AttributeError"""
+        for field in structureDescription.fields:
+            valueVariable = self.nextNestedVariable()
+            # Accessing the field checks also that it exists
+            lines.append("%s = %s.%s" % (valueVariable, instanceVariable, field.name))
+            if isinstance(field, EmbeddedStructureField):
+                self.addValidationLines(field.structureDescription, valueVariable, lines, fullValidation)
+            elif isinstance(field, StructureReferenceField):
+                firstItemVariable = self.nextNestedVariable()
+                lines.append("if isinstance(%s, list):" % valueVariable)
+                lines.append("    if len(%s) > 0:" % valueVariable)
+                lines.append("        %s = %s[0]" % (firstItemVariable, valueVariable))
+                lines.append("        if not isinstance(%s, M3Structure) or %s.structureDescription.history is not %s:" % (firstItemVariable, firstItemVariable, self.constant(field.historyOfReferencedStructures)))
+                lines.append("            return False")
+                lines.append("        if validateReferencedObjects and not %s.structureDescription.%s(%s, True):" % (firstItemVariable, "hasValidContent" if fullValidation else "hasValidStructure", valueVariable))
+                lines.append("            return False")
+                lines.append("elif not (isNumpyArray(%s) and %s.hasValidNumpyArray(%s)):" % (valueVariable, self.constant(field), valueVariable))
+                lines.append("    return False")
+            else:
+                condition = field.validCondition(valueVariable, self.constant, fullValidation)
+                if condition is not None:
+                    lines.append("if not (%s):" % condition)
+                    lines.append("    return False")
+
+    @staticmethod
+    def indented(lines, level):
+        prefix = "    " * level
+        return [prefix + line for line in lines]
+
+    def generate(self):
+        structureDescription = self.structureDescription
+        valueVariables = ["v%d" % i for i in range(structureDescription.valueCount)]
+        unpackLine = "%s, = values" % ", ".join(valueVariables)
+        source = []
+
+        readLines = []
+        checkLines = []
+        self.addReadLines(structureDescription, "instance", 0, 0, readLines, checkLines)
+        source.append("def assignFields(instance, values, buffer, offset, checkExpectedValue):")
+        source.extend(self.indented([unpackLine] + checkLines + readLines, 1))
+        source.append("")
+        source.append("def readInstances(buffer, count, checkExpectedValue):")
+        source.extend(self.indented([
+            "instances = []",
+            "append = instances.append",
+            "offset = 0",
+            "for values in structFormat.iter_unpack(memoryview(buffer)[:count * %d]):" % structureDescription.size,
+            "    instance = new(%s)" % self.constant(structureDescription.structureClass),
+            "    instance.structureDescription = %s" % self.constant(structureDescription),
+            "    assignFields(instance, values, buffer, offset, checkExpectedValue)",
+            "    append(instance)",
+            "    offset += %d" % structureDescription.size,
+            "return instances"], 1))
+        source.append("")
+
+        writeLines = []
+        expressions = []
+        self.addWriteLines(structureDescription, "instance", writeLines, expressions)
+        source.append("def writeInstance(instance, buffer, offset):")
+        source.extend(self.indented(writeLines + ["pack_into(buffer, offset, %s)" % ", ".join(expressions)], 1))
+        source.append("")
+        source.append("def writeInstances(instances, buffer, offset):")
+        source.extend(self.indented([
+            "for instance in instances:",
+            "    writeInstance(instance, buffer, offset)",
+            "    offset += %d" % structureDescription.size], 1))
+        source.append("")
+
+        writeLines = []
+        expressions = []
+        self.addWriteLines(structureDescription, "instance", writeLines, expressions, referencing=True)
+        source.append("def writeInstanceReferencing(instance, buffer, offset, indexMaker):")
+        source.extend(self.indented(writeLines + ["pack_into(buffer, offset, %s)" % ", ".join(expressions)], 1))
+        source.append("")
+        source.append("def writeInstancesReferencing(instances, buffer, offset, indexMaker):")
+        source.extend(self.indented([
+            "for instance in instances:",
+            "    writeInstanceReferencing(instance, buffer, offset, indexMaker)",
+            "    offset += %d" % structureDescription.size], 1))
+        source.append("")
+
+        for functionName, methodName, argumentName in [
+                ("introduceIndexReferences", "introduceIndexReferences", "indexMaker"),
+                ("collectIndexReferences", "collectIndexReferences", "indexMaker"),
+                ("resolveReferences", "resolveIndexReferences", "sections")]:
+            lines = []
+            self.addReferenceLines(structureDescription, "instance", methodName, argumentName, lines)
+            source.append("def %s(instance, %s):" % (functionName, argumentName))
+            source.extend(self.indented(lines + ["pass"], 1))
+            source.append("")
+
+        trackLines = ["instance.m3Owner = section"]
+        self.addTrackLines(structureDescription, "instance", trackLines)
+        source.append("def trackInstances(instances, section):")
+        source.extend(self.indented([
+            "emptyReferencedObjects = section.emptyReferencedObjects",
+            "for instance in instances:"] + self.indented(trackLines, 1), 1))
+        source.append("")
+
+        for functionName, fullValidation in [("hasValidStructure", False), ("hasValidContent", True)]:
+            validationLines = []
+            self.addValidationLines(structureDescription, "instance", validationLines, fullValidation)
+            source.append("def %s(instances, validateReferencedObjects):" % functionName)
+            source.extend(self.indented([
+                "try:",
+                "    for instance in instances:"] + self.indented(validationLines + ["pass"], 2) + [
+                "except AttributeError:",
+                "    return False",
+                "return True"], 1))
+            source.append("")
+
+        self.namespace["new"] = M3Structure.__new__
+        self.namespace["pack_into"] = structureDescription.structFormat.pack_into
+        self.source = "\n".join(source)
+        fileName = "<m3 %sV%d>" % (structureDescription.structureName, structureDescription.structureVersion)
+        exec(compileGeneratedSource(self.source, fileName), self.namespace)
+        return self.namespace
+
+
+def compileGeneratedSource(source, fileName):
+    """Returns the code object of generated source, which gets cached in generatedCodeCacheDirectory
+
+    Compiling the generated functions takes most of the time of the first load of a model in a new process.
+    The cache files are named after a hash of the source and of the Python bytecode version, so a changed
+    structures.xml or generator simply leads to new cache files. The least recently used files get removed
+    when the cache gets bigger than generatedCodeCacheMaxSize bytes."""
+    if generatedCodeCacheDirectory is None:
+        return compile(source, fileName, "exec")
+    key = hashlib.sha1(importlib.util.MAGIC_NUMBER + fileName.encode("utf-8") + b"\0" + source.encode("utf-8")).hexdigest()
+    cachePath = os.path.join(generatedCodeCacheDirectory, key + ".code")
+    try:
+        with open(cachePath, "rb") as cacheFile:
+            code = marshal.loads(cacheFile.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        code = None  # not cached yet or broken cache file
+    if code is not None:
+        try:
+            os.utime(cachePath)  # the modification time tells when the file got used last
+        except OSError:
+            pass  # e.g. a read only cache of an addon installed for all users
+        return code
+
+    code = compile(source, fileName, "exec")
+    temporaryCachePath = "%s.%d.tmp" % (cachePath, os.getpid())
+    try:
+        data = marshal.dumps(code)
+        os.makedirs(generatedCodeCacheDirectory, exist_ok=True)
+        with open(temporaryCachePath, "wb") as cacheFile:
+            cacheFile.write(data)
+        os.replace(temporaryCachePath, cachePath)
+        addToGeneratedCodeCacheSize(len(data))
+    except OSError:
+        # e.g. the addon directory is not writable, the cache is optional
+        try:
+            os.remove(temporaryCachePath)
+        except OSError:
+            pass
+    return code
+
+
+generatedCodeCacheSizeEstimate = None
+
+
+def addToGeneratedCodeCacheSize(addedSize):
+    """Removes the least recently used files of the generated code cache when it got bigger than generatedCodeCacheMaxSize
+
+    The size of the cache directory gets determined once and is then tracked while files get added."""
+    global generatedCodeCacheSizeEstimate
+    if generatedCodeCacheSizeEstimate is not None:
+        generatedCodeCacheSizeEstimate += addedSize
+        if generatedCodeCacheSizeEstimate <= generatedCodeCacheMaxSize:
+            return
+    cacheFiles = []
+    for entry in os.scandir(generatedCodeCacheDirectory):
+        if entry.name.endswith(".code") and entry.is_file():
+            fileStat = entry.stat()
+            cacheFiles.append((fileStat.st_mtime, fileStat.st_size, entry.path))
+    cacheFiles.sort()
+    cacheSize = sum(fileSize for lastUsed, fileSize, path in cacheFiles)
+    if cacheSize > generatedCodeCacheMaxSize:
+        # Removes files until the cache is at most 3/4 full, so that this doesn't happen for every new file
+        for lastUsed, fileSize, path in cacheFiles:
+            if cacheSize <= generatedCodeCacheMaxSize * 3 // 4:
+                break
+            try:
+                os.remove(path)
+                cacheSize -= fileSize
+            except OSError:
+                pass
+    generatedCodeCacheSizeEstimate = cacheSize
+
+
 class M3Structure:
+    """Base class of the structure classes, which get created for each structure description by createStructureClass
+
+    The slot m3Owner is only used by the instances of the tracked structure classes and by loaded models. It contains
+    the section of a record or, for embedded structures, the record which contains them."""
+    __slots__ = ("structureDescription", "m3Owner")
 
     def __init__(self, structureDescription: M3StructureDescription, buffer=None, offset=0, checkExpectedValue=True):
         self.structureDescription = structureDescription
@@ -294,27 +948,37 @@ class M3Structure:
                 field.setToDefault(self)
 
     def introduceIndexReferences(self, indexMaker):
-        for field in self.structureDescription.fields:
-            field.introduceIndexReferences(self, indexMaker)
+        self.structureDescription.introduceIndexReferencesOf(self, indexMaker)
+
+    def collectIndexReferences(self, indexMaker):
+        self.structureDescription.collectIndexReferencesOf(self, indexMaker)
 
     def resolveReferences(self, sections):
-        for field in self.structureDescription.fields:
-            field.resolveIndexReferences(self, sections)
+        self.structureDescription.resolveReferencesOf(self, sections)
 
     def readFromBuffer(self, buffer, offset, checkExpectedValue):
-        fieldOffset = offset
-        for field in self.structureDescription.fields:
-            try:
-                field.readFromBuffer(self, buffer, fieldOffset, checkExpectedValue)
-            except struct.error as e:
-                raise Exception('failed to unpack %sV%s %s' % (self.structureDescription.structureName, self.structureDescription.structureVersion, field.name), e)
-            fieldOffset += field.size
-        assert fieldOffset - offset == self.structureDescription.size
+        structureDescription = self.structureDescription
+        try:
+            values = structureDescription.structFormat.unpack_from(buffer, offset)
+        except struct.error as e:
+            raise Exception('failed to unpack %sV%s' % (structureDescription.structureName, structureDescription.structureVersion), e)
+        structureDescription.assignFields(self, values, buffer, offset, checkExpectedValue)
 
     def writeToBuffer(self, buffer, offset):
+        try:
+            self.structureDescription.writeInstance(self, buffer, offset)
+        except struct.error:
+            # Write field by field to find out which field is the cause:
+            self.writeFieldByField(buffer, offset)
+            raise
+
+    def writeFieldByField(self, buffer, offset):
         fieldOffset = offset
         for field in self.structureDescription.fields:
-            field.writeToBuffer(self, buffer, fieldOffset)
+            try:
+                field.writeToBuffer(self, buffer, fieldOffset)
+            except struct.error as e:
+                raise Exception('failed to pack %sV%s %s' % (self.structureDescription.structureName, self.structureDescription.structureVersion, field.name), e)
             fieldOffset += field.size
         assert fieldOffset - offset == self.structureDescription.size
 
@@ -337,6 +1001,95 @@ class M3Structure:
         return field.getBitNameMaskPairs()
 
 
+def createStructureFromFieldValues(structureDescription, fieldValues):
+    instance = structureDescription.allocateInstance()
+    for field, value in zip(structureDescription.fields, fieldValues):
+        setattr(instance, field.name, value)
+    return instance
+
+
+tableColumnsCache = {}
+
+
+def determineTableColumns(structureDescription):
+    """Returns the columns of a structure which can be written as table or None
+
+    That's possible for structures without references and tags. The columns are the paths of the
+    primitive and byte fields, e.g. "position.x" for embedded structures. The compact layout of
+    m3ToXml.py and xmlToM3.py use it to agree on the columns of a table."""
+    if structureDescription in tableColumnsCache:
+        return tableColumnsCache[structureDescription]
+    columns = []
+
+    def addColumns(description, prefix):
+        for field in description.fields:
+            if isinstance(field, EmbeddedStructureField):
+                if not addColumns(field.structureDescription, prefix + field.name + "."):
+                    return False
+            elif isinstance(field, (PrimitiveField, UnknownBytesField)):
+                columns.append(prefix + field.name)
+            else:
+                return False
+        return True
+
+    if structureDescription.hasReferences or not addColumns(structureDescription, ""):
+        columns = None
+    tableColumnsCache[structureDescription] = columns
+    return columns
+
+
+def formatTableValue(value):
+    """Formats a number or bytes value of a table or list of numbers, so that it can be parsed again by the parser of createTableValueParser"""
+    valueType = type(value)
+    if valueType == int:
+        return hex(value)
+    elif valueType == bytearray or valueType == bytes:
+        return "0x" + bytes(value).hex()
+    return str(value)
+
+
+def parseHexTableValue(value):
+    if not value.startswith("0x"):
+        raise Exception('hex string "%s" does not start with 0x' % value)
+    return bytes.fromhex(value[2:])
+
+
+def createTableValueParser(field):
+    """Returns a function which parses the values of a column, which got formatted with formatTableValue"""
+    if isinstance(field, UnknownBytesField):
+        return parseHexTableValue
+    elif field.typeString == "float" or field.typeString == "fixed8":
+        return float  # fixed8 values are floats in the model too, see Fixed8Field
+    return lambda value: int(value, 0)
+
+
+def createStructureClass(structureDescription):
+    """Creates a class with a slot for each field, so that instances don't need a __dict__"""
+    className = "%sV%d" % (structureDescription.structureName, structureDescription.structureVersion)
+    slots = tuple(field.name for field in structureDescription.fields)
+    return type(className, (M3Structure,), {"__slots__": slots, "__module__": __name__})
+
+
+def setAttributeOfTrackedStructure(self, name, value):
+    object.__setattr__(self, name, value)
+    try:
+        owner = self.m3Owner
+    except AttributeError:
+        return  # e.g. a copy which has not been initialized yet
+    if isinstance(owner, Section):
+        owner.markRecordAsModified(self)
+    else:
+        owner.m3Owner.markRecordAsModified(owner)
+
+
+def createTrackedStructureClass(structureDescription):
+    """Creates a subclass of the structure class, whose instances mark their section as modified when a field gets set
+
+    Loaded instances get this class assigned by the generated trackInstances function, after their references got resolved."""
+    structureClass = structureDescription.structureClass
+    return type(structureClass.__name__, (structureClass,), {"__slots__": (), "__module__": __name__, "__setattr__": setAttributeOfTrackedStructure})
+
+
 class Field:
     def __init__(self, name, sinceVersion, tillVersion):
         self.name = name
@@ -346,33 +1099,71 @@ class Field:
     def introduceIndexReferences(self, owner, indexMaker):
         pass
 
+    def collectIndexReferences(self, owner, indexMaker):
+        pass
+
     def resolveIndexReferences(self, owner, sections):
         pass
 
+    # The following methods return Python source code snippets for the StructureFunctionGenerator
+
+    def readExpression(self, valueVariable):
+        return valueVariable
+
+    def writeExpression(self, attributeExpression):
+        return attributeExpression
+
+    def unexpectedValueCondition(self, valueVariable, expectedValueVariable):
+        """Returns None if the field has no expected value"""
+        return None
+
+    def validCondition(self, valueVariable, constant, fullValidation):
+        """Returns a condition which is true if validateContent accepts the value or None if there is nothing to check
+
+        With fullValidation=False only the types of references and the sizes of tags and bytes get checked.
+        constant is a function which returns the name of a variable with the given value."""
+        return None
+
 
 class TagField(Field):
 
     def __init__(self, name, sinceVersion, tillVersion):
         Field.__init__(self, name, sinceVersion, tillVersion)
-        self.structFormat = struct.Struct("<4B")
+        self.structFormat = struct.Struct("<4s")
+        self.structFormatString = "4s"
+        self.valueCount = 1
         self.size = 4
 
-    def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
-        b = self.structFormat.unpack_from(buffer, offset)
+    @staticmethod
+    def bytesToTag(b):
         if b[3] == 0:
-            s = chr(b[2]) + chr(b[1]) + chr(b[0])
+            return chr(b[2]) + chr(b[1]) + chr(b[0])
         else:
-            s = chr(b[3]) + chr(b[2]) + chr(b[1]) + chr(b[0])
+            return chr(b[3]) + chr(b[2]) + chr(b[1]) + chr(b[0])
 
-        setattr(owner, self.name, s)
+    @staticmethod
+    def tagToBytes(s):
+        if len(s) == 4:
+            return (s[3] + s[2] + s[1] + s[0]).encode("ascii")
+        else:
+            return (s[2] + s[1] + s[0]).encode("ascii") + b"\x00"
+
+    def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
+        b = self.structFormat.unpack_from(buffer, offset)[0]
+        setattr(owner, self.name, TagField.bytesToTag(b))
 
     def writeToBuffer(self, owner, buffer, offset):
         s = getattr(owner, self.name)
-        if len(s) == 4:
-            b = (s[3] + s[2] + s[1] + s[0]).encode("ascii")
-        else:
-            b = (s[2] + s[1] + s[0]).encode("ascii") + b"\x00"
-        return self.structFormat.pack_into(buffer, offset, b[0], b[1], b[2], b[3])
+        return self.structFormat.pack_into(buffer, offset, TagField.tagToBytes(s))
+
+    def readExpression(self, valueVariable):
+        return "bytesToTag(%s)" % valueVariable
+
+    def numpyFormat(self):
+        return primitiveFieldTypeNumpyFormats["tag"]
+
+    def writeExpression(self, attributeExpression):
+        return "tagToBytes(%s)" % attributeExpression
 
     def setToDefault(self, owner):
         pass
@@ -381,6 +1172,9 @@ class TagField(Field):
         if (type(fieldContent) != str) or (len(fieldContent) != 4):
             raise Exception("%s is not a string with 4 characters" % (fieldPath))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        return "type(%s) is str and len(%s) == 4" % (valueVariable, valueVariable)
+
 
 class ReferenceField(Field):
     def __init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion):
@@ -388,22 +1182,36 @@ class ReferenceField(Field):
         self.referenceStructureDescription = referenceStructureDescription
         self.historyOfReferencedStructures = historyOfReferencedStructures
         self.size = referenceStructureDescription.size
+        self.structFormatString = referenceStructureDescription.structFormatString
+        self.valueCount = referenceStructureDescription.valueCount
 
     def introduceIndexReferences(self, owner, indexMaker):
         referencedObjects = getattr(owner, self.name)
         structureDescription = self.getListContentStructureDefinition(referencedObjects, "while adding index ref")
 
         indexReference = indexMaker.getIndexReferenceTo(referencedObjects, self.referenceStructureDescription, structureDescription)
-        isPrimitive = self.historyOfReferencedStructures is not None and self.historyOfReferencedStructures.isPrimitive
-        if not isPrimitive:
+        if structureDescription is not None and structureDescription.hasReferences:
             for referencedObject in referencedObjects:
                 referencedObject.introduceIndexReferences(indexMaker)
         setattr(owner, self.name, indexReference)
 
+    def collectIndexReferences(self, owner, indexMaker):
+        """Like introduceIndexReferences, but the owner keeps the referenced objects"""
+        referencedObjects = getattr(owner, self.name)
+        if indexMaker.hasIndexReferenceTo(referencedObjects):
+            return
+        structureDescription = self.getListContentStructureDefinition(referencedObjects, "while adding index ref")
+
+        indexMaker.getIndexReferenceTo(referencedObjects, self.referenceStructureDescription, structureDescription)
+        if structureDescription is not None and structureDescription.hasReferences:
+            indexMaker.collectIndexReferencesOf(referencedObjects)
+
+    def variableName(self, owner):
+        ownerName = owner.structureDescription.structureName
+        return "%(ownerName)s.%(fieldName)s" % {"ownerName": ownerName, "fieldName": self.name}
+
     def resolveIndexReferences(self, owner, sections):
         ref = getattr(owner, self.name)
-        ownerName = owner.structureDescription.structureName
-        variable = "%(ownerName)s.%(fieldName)s" % {"ownerName": ownerName, "fieldName": self.name}
         if ref.entries == 0:
             if self.historyOfReferencedStructures is None:
                 referencedObjects = []
@@ -415,16 +1223,16 @@ class ReferenceField(Field):
             indexEntry = referencedSection.indexEntry
 
             if indexEntry.repetitions < ref.entries:
-                raise Exception("%s tries to reference %s elements in a %s section that contains just %s element(s)" % (variable, ref.entries, indexEntry.tag, indexEntry.repetitions))
+                raise Exception("%s tries to reference %s elements in a %s section that contains just %s element(s)" % (self.variableName(owner), ref.entries, indexEntry.tag, indexEntry.repetitions))
 
             referencedObjects = referencedSection.content
             if self.historyOfReferencedStructures is not None:
                 expectedTagName = self.historyOfReferencedStructures.name
                 actualTagName = indexEntry.tag
                 if actualTagName != expectedTagName:
-                    raise Exception("Expected ref %s point to %s, but it points to %s" % (variable, expectedTagName, actualTagName))
+                    raise Exception("Expected ref %s point to %s, but it points to %s" % (self.variableName(owner), expectedTagName, actualTagName))
             else:
-                raise Exception("Field %s can be marked as a reference pointing to %s" % (variable, indexEntry.tag))
+                raise Exception("Field %s can be marked as a reference pointing to %s" % (self.variableName(owner), indexEntry.tag))
 
         setattr(owner, self.name, referencedObjects)
 
@@ -439,15 +1247,22 @@ class ReferenceField(Field):
         if self.historyOfReferencedStructures.isPrimitive:
             return self.historyOfReferencedStructures.getVersion(0)
 
-        if type(li) != list:
+        if isNumpyArray(li):
+            if len(li) == 0:
+                return None
+            structureDescription = self.historyOfReferencedStructures.getVersionOfNumpyDtype(li.dtype)
+            if structureDescription is None:
+                raise Exception("%s: Expected an array of %s, but it was an array of %s" % (contextString, self.historyOfReferencedStructures.name, li.dtype))
+            return structureDescription
+
+        if not isinstance(li, list):
             raise Exception("%s: Expected a list, but was a %s" % (contextString, type(li)))
         if len(li) == 0:
             return None
 
         firstElement = li[0]
-        contentClass = type(firstElement)
-        if contentClass != M3Structure:
-            raise Exception("%s: Expected a list to contain an M3Structure object and not a %s" % (contextString, contentClass))
+        if not isinstance(firstElement, M3Structure):
+            raise Exception("%s: Expected a list to contain an M3Structure object and not a %s" % (contextString, type(firstElement)))
         # Optional: Enable check:
         # if not contentClass.tagName == tagName:
         #     raise Exception("Expected a list to contain a object of a class with tagName %s, but it contained a object of class %s with tagName %s" % (tagName, contentClass, contentClass.tagName))
@@ -461,6 +1276,21 @@ class ReferenceField(Field):
         referenceObject = getattr(owner, self.name)
         referenceObject.writeToBuffer(buffer, offset)
 
+    def validateNumpyArray(self, fieldContent, fieldPath):
+        if fieldContent.ndim != 1:
+            raise Exception("%s is not a one dimensional array" % (fieldPath))
+        if len(fieldContent) > 0:
+            structureDescription = self.getListContentStructureDefinition(fieldContent, fieldPath)
+            if fieldContent.dtype != structureDescription.numpyDtype:
+                raise Exception("%s is an array of %s and not of %s" % (fieldPath, fieldContent.dtype, structureDescription.numpyDtype))
+
+    def hasValidNumpyArray(self, fieldContent):
+        try:
+            self.validateNumpyArray(fieldContent, self.name)
+        except Exception:
+            return False
+        return True
+
     def setToDefault(self, owner):
 
         if self.historyOfReferencedStructures is not None:
@@ -481,6 +1311,9 @@ class CharReferenceField(ReferenceField):
         if (fieldContent is not None) and (type(fieldContent) != str):
             raise Exception("%s is not a string but a %s" % (fieldPath, type(fieldContent)))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        return "%s is None or type(%s) is str" % (valueVariable, valueVariable)
+
 
 class ByteReferenceField(ReferenceField):
 
@@ -491,6 +1324,9 @@ class ByteReferenceField(ReferenceField):
         if (type(fieldContent) != bytearray):
             raise Exception("%s is not a bytearray but a %s" % (fieldPath, type(fieldContent)))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        return "type(%s) is bytearray" % valueVariable
+
 
 class RealReferenceField(ReferenceField):
 
@@ -498,13 +1334,23 @@ class RealReferenceField(ReferenceField):
         ReferenceField.__init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
 
     def validateContent(self, fieldContent, fieldPath):
-        if (type(fieldContent) != list):
+        if isNumpyArray(fieldContent):
+            self.validateNumpyArray(fieldContent, fieldPath)
+            return
+        if not isinstance(fieldContent, list):
             raise Exception("%s is not a list of float" % (fieldPath))
         for itemIndex, item in enumerate(fieldContent):
             if type(item) != float:
                 itemPath = "%s[%d]" % (fieldPath, itemIndex)
                 raise Exception("%s is not an float" % (itemPath))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        numpyCondition = "(isNumpyArray(%s) and %s.hasValidNumpyArray(%s))" % (valueVariable, constant(self), valueVariable)
+        if not fullValidation:
+            return "isinstance(%s, list) or %s" % (valueVariable, numpyCondition)
+        # The types of all items get determined at once instead of checking them one by one
+        return "(isinstance(%s, list) and floatTypeSet.issuperset(map(type, %s))) or %s" % (valueVariable, valueVariable, numpyCondition)
+
 
 class IntReferenceField(ReferenceField):
     intRefToMinValue = {"I16_": (-(1 << 15)), "U16_": 0, "I32_": (-(1 << 31)), "U32_": 0, "FLAG": 0}
@@ -516,7 +1362,10 @@ class IntReferenceField(ReferenceField):
         self.maxValue = IntReferenceField.intRefToMaxValue[historyOfReferencedStructures.name]
 
     def validateContent(self, fieldContent, fieldPath):
-        if (type(fieldContent) != list):
+        if isNumpyArray(fieldContent):
+            self.validateNumpyArray(fieldContent, fieldPath)
+            return
+        if not isinstance(fieldContent, list):
             raise Exception("%s is not a list of integers" % (fieldPath))
         for itemIndex, item in enumerate(fieldContent):
             itemPath = "%s[%d]" % (fieldPath, itemIndex)
@@ -525,21 +1374,33 @@ class IntReferenceField(ReferenceField):
             if (item < self.minValue) or (item > self.maxValue):
                 raise Exception("%s has value %d which is not in range [%s, %s]" % (itemPath, item, self.minValue, self.maxValue))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        numpyCondition = "(isNumpyArray(%s) and %s.hasValidNumpyArray(%s))" % (valueVariable, constant(self), valueVariable)
+        if not fullValidation:
+            return "isinstance(%s, list) or %s" % (valueVariable, numpyCondition)
+        # The types and the range of all items get checked at once instead of one by one
+        return "(isinstance(%s, list) and intTypeSet.issuperset(map(type, %s)) and (len(%s) == 0 or (min(%s) >= %d and max(%s) <= %d))) or %s" % (
+            valueVariable, valueVariable, valueVariable, valueVariable, self.minValue, valueVariable, self.maxValue, numpyCondition)
+
 
 class StructureReferenceField(ReferenceField):
 
     def __init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion):
         ReferenceField.__init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
 
-    def validateContent(self, fieldContent, fieldPath):
-        if (type(fieldContent) != list):
+    def validateContent(self, fieldContent, fieldPath, validateReferencedObjects=True, level="full"):
+        if isNumpyArray(fieldContent):
+            self.validateNumpyArray(fieldContent, fieldPath)
+            return
+        if not isinstance(fieldContent, list):
             raise Exception("%s is not a list, but a %s" % (fieldPath, type(fieldContent)))
         if len(fieldContent) > 0:
             structureDescription = self.getListContentStructureDefinition(fieldContent, fieldPath)
             if structureDescription.history != self.historyOfReferencedStructures:
                 raise Exception("Expected that %s is a list of %s and not %s" % (fieldPath, self.historyOfReferencedStructures.name, structureDescription.history.name))
-            for itemIndex, item in enumerate(fieldContent):
-                structureDescription.validateInstance(item, "%s[%d]" % (fieldPath, itemIndex))
+            if not validateReferencedObjects:
+                return
+            structureDescription.validateInstances(fieldContent, fieldPath, level=level)
 
 
 class UnknownReferenceField(ReferenceField):
@@ -548,9 +1409,12 @@ class UnknownReferenceField(ReferenceField):
         ReferenceField.__init__(self, name, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
 
     def validateContent(self, fieldContent, fieldPath):
-        if (type(fieldContent) != list) or (len(fieldContent) != 0):
+        if (not isinstance(fieldContent, list)) or (len(fieldContent) != 0):
             raise Exception("%s is not an empty list" % (fieldPath))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        return "isinstance(%s, list) and len(%s) == 0" % (valueVariable, valueVariable)
+
 
 class EmbeddedStructureField(Field):
 
@@ -558,11 +1422,17 @@ class EmbeddedStructureField(Field):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.structureDescription = structureDescription
         self.size = structureDescription.size
+        self.structFormatString = structureDescription.structFormatString
+        self.valueCount = structureDescription.valueCount
 
     def introduceIndexReferences(self, owner, indexMaker):
         emeddedStructure = getattr(owner, self.name)
         emeddedStructure.introduceIndexReferences(indexMaker)
 
+    def collectIndexReferences(self, owner, indexMaker):
+        emeddedStructure = getattr(owner, self.name)
+        emeddedStructure.collectIndexReferences(indexMaker)
+
     def resolveIndexReferences(self, owner, sections):
         emeddedStructure = getattr(owner, self.name)
         emeddedStructure.resolveReferences(sections)
@@ -584,8 +1454,11 @@ class EmbeddedStructureField(Field):
         v = self.structureDescription.createInstance()
         setattr(owner, self.name, v)
 
-    def validateContent(self, fieldContent, fieldPath):
-        self.structureDescription.validateInstance(fieldContent, fieldPath)
+    def numpyFormat(self):
+        return self.structureDescription.numpyDtype
+
+    def validateContent(self, fieldContent, fieldPath, validateReferencedObjects=True, level="full"):
+        self.structureDescription.validateInstance(fieldContent, fieldPath, validateReferencedObjects, level)
 
 
 class PrimitiveField(Field):
@@ -594,7 +1467,9 @@ class PrimitiveField(Field):
     def __init__(self, name, typeString, sinceVersion, tillVersion, defaultValue, expectedValue):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.size = primitiveFieldTypeSizes[typeString]
-        self.structFormat = struct.Struct("<" + primitiveFieldTypeFormats[typeString])
+        self.structFormatString = primitiveFieldTypeFormats[typeString]
+        self.structFormat = struct.Struct("<" + self.structFormatString)
+        self.valueCount = 1
         self.typeString = typeString
         self.defaultValue = defaultValue
         self.expectedValue = expectedValue
@@ -614,6 +1489,15 @@ class PrimitiveField(Field):
     def setToDefault(self, owner):
         setattr(owner, self.name, self.defaultValue)
 
+    def unexpectedValueCondition(self, valueVariable, expectedValueVariable):
+        if self.expectedValue is None:
+            return None
+        # Like readFromBuffer, this check does not depend on checkExpectedValue
+        return "%s != %s" % (valueVariable, expectedValueVariable)
+
+    def numpyFormat(self):
+        return primitiveFieldTypeNumpyFormats[self.typeString]
+
 
 class IntField(PrimitiveField):
     intTypeToMinValue = {"int16": (-(1 << 15)), "uint16": 0, "int32": (-(1 << 31)), "uint32": 0, "int8": -(1 << 7), "uint8": 0}
@@ -631,6 +1515,11 @@ class IntField(PrimitiveField):
         if (fieldContent < self.minValue) or (fieldContent > self.maxValue):
             raise Exception("%s has value %d which is not in range [%d, %d]" % (fieldPath, fieldContent, self.minValue, self.maxValue))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        if not fullValidation:
+            return None
+        return "type(%s) is int and %d <= %s <= %d" % (valueVariable, self.minValue, valueVariable, self.maxValue)
+
     def getNamedBit(self, owner, bitName):
         mask = self.bitMaskMap[bitName]
         intValue = getattr(owner, self.name)
@@ -658,15 +1547,39 @@ class FloatField(PrimitiveField):
         if (type(fieldContent) != float):
             raise Exception("%s is not a float but a %s!" % (fieldPath, type(fieldContent)))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        if not fullValidation:
+            return None
+        return "type(%s) is float" % valueVariable
+
 
 class Fixed8Field(PrimitiveField):
 
     def __init__(self, name, typeString, sinceVersion, tillVersion, defaultValue, expectedValue):
         PrimitiveField.__init__(self, name, typeString, sinceVersion, tillVersion, defaultValue, expectedValue)
 
+    @staticmethod
+    def intToFloat(intValue):
+        return ((intValue / 255.0 * 2.0) - 1)
+
+    @staticmethod
+    def floatToInt(floatValue):
+        return round((floatValue + 1) / 2.0 * 255.0)
+
+    def readExpression(self, valueVariable):
+        return "fixed8ToFloat(%s)" % valueVariable
+
+    def writeExpression(self, attributeExpression):
+        return "floatToFixed8(%s)" % attributeExpression
+
+    def unexpectedValueCondition(self, valueVariable, expectedValueVariable):
+        if self.expectedValue is None:
+            return None
+        return "checkExpectedValue and fixed8ToFloat(%s) != %s" % (valueVariable, expectedValueVariable)
+
     def readFromBuffer(self, owner, buffer, offset, checkExpectedValue):
         intValue = self.structFormat.unpack_from(buffer, offset)[0]
-        floatValue = ((intValue / 255.0 * 2.0) - 1)
+        floatValue = Fixed8Field.intToFloat(intValue)
 
         if checkExpectedValue and self.expectedValue is not None and floatValue != self.expectedValue:
             structureName = owner.structureDescription.structureName
@@ -676,20 +1589,27 @@ class Fixed8Field(PrimitiveField):
 
     def writeToBuffer(self, owner, buffer, offset):
         floatValue = getattr(owner, self.name)
-        intValue = round((floatValue + 1) / 2.0 * 255.0)
+        intValue = Fixed8Field.floatToInt(floatValue)
         return self.structFormat.pack_into(buffer, offset, intValue)
 
     def validateContent(self, fieldContent, fieldPath):
         if (type(fieldContent) != float):
             raise Exception("%s is not a float but a %s!" % (fieldPath, type(fieldContent)))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        if not fullValidation:
+            return None
+        return "type(%s) is float" % valueVariable
+
 
 class UnknownBytesField(Field):
 
     def __init__(self, name, size, sinceVersion, tillVersion, defaultValue, expectedValue):
         Field.__init__(self, name, sinceVersion, tillVersion)
         self.size = size
-        self.structFormat = struct.Struct("<%ss" % size)
+        self.structFormatString = "%ss" % size
+        self.structFormat = struct.Struct("<" + self.structFormatString)
+        self.valueCount = 1
         self.defaultValue = defaultValue
         self.expectedValue = expectedValue
         assert self.structFormat.size == self.size
@@ -708,10 +1628,21 @@ class UnknownBytesField(Field):
     def setToDefault(self, owner):
         setattr(owner, self.name, self.defaultValue)
 
+    def unexpectedValueCondition(self, valueVariable, expectedValueVariable):
+        if self.expectedValue is None:
+            return None
+        return "checkExpectedValue and %s != %s" % (valueVariable, expectedValueVariable)
+
+    def numpyFormat(self):
+        return ("u1", (self.size,))
+
     def validateContent(self, fieldContent, fieldPath):
         if (type(fieldContent) != bytes) or (len(fieldContent) != self.size):
             raise Exception("%s is not an bytes object of size %s" % (fieldPath, self.size))
 
+    def validCondition(self, valueVariable, constant, fullValidation):
+        return "type(%s) is bytes and len(%s) == %d" % (valueVariable, valueVariable, self.size)
+
 
 class Visitor:
     def visitStart(self, generalDataMap):
@@ -936,72 +1867,65 @@ class BitMaskMapDeterminer(Visitor):
         bitMaskMap[bitName] = bitMask
 
 
-class FieldListCreator(Visitor):
-    def visitClassStart(self, generalDataMap, classDataMap):
-        classDataMap["fields"] = []
-
-    def visitFieldEnd(self, generalDataMap, classDataMap, fieldDataMap):
-        fields = classDataMap["fields"]
-        structureName = classDataMap["structureName"]
-        fieldName = fieldDataMap["fieldName"]
-        typeString = fieldDataMap["typeString"]
-        sinceVersion = fieldDataMap["sinceVersion"]
-        tillVersion = fieldDataMap["tillVersion"]
-        defaultValue = fieldDataMap["defaultValue"]
-        expectedValue = fieldDataMap["expectedValue"]
-        specifiedFieldSize = fieldDataMap["specifiedFieldSize"]
-        structures = generalDataMap["structures"]
-        bitMaskMap = fieldDataMap["bitMaskMap"]
+def createField(structures, structureName, fieldDataMap):
+    fieldName = fieldDataMap["fieldName"]
+    typeString = fieldDataMap["typeString"]
+    sinceVersion = fieldDataMap["sinceVersion"]
+    tillVersion = fieldDataMap["tillVersion"]
+    defaultValue = fieldDataMap["defaultValue"]
+    expectedValue = fieldDataMap["expectedValue"]
+    specifiedFieldSize = fieldDataMap["specifiedFieldSize"]
+    bitMaskMap = fieldDataMap["bitMaskMap"]
+
+    # TODO validate field size
+    if typeString == "tag":
+        field = TagField(fieldName, sinceVersion, tillVersion)
+    elif typeString in intTypes:
+        field = IntField(fieldName, typeString, sinceVersion, tillVersion, defaultValue, expectedValue, bitMaskMap)
+    elif typeString == "float":
+        field = FloatField(fieldName, typeString, sinceVersion, tillVersion, defaultValue, expectedValue)
+    elif typeString == "fixed8":
+        field = Fixed8Field(fieldName, typeString, sinceVersion, tillVersion, defaultValue, expectedValue)
+    elif typeString is None:
+        field = UnknownBytesField(fieldName, specifiedFieldSize, sinceVersion, tillVersion, defaultValue, expectedValue)
+    else:
+        vPos = typeString.rfind("V")
+        if vPos != -1:
+            fieldStructureName = typeString[:vPos]
+            fieldStructureVersion = int(typeString[vPos + 1:])
 
-        # TODO validate field size
-        if typeString == "tag":
-            field = TagField(fieldName, sinceVersion, tillVersion)
-        elif typeString in intTypes:
-            field = IntField(fieldName, typeString, sinceVersion, tillVersion, defaultValue, expectedValue, bitMaskMap)
-        elif typeString == "float":
-            field = FloatField(fieldName, typeString, sinceVersion, tillVersion, defaultValue, expectedValue)
-        elif typeString == "fixed8":
-            field = Fixed8Field(fieldName, typeString, sinceVersion, tillVersion, defaultValue, expectedValue)
-        elif typeString is None:
-            field = UnknownBytesField(fieldName, specifiedFieldSize, sinceVersion, tillVersion, defaultValue, expectedValue)
         else:
-            vPos = typeString.rfind("V")
-            if vPos != -1:
-                fieldStructureName = typeString[:vPos]
-                fieldStructureVersion = int(typeString[vPos + 1:])
-
+            fieldStructureName = typeString
+            fieldStructureVersion = 0
+        if fieldStructureName == "Reference" or fieldStructureName == "SmallReference":
+            refTo = fieldDataMap["refTo"]
+            if (refTo is not None) and (not (refTo in structures)):
+                raise Exception("The structure with name %s referenced by %s.%s is not defined" % (refTo, structureName, fieldName))
+            if refTo is not None:
+                historyOfReferencedStructures = structures[refTo]
             else:
-                fieldStructureName = typeString
-                fieldStructureVersion = 0
-            if fieldStructureName == "Reference" or fieldStructureName == "SmallReference":
-                refTo = fieldDataMap["refTo"]
-                if (refTo is not None) and (not (refTo in structures)):
-                    raise Exception("The structure with name %s referenced by %s.%s is not defined" % (refTo, structureName, fieldName))
-                if refTo is not None:
-                    historyOfReferencedStructures = structures[refTo]
-                else:
-                    historyOfReferencedStructures = None
-                referenceStructureDescription = structures[fieldStructureName].getVersion(fieldStructureVersion)
-
-                if refTo is None:
-                    field = UnknownReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
-                elif refTo == "CHAR":
-                    field = CharReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
-                elif refTo == "U8__":
-                    field = ByteReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
-                elif refTo == "REAL":
-                    field = RealReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
-                elif refTo in ["I16_", "U16_", "I32_", "U32_", "FLAG"]:
-                    field = IntReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
-                else:
-                    field = StructureReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
+                historyOfReferencedStructures = None
+            referenceStructureDescription = structures[fieldStructureName].getVersion(fieldStructureVersion)
+
+            if refTo is None:
+                field = UnknownReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
+            elif refTo == "CHAR":
+                field = CharReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
+            elif refTo == "U8__":
+                field = ByteReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
+            elif refTo == "REAL":
+                field = RealReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
+            elif refTo in ["I16_", "U16_", "I32_", "U32_", "FLAG"]:
+                field = IntReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
             else:
-                fieldStructureHistory = structures.get(fieldStructureName)
-                if fieldStructureHistory is None:
-                    raise Exception("The structure %s has not been defined before structure %s" % (fieldStructureName, structureName))
-                fieldStructureDescription = fieldStructureHistory.getVersion(fieldStructureVersion)
-                field = EmbeddedStructureField(fieldName, fieldStructureDescription, sinceVersion, tillVersion)
-        fields.append(field)
+                field = StructureReferenceField(fieldName, referenceStructureDescription, historyOfReferencedStructures, sinceVersion, tillVersion)
+        else:
+            fieldStructureHistory = structures.get(fieldStructureName)
+            if fieldStructureHistory is None:
+                raise Exception("The structure %s embedded by %s.%s is not defined" % (fieldStructureName, structureName, fieldName))
+            fieldStructureDescription = fieldStructureHistory.getVersion(fieldStructureVersion)
+            field = EmbeddedStructureField(fieldName, fieldStructureDescription, sinceVersion, tillVersion)
+    return field
 
 
 class StructureHistoryListCreator(Visitor):
@@ -1010,18 +1934,39 @@ class StructureHistoryListCreator(Visitor):
         pass
 
     def visitClassEnd(self, generalDataMap, classDataMap):
-        fields = classDataMap["fields"]
+        fieldDataMaps = classDataMap["fieldDataMaps"]
         structureName = classDataMap["structureName"]
         versionToSizeMap = classDataMap["versionToSizeMap"]
         structures = generalDataMap["structures"]
 
-        structureHistory = M3StructureHistory(structureName, versionToSizeMap, fields)
+        # The fields get created when the structure history gets used for the first time
+        structureHistory = M3StructureHistory(structureName, versionToSizeMap, None, fieldDataMaps, structures)
         structures[structureName] = structureHistory
 
     def visitEnd(self, generalDataMap):
         pass
 
 
+class SchemaDataCollector(Visitor):
+    """Collects the data maps of all structures as plain data without xml nodes, so that they can be cached"""
+    classKeys = ("structureName", "description", "versionToSizeMap")
+    fieldKeys = ("fieldName", "typeString", "refTo", "specifiedFieldSize", "expectedValue", "defaultValue", "tillVersion", "sinceVersion", "bitMaskMap")
+
+    def visitStart(self, generalDataMap):
+        generalDataMap["schemaData"] = []
+
+    def visitClassStart(self, generalDataMap, classDataMap):
+        classDataMap["fieldDataMaps"] = []
+
+    def visitFieldEnd(self, generalDataMap, classDataMap, fieldDataMap):
+        classDataMap["fieldDataMaps"].append({key: fieldDataMap[key] for key in SchemaDataCollector.fieldKeys})
+
+    def visitClassEnd(self, generalDataMap, classDataMap):
+        classData = {key: classDataMap[key] for key in SchemaDataCollector.classKeys}
+        classData["fieldDataMaps"] = classDataMap["fieldDataMaps"]
+        generalDataMap["schemaData"].append(classData)
+
+
 def foreachChildWithName(parentNode, childName):
     for childNode in parentNode.childNodes:
         if childNode.nodeName == childName:
@@ -1081,7 +2026,33 @@ def visitStructresDomWith(structuresDom, visitors, generalDataMap):
         visitor.visitEnd(generalDataMap)
 
 
-def readStructureDefinitions(structuresXmlFile):
+def visitSchemaDataWith(schemaData, visitors, generalDataMap):
+    """Like visitStructresDomWith, but for the data collected by a SchemaDataCollector
+
+    There are no version and bit visits, since their data is already part of the class and field data maps."""
+    for visitor in visitors:
+        visitor.visitStart(generalDataMap)
+
+    for classData in schemaData:
+        classDataMap = dict(classData)
+        for visitor in visitors:
+            visitor.visitClassStart(generalDataMap, classDataMap)
+
+        for fieldData in classData["fieldDataMaps"]:
+            fieldDataMap = dict(fieldData)
+            for visitor in visitors:
+                visitor.visitFieldStart(generalDataMap, classDataMap, fieldDataMap)
+            for visitor in visitors:
+                visitor.visitFieldEnd(generalDataMap, classDataMap, fieldDataMap)
+
+        for visitor in visitors:
+            visitor.visitClassEnd(generalDataMap, classDataMap)
+
+    for visitor in visitors:
+        visitor.visitEnd(generalDataMap)
+
+
+def readSchemaData(structuresXmlFile):
     doc = xml.dom.minidom.parse(structuresXmlFile)
     generalDataMap = {}
 
@@ -1100,15 +2071,58 @@ def readStructureDefinitions(structuresXmlFile):
         ExpectedAndDefaultConstantsDeterminer(),
         BitAttributesReader(),
         BitMaskMapDeterminer(),
-        FieldListCreator(),
-        StructureHistoryListCreator()
+        SchemaDataCollector()
     ]
 
     visitStructresDomWith(doc, secondRunVisitors, generalDataMap)
 
+    return generalDataMap["schemaData"]
+
+
+def createStructuresFromSchemaData(schemaData):
+    generalDataMap = {}
+    visitors = [
+        StructureHistoryListCreator()
+    ]
+    visitSchemaDataWith(schemaData, visitors, generalDataMap)
     return generalDataMap["structures"]
 
 
+def readStructureDefinitions(structuresXmlFile):
+    return createStructuresFromSchemaData(readSchemaData(structuresXmlFile))
+
+
+schemaCacheFormatVersion = 1
+
+
+def loadSchemaData(structuresXmlPath, cachePath):
+    """Returns the hash of the structures xml file and the schema data read from it
+
+    The schema data gets cached with marshal in the file cachePath. The cache is only used
+    when it got created from an xml file with the same hash, otherwise it gets rebuilt."""
+    with open(structuresXmlPath, "rb") as xmlFile:
+        xmlBytes = xmlFile.read()
+    xmlHash = hashlib.sha1(xmlBytes).hexdigest()
+
+    try:
+        with open(cachePath, "rb") as cacheFile:
+            cacheFormatVersion, cachedXmlHash, schemaData = marshal.loads(cacheFile.read())
+        if cacheFormatVersion == schemaCacheFormatVersion and cachedXmlHash == xmlHash:
+            return xmlHash, schemaData
+    except (OSError, EOFError, ValueError, TypeError):
+        pass  # missing, outdated or broken cache
+
+    schemaData = readSchemaData(io.BytesIO(xmlBytes))
+    try:
+        temporaryCachePath = "%s.%d.tmp" % (cachePath, os.getpid())
+        with open(temporaryCachePath, "wb") as cacheFile:
+            marshal.dump((schemaCacheFormatVersion, xmlHash, schemaData), cacheFile)
+        os.replace(temporaryCachePath, cachePath)
+    except OSError:
+        pass  # e.g. the addon directory is not writable, the cache is optional
+    return xmlHash, schemaData
+
+
 def resolveAllReferences(list, sections):
     ListType = type([])
     for sublist in list:
@@ -1117,43 +2131,282 @@ def resolveAllReferences(list, sections):
                 entry.resolveReferences(sections)
 
 
-def loadSections(filename, checkExpectedValue=True):
-    source = open(filename, "rb")
-    try:
-        fmagic = source.read(4)[::-1].decode('ascii')
-        source.seek(0)
+def readHeaderAndIndex(source, checkExpectedValue=True):
+    """Reads the header and the index entries from a binary file object of a m3 file; returns fmagic, header and index entries"""
+    fmagic, header, indexBytes = readHeaderAndIndexBytes(source, checkExpectedValue)
+    MD34IndexEntryV0 = structures["MD34IndexEntry"].getVersion(0)
+    indexEntries = MD34IndexEntryV0.createInstances(indexBytes, header.indexSize, checkExpectedValue)
+    return fmagic, header, indexEntries
+
+
+def readHeaderAndIndexBytes(source, checkExpectedValue=True):
+    """Like readHeaderAndIndex, but returns the undecoded bytes of the index instead of the index entries"""
+    source.seek(0)
+    fmagic = source.read(4)[::-1].decode('ascii')
+    if fmagic not in ("MD34", "MD33"):
+        raise Exception("The file is no m3 file since it starts with %s" % repr(fmagic[::-1]))
+    source.seek(0)
+
+    m3Header = structures[fmagic].getVersion(11)
+    headerBytes = source.read(m3Header.size)
+    header = m3Header.createInstance(headerBytes, checkExpectedValue=checkExpectedValue)
+
+    source.seek(header.indexOffset)
+    MD34IndexEntryV0 = structures["MD34IndexEntry"].getVersion(0)
+    indexBytes = source.read(header.indexSize * MD34IndexEntryV0.size)
+    if len(indexBytes) != header.indexSize * MD34IndexEntryV0.size:
+        raise Exception("The index with %d entries at offset %d is incomplete" % (header.indexSize, header.indexOffset))
+    return fmagic, header, indexBytes
+
+
+def determineSectionSizes(indexEntries, indexOffset):
+    """Returns a map from the offsets of the sections to their sizes, which includes the padding at their end"""
+    offsets = []
+    for indexEntry in indexEntries:
+        offsets.append(indexEntry.offset)
+    return determineSizesOfOffsets(offsets, indexOffset)
+
+
+def determineSizesOfOffsets(offsets, indexOffset):
+    offsets = list(offsets)
+    offsets.append(indexOffset)
+    offsets.sort()
+    previousOffset = offsets[0]
+    offsetToSizeMap = {}
+    for offset in offsets[1:]:
+        offsetToSizeMap[previousOffset] = offset - previousOffset
+        previousOffset = offset
+    return offsetToSizeMap
+
+
+def probe(filename):
+    """Reads only the header and the index of a m3 file and returns a description of it without decoding the sections
+
+    The description is a dict with the keys fmagic, fileSize, indexOffset and sections. sections is a list with
+    a dict per index entry with the keys tag, version, repetitions, offset, size and known. size is the number of
+    bytes including the padding and known tells if structures.xml defines the structure in that version."""
+    with open(filename, "rb") as source:
+        fmagic, header, indexBytes = readHeaderAndIndexBytes(source)
+        fileSize = os.fstat(source.fileno()).st_size
+    # The index entries get unpacked without creating objects for them, since it's faster:
+    MD34IndexEntryV0 = structures["MD34IndexEntry"].getVersion(0)
+    indexValues = list(MD34IndexEntryV0.structFormat.iter_unpack(indexBytes))
+    offsetToSizeMap = determineSizesOfOffsets([offset for tagBytes, offset, repetitions, version in indexValues], header.indexOffset)
+    tagBytesToTagMap = {}
+    sectionDescriptions = []
+    for tagBytes, offset, repetitions, version in indexValues:
+        tag = tagBytesToTagMap.get(tagBytes)
+        if tag is None:
+            tag = TagField.bytesToTag(tagBytes)
+            tagBytesToTagMap[tagBytes] = tag
+        structureHistory = structures.get(tag)
+        sectionDescriptions.append({
+            "tag": tag,
+            "version": version,
+            "repetitions": repetitions,
+            "offset": offset,
+            "size": offsetToSizeMap[offset],
+            "known": structureHistory is not None and version in structureHistory.versionToSizeMap})
+    return {"fmagic": fmagic, "fileSize": fileSize, "indexOffset": header.indexOffset, "sections": sectionDescriptions}
+
+
+def getModelFieldsByName(modelDescription, fieldNames):
+    """Returns the reference fields of the model description with the given names
+
+    Names of fields which exist only in other versions of the model get ignored."""
+    modelFields = []
+    for fieldName in fieldNames:
+        field = modelDescription.nameToFieldMap.get(fieldName)
+        if field is None:
+            if not any(field.name == fieldName for field in modelDescription.history.allFields):
+                raise Exception("%s has no field called %s" % (modelDescription.structureName, fieldName))
+            continue
+        if not isinstance(field, ReferenceField):
+            raise Exception("%s.%s is no reference field" % (modelDescription.structureName, fieldName))
+        modelFields.append(field)
+    return modelFields
+
+
+def determineSectionIndicesOfModelFields(sections, fieldNames, checkExpectedValue=True):
+    """Returns the indices of the header, the model and the sections reachable from the given fields of the model
+
+    Only the header and the model get decoded for that, the references of the other sections get read from their raw bytes."""
+    headerSection = sections[0]
+    header = headerSection.structureDescription.createInstances(headerSection.rawBytes, 1, checkExpectedValue)[0]
+    modelSectionIndex = header.model.index
+    modelSection = sections[modelSectionIndex]
+    modelDescription = modelSection.structureDescription
+    model = modelDescription.createInstances(modelSection.rawBytes, 1, checkExpectedValue)[0]
+
+    sectionIndices = set([0, modelSectionIndex])
+    sectionIndicesToVisit = []
+    for field in getModelFieldsByName(modelDescription, fieldNames):
+        indexReference = getattr(model, field.name)
+        if indexReference.entries != 0:
+            sectionIndicesToVisit.append(indexReference.index)
+    while len(sectionIndicesToVisit) > 0:
+        sectionIndex = sectionIndicesToVisit.pop()
+        if sectionIndex in sectionIndices:
+            continue
+        sectionIndices.add(sectionIndex)
+        section = sections[sectionIndex]
+        if section.structureDescription.hasReferences:
+            sectionIndicesToVisit.extend(section.structureDescription.getReferencedSectionIndices(section.rawBytes, section.indexEntry.repetitions))
+    return sectionIndices
+
+
+class Profile:
+    """Wall time, bytes, instances and sections per phase and structure version, see enableProfiling
+
+    The phases are read, decode, resolve and validate for loading and layout, validate, encode, copy and write for saving."""
+    phases = ("read", "decode", "resolve", "validate", "layout", "encode", "copy", "write")
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, phase, tag, version, seconds, numberOfBytes=0, instances=0):
+        entry = self.entries.setdefault((phase, tag, version), [0.0, 0, 0, 0])
+        entry[0] += seconds
+        entry[1] += numberOfBytes
+        entry[2] += instances
+        entry[3] += 1
+
+    def addSection(self, phase, section, startTime, numberOfBytes):
+        """Adds the time since startTime, which got taken with time.perf_counter, for a whole section"""
+        indexEntry = section.indexEntry
+        self.add(phase, indexEntry.tag, indexEntry.version, time.perf_counter() - startTime, numberOfBytes, indexEntry.repetitions)
+
+    def merge(self, otherProfile):
+        """Adds the entries of another profile, e.g. one that got recorded in another process"""
+        for key, otherEntry in otherProfile.entries.items():
+            entry = self.entries.setdefault(key, [0.0, 0, 0, 0])
+            for i in range(4):
+                entry[i] += otherEntry[i]
+
+    def asDict(self):
+        """Returns a dict like {"decode": {"BONEV1": {"seconds": 0.1, "bytes": 1024, "instances": 8, "sections": 1}}}"""
+        result = {}
+        for (phase, tag, version), (seconds, numberOfBytes, instances, count) in self.entries.items():
+            result.setdefault(phase, {})["%sV%d" % (tag, version)] = {"seconds": seconds, "bytes": numberOfBytes, "instances": instances, "sections": count}
+        return result
+
+    def formatTable(self, maximumRowsPerPhase=None):
+        """Returns a table of the entries sorted by phase and by time, with the total of each phase
+
+        With maximumRowsPerPhase the remaining structures of a phase get summed up in one row."""
+        rowFormat = "%-10s %-26s %9s %12s %12s %10s %6s"
+        lines = [rowFormat % ("phase", "structure", "sections", "instances", "bytes", "seconds", "%")]
+        totalSeconds = sum(entry[0] for entry in self.entries.values())
+
+        def addRow(phase, structureName, entry):
+            seconds, numberOfBytes, instances, count = entry
+            share = 100.0 * seconds / totalSeconds if totalSeconds > 0 else 0.0
+            lines.append(rowFormat % (phase, structureName, count, instances, numberOfBytes, "%.4f" % seconds, "%.1f" % share))
+
+        phaseToEntriesMap = {}
+        for (phase, tag, version), entry in self.entries.items():
+            phaseToEntriesMap.setdefault(phase, []).append(("%sV%d" % (tag, version), entry))
+        for phase in sorted(phaseToEntriesMap, key=lambda phase: self.phases.index(phase) if phase in self.phases else len(self.phases)):
+            phaseEntries = sorted(phaseToEntriesMap[phase], key=lambda nameAndEntry: -nameAndEntry[1][0])
+            if maximumRowsPerPhase is not None and len(phaseEntries) > maximumRowsPerPhase:
+                otherEntries = phaseEntries[maximumRowsPerPhase:]
+                phaseEntries = phaseEntries[:maximumRowsPerPhase]
+                phaseEntries.append(("(%d others)" % len(otherEntries), [sum(entry[i] for name, entry in otherEntries) for i in range(4)]))
+            for structureName, entry in phaseEntries:
+                addRow(phase, structureName, entry)
+            addRow(phase, "(total)", [sum(entry[i] for name, entry in phaseEntries) for i in range(4)])
+        return "\n".join(lines) + "\n"
+
+
+def enableProfiling():
+    """Starts recording the costs of loading and saving in a new Profile, which gets returned and is available as m3.profile
+
+    Without profiling, the loading and saving functions only check once per section if m3.profile is None."""
+    global profile
+    profile = Profile()
+    return profile
+
+
+def disableProfiling():
+    """Stops recording and returns the recorded Profile or None"""
+    global profile
+    recordedProfile = profile
+    profile = None
+    return recordedProfile
+
+
+def validateModelSectionBySection(model, sections, level):
+    """Validates a model like validateInstance, but each section on its own to record the time per structure in the profile
+
+    The first section is the header which is not part of the model. If a section is invalid,
+    the model gets validated as a whole to report the problem with the usual message."""
+    if level == "none":
+        return
+    for section in sections[1:]:
+        structureDescription = section.structureDescription
+        if structureDescription.isPrimitive or isNumpyArray(section.content):
+            continue
+        startTime = time.perf_counter()
+        if level == "full":
+            isValid = structureDescription.hasValidContent(section.content, False)
+        else:
+            isValid = structureDescription.hasValidStructure(section.content, False)
+        profile.addSection("validate", section, startTime, 0)
+        if not isValid:
+            break
+    else:
+        return
+    model.structureDescription.validateInstance(model, "model", level=level)
+
+
+def loadSections(filename, checkExpectedValue=True, mmap=False, lazy=False, numpyArrays=False, trackChanges=False, fields=None):
+    """Loads the sections of a m3 file
+
+    With mmap=True the file gets memory mapped and the raw bytes of each section are memoryview slices of the mapping,
+    so the file content is not copied. The mapping stays alive as long as one of the slices is in use.
 
-        m3Header = structures[fmagic].getVersion(11)
-        headerBytes = source.read(m3Header.size)
-        header = m3Header.createInstance(headerBytes, checkExpectedValue=checkExpectedValue)
+    With lazy=True the content of the sections are LazySectionList objects which get decoded on first access.
+    Their references get resolved when they get decoded, so resolveReferencesOfSections must not be called for them.
 
-        source.seek(header.indexOffset)
-        MD34IndexEntryV0 = structures["MD34IndexEntry"].getVersion(0)
+    With numpyArrays=True sections of plain records without references (e.g. REAL, U16_, VEC3, QUAT) get represented
+    by numpy arrays which use the raw bytes of the section without copying them. The arrays are read only.
+
+    With trackChanges=True the lists of the sections are TrackedList objects, which mark their section as modified when
+    they get changed. Each section knows the list of all sections as loadedSections. See loadModel.
+
+    With fields only the header, the model and the sections reachable from the given reference fields of the model
+    get decoded. The content of the other sections is None, see determineSectionIndicesOfModelFields."""
+    if numpyArrays and importNumpy() is None:
+        raise Exception("numpy is required for loading sections as numpy arrays")
+    source = open(filename, "rb")
+    try:
+        if mmap:
+            mappedFile = memoryview(MemoryMappedFile(source.fileno(), 0, access=ACCESS_READ))
+        else:
+            mappedFile = None
+        fmagic, header, indexEntries = readHeaderAndIndex(source, checkExpectedValue)
         sections = []
-        for i in range(header.indexSize):
+        for indexEntry in indexEntries:
             section = Section()
-            indexEntryBytes = source.read(MD34IndexEntryV0.size)
-            section.indexEntry = MD34IndexEntryV0.createInstance(indexEntryBytes, checkExpectedValue=checkExpectedValue)
+            section.indexEntry = indexEntry
+            if trackChanges:
+                section.loadedSections = sections
             sections.append(section)
-
-        offsets = []
-        for section in sections:
-            indexEntry = section.indexEntry
-            offsets.append(indexEntry.offset)
-        offsets.append(header.indexOffset)
-        offsets.sort()
-        previousOffset = offsets[0]
-        offsetToSizeMap = {}
-        for offset in offsets[1:]:
-            offsetToSizeMap[previousOffset] = offset - previousOffset
-            previousOffset = offset
+        offsetToSizeMap = determineSectionSizes(indexEntries, header.indexOffset)
 
         unknownSections = set()
         for section in sections:
             indexEntry = section.indexEntry
-            source.seek(indexEntry.offset)
             numberOfBytes = offsetToSizeMap[indexEntry.offset]
-            section.rawBytes = source.read(numberOfBytes)
+            if profile is not None:
+                startTime = time.perf_counter()
+            if mappedFile is not None:
+                section.rawBytes = mappedFile[indexEntry.offset:indexEntry.offset + numberOfBytes]
+            else:
+                source.seek(indexEntry.offset)
+                section.rawBytes = source.read(numberOfBytes)
+            if profile is not None:
+                profile.addSection("read", section, startTime, len(section.rawBytes))
 
             structureHistory = structures.get(indexEntry.tag)
             if structureHistory is not None:
@@ -1163,7 +2416,6 @@ def loadSections(filename, checkExpectedValue=True):
 
             if structureDescription is not None:
                 section.structureDescription = structureDescription
-                section.determineContentField(checkExpectedValue)
             else:
                 guessedUnusedSectionBytes = 0
                 for i in range(1, 16):
@@ -1195,64 +2447,516 @@ def loadSections(filename, checkExpectedValue=True):
                 unknownSections.add("%sV%s" % (indexEntry.tag, indexEntry.version))
         if len(unknownSections) != 0:
             raise Exception("There were %s unknown sections: %s (see console log for more details)" % (len(unknownSections), unknownSections))
+
+        if fields is not None:
+            sectionIndicesToDecode = determineSectionIndicesOfModelFields(sections, fields, checkExpectedValue)
+        for sectionIndex, section in enumerate(sections):
+            if fields is not None and sectionIndex not in sectionIndicesToDecode:
+                section.content = None
+                continue
+            structureDescription = section.structureDescription
+            indexEntry = section.indexEntry
+            if profile is not None:
+                startTime = time.perf_counter()
+            if numpyArrays and structureDescription.structureName != "U8__" and structureDescription.numpyDtype is not None:
+                section.content = structureDescription.createArray(section.rawBytes, indexEntry.repetitions)
+            elif lazy and structureDescription.structureName not in ("CHAR", "U8__"):
+                section.content = LazySectionList(section, sections, checkExpectedValue, trackChanges)
+                continue  # gets recorded in the profile when it gets decoded
+            else:
+                section.determineContentField(checkExpectedValue)
+                if trackChanges and isinstance(section.content, list):
+                    section.content = TrackedList(section.content, section)
+            if profile is not None:
+                profile.addSection("decode", section, startTime, len(section.rawBytes))
     finally:
         source.close()
     return sections
 
 
+class ReferenceGraph:
+    """The references between the sections of a loaded model
+
+    getReferencesOf returns the (record index, field path, referenced section index) tuples of a section, e.g.
+    (3, "name", 17) if the name of the fourth record is stored in section 17. References to no entries are not part
+    of the graph. The graph gets determined from the raw bytes of the sections, so they don't need to be decoded.
+    Use getReferenceGraphOf to get the graph of a loaded model."""
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.sectionIndexToReferencesMap = {}
+        self.referencingSectionIndicesList = [[] for section in sections]
+        self.contentIdToSectionIndexMap = None
+        for sectionIndex, section in enumerate(sections):
+            structureDescription = section.structureDescription
+            if not structureDescription.hasReferences:
+                continue
+            fieldPaths = structureDescription.referenceFieldPaths
+            numberOfBytes = section.indexEntry.repetitions * structureDescription.size
+            references = []
+            recordIndex = 0
+            for values in structureDescription.referenceStruct.iter_unpack(memoryview(section.rawBytes)[:numberOfBytes]):
+                for valueIndex in range(0, len(values), 2):
+                    if values[valueIndex] != 0:
+                        referencedSectionIndex = values[valueIndex + 1]
+                        references.append((recordIndex, fieldPaths[valueIndex // 2], referencedSectionIndex))
+                        self.referencingSectionIndicesList[referencedSectionIndex].append(sectionIndex)
+                recordIndex += 1
+            if len(references) > 0:
+                self.sectionIndexToReferencesMap[sectionIndex] = references
+
+    def getReferencesOf(self, sectionIndex):
+        """Returns the (record index, field path, referenced section index) tuples of the references in the section"""
+        return self.sectionIndexToReferencesMap.get(sectionIndex, [])
+
+    def getReferencedSectionIndices(self, sectionIndex):
+        """Returns the sorted indices of the sections which the section references"""
+        return sorted(set(reference[2] for reference in self.getReferencesOf(sectionIndex)))
+
+    def getReferencingSectionIndices(self, sectionIndex):
+        """Returns the sorted indices of the sections which reference the section"""
+        return sorted(set(self.referencingSectionIndicesList[sectionIndex]))
+
+    def getReferencesTo(self, sectionIndex):
+        """Returns the (section index, record index, field path) tuples of the references to the section"""
+        referencesTo = []
+        for referencingSectionIndex in self.getReferencingSectionIndices(sectionIndex):
+            for recordIndex, fieldPath, referencedSectionIndex in self.sectionIndexToReferencesMap[referencingSectionIndex]:
+                if referencedSectionIndex == sectionIndex:
+                    referencesTo.append((referencingSectionIndex, recordIndex, fieldPath))
+        return referencesTo
+
+    def getUnreferencedSectionIndices(self):
+        """Returns the indices of the sections which are not referenced, except the header"""
+        return [sectionIndex for sectionIndex, referencingSectionIndices in enumerate(self.referencingSectionIndicesList)
+                if sectionIndex != 0 and len(referencingSectionIndices) == 0]
+
+    def getReachableSectionIndices(self, sectionIndex):
+        """Returns the indices of the section and of all sections which it references directly or indirectly"""
+        reachableSectionIndices = set()
+        sectionIndicesToVisit = [sectionIndex]
+        while len(sectionIndicesToVisit) > 0:
+            sectionIndex = sectionIndicesToVisit.pop()
+            if sectionIndex in reachableSectionIndices:
+                continue
+            reachableSectionIndices.add(sectionIndex)
+            sectionIndicesToVisit.extend(reference[2] for reference in self.getReferencesOf(sectionIndex))
+        return reachableSectionIndices
+
+    def getSectionIndexOf(self, objects):
+        """Returns the index of the section whose content the objects are, e.g. model.bones, or None"""
+        if self.contentIdToSectionIndexMap is None:
+            self.contentIdToSectionIndexMap = {}
+            for sectionIndex, section in enumerate(self.sections):
+                content = getattr(section, "content", None)
+                if content is not None:
+                    self.contentIdToSectionIndexMap[id(content)] = sectionIndex
+        sectionIndex = self.contentIdToSectionIndexMap.get(id(objects))
+        if sectionIndex is None or self.sections[sectionIndex].content is not objects:
+            return None
+        return sectionIndex
+
+
 def resolveReferencesOfSections(sections):
-    for section in sections:
-        section.resolveReferences(sections)
+    """Resolves the index references of all sections and returns the ReferenceGraph of them"""
+    if profile is not None:
+        for section in sections:
+            startTime = time.perf_counter()
+            section.resolveReferences(sections)
+            profile.addSection("resolve", section, startTime, 0)
+    else:
+        for section in sections:
+            section.resolveReferences(sections)
+    return ReferenceGraph(sections)
 
 
-def checkThatAllSectionsGotReferenced(sections):
-    numberOfUnreferencedSections = 0
-    referenceStructureDescription = reference = structures["SmallReference"].getVersion(0)
-    for sectionIndex, section in enumerate(sections):
+def resolveReferencesOfModelFields(sections, fieldNames):
+    """Like resolveReferencesOfSections for sections loaded with fields
 
-        if (section.timesReferenced == 0) and (sectionIndex != 0):
-            numberOfUnreferencedSections += 1
-            stderr.write("WARNING: %sV%s (%d repetitions) got %d times referenced\n" % (section.indexEntry.tag, section.indexEntry.version, section.indexEntry.repetitions, section.timesReferenced))
-            reference = referenceStructureDescription.createInstance()
-            reference.entries = section.indexEntry.repetitions
-            reference.index = sectionIndex
-            bytesToSearch = referenceStructureDescription.instancesToBytes([reference])
-            for sectionToCheck in sections:
-                positionInSection = sectionToCheck.rawBytes.find(bytesToSearch)
-                if positionInSection != -1:
-                    flagBytes = sectionToCheck.rawBytes[positionInSection + 8:positionInSection + 12]
-                    flagsAsHex = ''.join(["%02x" % x for x in flagBytes])
-                    stderr.write("  -> Found possible reference at offset %d in a section of type %sV%s with flag %s\n" % (
-                        positionInSection % sectionToCheck.structureDescription.size,
-                        sectionToCheck.indexEntry.tag,
-                        sectionToCheck.indexEntry.version,
-                        flagsAsHex
-                    ))
-                    sectionToCheck.structureDescription.dumpOffsets()
-
-    if numberOfUnreferencedSections > 0:
-        raise Exception("Unable to load all data: There were %d unreferenced sections. View log for details" % numberOfUnreferencedSections)
-
-
-def loadModel(filename, checkExpectedValue=True):
-    sections = loadSections(filename, checkExpectedValue)
-    resolveReferencesOfSections(sections)
-    checkThatAllSectionsGotReferenced(sections)
+    Only the given fields of the model get resolved, its other reference fields keep their index references."""
+    modelSection = sections[sections[0].content[0].model.index]
+    for section in sections:
+        if section.content is not None and section is not modelSection:
+            if profile is not None:
+                startTime = time.perf_counter()
+            section.resolveReferences(sections)
+            if profile is not None:
+                profile.addSection("resolve", section, startTime, 0)
+    if profile is not None:
+        startTime = time.perf_counter()
+    model = modelSection.content[0]
+    for field in getModelFieldsByName(modelSection.structureDescription, fieldNames):
+        field.resolveIndexReferences(model, sections)
+    if profile is not None:
+        profile.addSection("resolve", modelSection, startTime, 0)
+
+
+def checkThatAllSectionsGotReferenced(sections, referenceGraph=None):
+    """Raises an exception if there are sections which are not referenced, see ReferenceGraph
+
+    For each unreferenced section the raw bytes of all sections get searched for possible references to it, which
+    the structure definitions don't know yet. The search is done once for all unreferenced sections."""
+    if referenceGraph is None:
+        referenceGraph = ReferenceGraph(sections)
+    unreferencedSectionIndices = referenceGraph.getUnreferencedSectionIndices()
+    if len(unreferencedSectionIndices) == 0:
+        return
+
+    referenceStructureDescription = structures["SmallReference"].getVersion(0)
+    bytesToSearchToSectionIndexMap = {}
+    for sectionIndex in unreferencedSectionIndices:
+        reference = referenceStructureDescription.createInstance()
+        reference.entries = sections[sectionIndex].indexEntry.repetitions
+        reference.index = sectionIndex
+        bytesToSearchToSectionIndexMap[bytes(referenceStructureDescription.instancesToBytes([reference]))] = sectionIndex
+    # The lookahead makes finditer report overlapping matches too, so no possible reference gets hidden by another
+    bytesToSearchPattern = re.compile(b"(?=(" + b"|".join(re.escape(bytesToSearch) for bytesToSearch in bytesToSearchToSectionIndexMap) + b"))")
+    sectionIndexToPossibleReferencesMap = {}
+    for sectionToCheck in sections:
+        foundSectionIndices = set()
+        for match in bytesToSearchPattern.finditer(sectionToCheck.rawBytes):
+            sectionIndex = bytesToSearchToSectionIndexMap[match.group(1)]
+            if sectionIndex not in foundSectionIndices:
+                foundSectionIndices.add(sectionIndex)
+                sectionIndexToPossibleReferencesMap.setdefault(sectionIndex, []).append((sectionToCheck, match.start()))
+
+    for sectionIndex in unreferencedSectionIndices:
+        section = sections[sectionIndex]
+        timesReferenced = len(referenceGraph.getReferencesTo(sectionIndex))
+        stderr.write("WARNING: %sV%s (%d repetitions) got %d times referenced\n" % (section.indexEntry.tag, section.indexEntry.version, section.indexEntry.repetitions, timesReferenced))
+        for sectionToCheck, positionInSection in sectionIndexToPossibleReferencesMap.get(sectionIndex, []):
+            flagBytes = sectionToCheck.rawBytes[positionInSection + 8:positionInSection + 12]
+            flagsAsHex = ''.join(["%02x" % x for x in flagBytes])
+            stderr.write("  -> Found possible reference at offset %d in a section of type %sV%s with flag %s\n" % (
+                positionInSection % sectionToCheck.structureDescription.size,
+                sectionToCheck.indexEntry.tag,
+                sectionToCheck.indexEntry.version,
+                flagsAsHex
+            ))
+            sectionToCheck.structureDescription.dumpOffsets()
+
+    raise Exception("Unable to load all data: There were %d unreferenced sections. View log for details" % len(unreferencedSectionIndices))
+
+
+def loadModel(filename, checkExpectedValue=True, mmap=False, lazy=False, numpyArrays=False, trackChanges=False, fields=None, validation="full"):
+    """Loads the model of a m3 file
+
+    With lazy=True only the sections which get accessed get decoded. The check for unreferenced sections
+    and the validation of the model get skipped in that case, since they would need to decode everything.
+
+    With fields, e.g. fields=["bones", "sequences"], only the sections reachable from the given reference fields
+    of the model get decoded. The other reference fields of the model keep their index references, so the model
+    can't be saved, but its loaded parts can still be changed with patchModel when trackChanges is True.
+    Only the given fields get validated and the check for unreferenced sections gets skipped.
+
+    validation is one of validationLevels, see M3StructureDescription.validateInstances. Decoded models have
+    valid field values by construction, so "none" is fine for models which don't get changed before saving.
+
+    The ReferenceGraph of the sections is available via getReferenceGraphOf, except for lazy=True and fields.
+
+    With trackChanges=True the loaded objects and lists remember their section and mark it as modified when they
+    get changed. saveModel writes the raw bytes of unmodified sections then instead of encoding them again.
+    Byte arrays of U8__ sections get compared with their raw bytes instead, since they can't track changes."""
+    if lazy and fields is not None:
+        raise Exception("Lazy loading can't be combined with loading only some fields")
+    sections = loadSections(filename, checkExpectedValue, mmap, lazy, numpyArrays, trackChanges, fields)
+    referenceGraph = None
+    if fields is not None:
+        resolveReferencesOfModelFields(sections, fields)
+    elif not lazy:
+        referenceGraph = resolveReferencesOfSections(sections)
+        checkThatAllSectionsGotReferenced(sections, referenceGraph)
+    if trackChanges and not lazy:
+        for section in sections:
+            section.trackChanges()
     header = sections[0].content[0]
     model = header.model[0]
-    modelDescription = model.structureDescription
-    modelDescription.validateInstance(model, "model")
+    if referenceGraph is not None:
+        modelSection = sections[referenceGraph.getSectionIndexOf(header.model)]
+        modelSection.referenceGraph = referenceGraph
+        if not trackChanges:
+            model.m3Owner = modelSection
+    if fields is not None:
+        if validation != "none":
+            if profile is not None:
+                startTime = time.perf_counter()
+            modelDescription = model.structureDescription
+            modelDescription.validateFields(model, "model", getModelFieldsByName(modelDescription, fields), level=validation)
+            if profile is not None:
+                profile.add("validate", modelDescription.structureName, modelDescription.structureVersion, time.perf_counter() - startTime, 0, 1)
+    elif not lazy:
+        if profile is not None:
+            validateModelSectionBySection(model, sections, validation)
+        else:
+            modelDescription = model.structureDescription
+            modelDescription.validateInstance(model, "model", level=validation)
     return model
 
 
+def getVertexStructureDescription(vFlags):
+    vertexStructureName = "VertexFormat" + hex(vFlags)
+    if vertexStructureName not in structures:
+        raise Exception("Vertex flags %s can't be handled yet" % hex(vFlags))
+    return structures[vertexStructureName].getVersion(0)
+
+
+class VertexBuffer:
+    """Provides the vertices of a model as numpy arrays
+
+    The vertices get stored as U8__ blob in MODL.vertices, using the layout of the structure VertexFormat<vFlags>.
+    The arrays returned by positions, boneWeights, boneLookupIndices, uvs and colors are views of the records,
+    so modifying them modifies the buffer. The fixed8 values of normals, signs and tangents get converted from and to
+    floats like by Fixed8Field. toBytes returns the records in the exact layout required for MODL.vertices."""
+
+    def __init__(self, vFlags, count=0, buffer=None):
+        np = importNumpy()
+        if np is None:
+            raise Exception("numpy is required for VertexBuffer")
+        self.vFlags = vFlags
+        self.structureDescription = getVertexStructureDescription(vFlags)
+        dtype = self.structureDescription.numpyDtype
+        if buffer is None:
+            self.records = np.zeros(count, dtype=dtype)
+        else:
+            size = self.structureDescription.size
+            if len(buffer) % size != 0:
+                raise Exception("The vertex buffer has a size of %d bytes, which is not a multiple of the size %d of %s" % (len(buffer), size, self.structureDescription.structureName))
+            # Uses the memory of the buffer, which gets modified together with the arrays if it is a bytearray:
+            self.records = np.frombuffer(buffer, dtype=dtype)
+        self.fieldOffsets = {}
+        offset = 0
+        for field in self.structureDescription.fields:
+            self.fieldOffsets[field.name] = offset
+            offset += field.size
+
+    def __len__(self):
+        return len(self.records)
+
+    def hasField(self, fieldName):
+        return fieldName in self.fieldOffsets
+
+    def view(self, firstFieldName, numpyFormat, shape):
+        """Returns the values of consecutive fields with the same type as array with the given shape per vertex"""
+        dtype = importNumpy().dtype({
+            "names": ["values"],
+            "formats": [(numpyFormat, shape)],
+            "offsets": [self.fieldOffsets[firstFieldName]],
+            "itemsize": self.structureDescription.size
+        })
+        return self.records.view(dtype)["values"]
+
+    def setFixed8Values(self, view, values):
+        np = importNumpy()
+        intValues = np.round((np.asarray(values, dtype=np.float64) + 1) / 2.0 * 255.0)
+        if np.any(intValues < 0) or np.any(intValues > 255):
+            raise Exception("Fixed8 values must be in range [-1, 1]")
+        view[...] = intValues
+
+    @property
+    def positions(self):
+        return self.view("position", "<f4", (3,))
+
+    @positions.setter
+    def positions(self, values):
+        self.positions[...] = values
+
+    @property
+    def boneWeights(self):
+        return self.view("boneWeight0", "u1", (4,))
+
+    @boneWeights.setter
+    def boneWeights(self, values):
+        self.boneWeights[...] = values
+
+    @property
+    def boneLookupIndices(self):
+        return self.view("boneLookupIndex0", "u1", (4,))
+
+    @boneLookupIndices.setter
+    def boneLookupIndices(self, values):
+        self.boneLookupIndices[...] = values
+
+    @property
+    def normals(self):
+        return self.view("normal", "u1", (3,)) / 255.0 * 2.0 - 1
+
+    @normals.setter
+    def normals(self, values):
+        self.setFixed8Values(self.view("normal", "u1", (3,)), values)
+
+    @property
+    def signs(self):
+        return self.view("sign", "u1", ()) / 255.0 * 2.0 - 1
+
+    @signs.setter
+    def signs(self, values):
+        self.setFixed8Values(self.view("sign", "u1", ()), values)
+
+    @property
+    def tangents(self):
+        return self.view("tangent", "u1", (3,)) / 255.0 * 2.0 - 1
+
+    @tangents.setter
+    def tangents(self, values):
+        self.setFixed8Values(self.view("tangent", "u1", (3,)), values)
+
+    @property
+    def uvs(self):
+        """List with one int16 array of shape (count, 2) for each UV channel"""
+        uvs = []
+        for uvIndex in range(4):
+            fieldName = "uv%d" % uvIndex
+            if self.hasField(fieldName):
+                uvs.append(self.view(fieldName, "<i2", (2,)))
+        return uvs
+
+    @property
+    def colors(self):
+        """Array of shape (count, 4) with the blue, green, red and alpha values or None"""
+        if not self.hasField("color"):
+            return None
+        return self.view("color", "u1", (4,))
+
+    def toBytes(self):
+        return bytearray(self.records.tobytes())
+
+
+def loadVertexBuffer(model):
+    """Returns a VertexBuffer for MODL.vertices of the model"""
+    return VertexBuffer(model.vFlags, buffer=model.vertices)
+
+
 class IndexReferenceSourceAndSectionListMaker:
-    """ Creates a list of sections which are needed to store the objects for which index references are requested"""
-    def __init__(self):
+    """ Creates a list of sections which are needed to store the objects for which index references are requested
+
+    If the sections of a model loaded with trackChanges=True get passed, the references of unmodified sections
+    get taken from the loaded sections instead of visiting their objects."""
+    def __init__(self, loadedSections=None):
         self.objectsIdToIndexReferenceMap = {}
+        self.emptyIndexReferences = {}
         self.offset = 0
         self.nextFreeIndexPosition = 0
         self.sections = []
         self.MD34IndexEntry = structures["MD34IndexEntry"].getVersion(0)
+        self.loadedSections = loadedSections
+        if loadedSections is not None:
+            self.ReferenceV0 = structures["Reference"].getVersion(0)
+            self.loadedSectionIndexToReferencedSectionIndicesMap = {}
+            self.loadedContentIdToSectionIndexMap = {}
+            for sectionIndex, section in enumerate(loadedSections):
+                if section.content is not None:
+                    self.loadedContentIdToSectionIndexMap[id(section.content)] = sectionIndex
+
+    def getIndexOfUnmodifiedSection(self, objectsToSave):
+        """Returns the index of the loaded section, whose unmodified content the objects are, or None"""
+        if self.loadedSections is None:
+            return None
+        sectionIndex = self.loadedContentIdToSectionIndexMap.get(id(objectsToSave))
+        if sectionIndex is None:
+            return None
+        section = self.loadedSections[sectionIndex]
+        if section.content is not objectsToSave or section.modified:
+            return None
+        if section.structureDescription.structureName == "U8__":
+            if len(objectsToSave) != section.indexEntry.repetitions or objectsToSave != section.rawBytes[:len(objectsToSave)]:
+                return None
+        for emptyObjects in section.emptyReferencedObjects:
+            if len(emptyObjects) != 0:
+                return None
+        return sectionIndex
+
+    def collectIndexReferencesOf(self, objectsToSave):
+        """Determines the index references which are needed by the references of the objects"""
+        sectionIndex = self.getIndexOfUnmodifiedSection(objectsToSave)
+        if sectionIndex is None:
+            for objectToSave in objectsToSave:
+                objectToSave.collectIndexReferences(self)
+            return
+        for referencedSectionIndex in self.getReferencedSectionIndices(sectionIndex):
+            referencedSection = self.loadedSections[referencedSectionIndex]
+            referencedObjects = referencedSection.content
+            if self.hasIndexReferenceTo(referencedObjects):
+                continue
+            structureDescription = referencedSection.structureDescription
+            self.getIndexReferenceTo(referencedObjects, self.ReferenceV0, structureDescription)
+            if structureDescription.hasReferences:
+                self.collectIndexReferencesOf(referencedObjects)
+
+    def getReferencedSectionIndices(self, sectionIndex):
+        """Returns the indices of the sections referenced by the raw bytes of a loaded section"""
+        referencedSectionIndices = self.loadedSectionIndexToReferencedSectionIndicesMap.get(sectionIndex)
+        if referencedSectionIndices is None:
+            section = self.loadedSections[sectionIndex]
+            if section.structureDescription.hasReferences:
+                referencedSectionIndices = section.structureDescription.getReferencedSectionIndices(section.rawBytes, section.indexEntry.repetitions)
+            else:
+                referencedSectionIndices = []
+            self.loadedSectionIndexToReferencedSectionIndicesMap[sectionIndex] = referencedSectionIndices
+        return referencedSectionIndices
+
+    def orderSectionsLikeLoadedSections(self):
+        """Sorts the sections by the index they had in the loaded file, which keeps the references of unmodified sections valid
+
+        The header stays the first section, sections with new content come after the loaded ones."""
+        def getLoadedSectionIndex(section):
+            sectionIndex = self.loadedContentIdToSectionIndexMap.get(id(section.content))
+            if sectionIndex is None or self.loadedSections[sectionIndex].content is not section.content:
+                return len(self.loadedSections)
+            return sectionIndex
+        self.sections[1:] = sorted(self.sections[1:], key=getLoadedSectionIndex)
+        self.offset = 0
+        for sectionIndex, section in enumerate(self.sections):
+            self.objectsIdToIndexReferenceMap[id(section.content)].index = sectionIndex
+            section.indexEntry.offset = self.offset
+            self.offset += increaseToValidSectionSize(section.bytesRequiredForContent())
+
+    def getUnmodifiedRawBytes(self, section):
+        """Returns the loaded raw bytes of a section, if they can be written without encoding the content again
+
+        That's the case if the content did not change and the sections it references have the same index and size as before."""
+        sectionIndex = self.getIndexOfUnmodifiedSection(section.content)
+        if sectionIndex is None:
+            return None
+        loadedSection = self.loadedSections[sectionIndex]
+        loadedDescription = loadedSection.structureDescription
+        structureDescription = section.structureDescription
+        if loadedDescription.structureName != structureDescription.structureName or loadedDescription.structureVersion != structureDescription.structureVersion or loadedDescription.size != structureDescription.size:
+            return None
+        for referencedSectionIndex in self.getReferencedSectionIndices(sectionIndex):
+            referencedSection = self.loadedSections[referencedSectionIndex]
+            indexReference = self.objectsIdToIndexReferenceMap.get(id(referencedSection.content))
+            if indexReference is None or indexReference.index != referencedSectionIndex or indexReference.entries != referencedSection.indexEntry.repetitions:
+                return None
+        return loadedSection.rawBytes
+
+    def validateSectionsToEncode(self, level="full"):
+        """Validates the objects of the sections whose raw bytes can't be taken from the loaded sections
+
+        Referenced objects get validated with their own section, so unmodified ones don't get validated again."""
+        if level == "none":
+            return
+        for section in self.sections:
+            structureDescription = section.structureDescription
+            if structureDescription.isPrimitive or isNumpyArray(section.content) or self.getUnmodifiedRawBytes(section) is not None:
+                continue
+            if profile is not None:
+                startTime = time.perf_counter()
+            structureDescription.validateInstances(section.content, section.indexEntry.tag, validateReferencedObjects=False, level=level)
+            if profile is not None:
+                profile.addSection("validate", section, startTime, 0)
+
+    def hasIndexReferenceTo(self, objectsToSave):
+        return id(objectsToSave) in self.objectsIdToIndexReferenceMap
+
+    def getExistingIndexReferenceTo(self, objectsToSave, referenceStructureDescription):
+        """Returns the index reference created by getIndexReferenceTo or an empty one for objects without a section"""
+        indexReference = self.objectsIdToIndexReferenceMap.get(id(objectsToSave))
+        if indexReference is None:
+            indexReference = self.emptyIndexReferences.get(referenceStructureDescription)
+            if indexReference is None:
+                indexReference = referenceStructureDescription.createInstance()
+                self.emptyIndexReferences[referenceStructureDescription] = indexReference
+        return indexReference
 
     def getIndexReferenceTo(self, objectsToSave, referenceStructureDescription, structureDescription):
         if id(objectsToSave) in self.objectsIdToIndexReferenceMap.keys():
@@ -1294,18 +2998,118 @@ def modelToSections(model):
     header.tag = "MD34"
     header.model = [model]
     ReferenceV0 = structures["Reference"].getVersion(0)
+    if profile is not None:
+        startTime = time.perf_counter()
     indexMaker = IndexReferenceSourceAndSectionListMaker()
     indexMaker.getIndexReferenceTo([header], ReferenceV0, MD34V11)
     header.introduceIndexReferences(indexMaker)
     sections = indexMaker.sections
     header.indexOffset = indexMaker.offset
     header.indexSize = len(sections)
+    if profile is not None:
+        profile.add("layout", "MD34", 11, time.perf_counter() - startTime, 0, len(sections))
 
     for section in sections:
+        if profile is not None:
+            startTime = time.perf_counter()
         section.determineFieldRawBytes()
+        if profile is not None:
+            profile.addSection("encode", section, startTime, len(section.rawBytes))
     return sections
 
 
+def getReferenceGraphOf(model):
+    """Returns the ReferenceGraph of the sections a model got loaded from, or None, e.g. if it was loaded with lazy=True"""
+    modelSection = getattr(model, "m3Owner", None)
+    if modelSection is None:
+        return None
+    return modelSection.referenceGraph
+
+
+def getLoadedSectionsOf(model):
+    """Returns the sections of a model loaded with trackChanges=True, otherwise None"""
+    modelSection = getattr(model, "m3Owner", None)
+    if modelSection is None:
+        return None
+    return modelSection.loadedSections
+
+
+def layoutSectionsOfModel(model):
+    """Like modelToSections, but without modifying the model and without creating the raw bytes of the sections
+
+    The index references get stored in the returned index maker, whose sections field contains the sections.
+    The sections of a model loaded with trackChanges=True keep the order they had in the loaded file."""
+    MD34V11 = structures["MD34"].getVersion(11)
+    header = MD34V11.createInstance()
+    header.tag = "MD34"
+    header.model = [model]
+    loadedSections = getLoadedSectionsOf(model)
+    if loadedSections is not None:
+        loadedModelList = loadedSections[0].content[0].model
+        if len(loadedModelList) == 1 and loadedModelList[0] is model:
+            header.model = loadedModelList
+    ReferenceV0 = structures["Reference"].getVersion(0)
+    if profile is not None:
+        startTime = time.perf_counter()
+    indexMaker = IndexReferenceSourceAndSectionListMaker(loadedSections)
+    indexMaker.getIndexReferenceTo([header], ReferenceV0, MD34V11)
+    header.collectIndexReferences(indexMaker)
+    if loadedSections is not None:
+        indexMaker.orderSectionsLikeLoadedSections()
+    sections = indexMaker.sections
+    header.indexOffset = indexMaker.offset
+    header.indexSize = len(sections)
+    if profile is not None:
+        profile.add("layout", "MD34", 11, time.perf_counter() - startTime, 0, len(sections))
+    return indexMaker
+
+
+def writeSections(sections, fileObject, indexMaker=None):
+    """Encodes the sections one after another and writes them and the index to a binary file object
+
+    The offsets of the index entries must have been determined before, e.g. by layoutSectionsOfModel.
+    Only the bytes of one section are held in memory at a time. Unmodified loaded sections get copied
+    from their raw bytes, see IndexReferenceSourceAndSectionListMaker.getUnmodifiedRawBytes."""
+    header = sections[0].content[0]
+    offset = 0
+    for sectionIndex, section in enumerate(sections):
+        if section.indexEntry.offset != offset:
+            raise Exception("Section length problem: Expected section with index entry %s at offset %s" % (section.indexEntry, offset))
+        if sectionIndex + 1 < len(sections):
+            nextOffset = sections[sectionIndex + 1].indexEntry.offset
+        else:
+            nextOffset = header.indexOffset
+        if profile is not None:
+            startTime = time.perf_counter()
+        if indexMaker is not None:
+            rawBytes = indexMaker.getUnmodifiedRawBytes(section)
+        else:
+            rawBytes = None
+        if rawBytes is not None:
+            numberOfBytes = section.bytesRequiredForContent()
+            if increaseToValidSectionSize(numberOfBytes) != nextOffset - offset:
+                raise Exception("Section size calculation failed: %s requires %s bytes, but %s bytes were reserved" % (section.indexEntry, numberOfBytes, nextOffset - offset))
+            fileObject.write(rawBytes[:numberOfBytes])
+            fileObject.write(b"\xaa" * (nextOffset - offset - numberOfBytes))
+            if profile is not None:
+                profile.addSection("copy", section, startTime, nextOffset - offset)
+        else:
+            buffer = bytearray(nextOffset - offset)
+            numberOfBytes = section.structureDescription.writeInstancesToBuffer(section.content, buffer, 0, indexMaker)
+            if increaseToValidSectionSize(numberOfBytes) != len(buffer):
+                raise Exception("Section size calculation failed: %s requires %s bytes, but %s bytes were reserved" % (section.indexEntry, numberOfBytes, len(buffer)))
+            buffer[numberOfBytes:] = b"\xaa" * (len(buffer) - numberOfBytes)
+            fileObject.write(buffer)
+            if profile is not None:
+                profile.addSection("encode", section, startTime, len(buffer))
+        offset = nextOffset
+
+    indexEntryDescription = structures["MD34IndexEntry"].getVersion(0)
+    buffer = bytearray(len(sections) * indexEntryDescription.size)
+    indexEntryDescription.writeInstances([section.indexEntry for section in sections], buffer, 0)
+    fileObject.write(buffer)
+
+
 def saveSections(sections, filename):
     fileObject = open(filename, "w+b")
     try:
@@ -1313,7 +3117,11 @@ def saveSections(sections, filename):
         for section in sections:
             if section.indexEntry.offset != fileObject.tell():
                 raise Exception("Section length problem: Section with index entry %(previousIndexEntry)s has length %(previousLength)s and gets followed by section with index entry %(currentIndexEntry)s" % {"previousIndexEntry": previousSection.indexEntry, "previousLength": len(previousSection.rawBytes), "currentIndexEntry": section.indexEntry})
+            if profile is not None:
+                startTime = time.perf_counter()
             fileObject.write(section.rawBytes)
+            if profile is not None:
+                profile.addSection("write", section, startTime, len(section.rawBytes))
             previousSection = section
         header = sections[0].content[0]
         if fileObject.tell() != header.indexOffset:
@@ -1326,18 +3134,227 @@ def saveSections(sections, filename):
         fileObject.close()
 
 
-def saveAndInvalidateModel(model, filename):
+def saveModel(model, filename, validation="full"):
+    """Saves the model without modifying it, so it can be saved again or used otherwise afterwards
+
+    filename can also be a binary file object, to which the model gets written.
+    Of a model loaded with trackChanges=True only the modified sections get validated and encoded again.
+    validation is one of validationLevels, see M3StructureDescription.validateInstances."""
+    if getLoadedSectionsOf(model) is None:
+        if profile is not None:
+            try:
+                indexMaker = layoutSectionsOfModel(model)
+            except Exception:
+                model.structureDescription.validateInstance(model, "model", level=validation)
+                raise
+            validateModelSectionBySection(model, indexMaker.sections, validation)
+        else:
+            model.structureDescription.validateInstance(model, "model", level=validation)
+            indexMaker = layoutSectionsOfModel(model)
+    else:
+        indexMaker = layoutSectionsOfModel(model)
+        indexMaker.validateSectionsToEncode(validation)
+    if hasattr(filename, "write"):
+        writeSections(indexMaker.sections, filename, indexMaker)
+    else:
+        with open(filename, "wb") as fileObject:
+            writeSections(indexMaker.sections, fileObject, indexMaker)
+
+
+def findChangedByteRanges(oldBytes, newBytes, chunkSize=64):
+    """Compares the bytes chunk by chunk and returns a list of [offset, length] pairs of the ranges which differ"""
+    changedRanges = []
+    for offset in range(0, len(newBytes), chunkSize):
+        end = min(offset + chunkSize, len(newBytes))
+        if oldBytes[offset:end] != newBytes[offset:end]:
+            if len(changedRanges) > 0 and changedRanges[-1][0] + changedRanges[-1][1] == offset:
+                changedRanges[-1][1] += end - offset
+            else:
+                changedRanges.append([offset, end - offset])
+    return changedRanges
+
+
+class LoadedSectionIndexReferenceSource:
+    """Provides the index references of the content of loaded sections like IndexReferenceSourceAndSectionListMaker
+
+    Used for encoding records again without changing the layout of the loaded file, see patchModel."""
+    def __init__(self, loadedSections):
+        self.loadedSections = loadedSections
+        self.contentIdToSectionIndexMap = {}
+        for sectionIndex, section in enumerate(loadedSections):
+            if section.content is not None:  # not decoded, see loadModel(..., fields=...)
+                self.contentIdToSectionIndexMap[id(section.content)] = sectionIndex
+        self.indexReferences = {}
+
+    def getExistingIndexReferenceTo(self, objectsToSave, referenceStructureDescription):
+        """Returns an empty index reference for objects which are not the content of a loaded section"""
+        sectionIndex = self.contentIdToSectionIndexMap.get(id(objectsToSave))
+        if sectionIndex is None or self.loadedSections[sectionIndex].content is not objectsToSave:
+            sectionIndex = None
+        indexReference = self.indexReferences.get((sectionIndex, referenceStructureDescription))
+        if indexReference is None:
+            indexReference = referenceStructureDescription.createInstance()
+            if sectionIndex is not None:
+                indexReference.entries = self.loadedSections[sectionIndex].indexEntry.repetitions
+                indexReference.index = sectionIndex
+            self.indexReferences[(sectionIndex, referenceStructureDescription)] = indexReference
+        return indexReference
+
+
+def determinePatchesOfSection(section, indexReferenceSource):
+    """Returns the changed bytes of a loaded section as (offset in section, bytes) pairs
+
+    Raises an exception if the changes can't be stored without changing the layout of the file."""
+    content = section.content
+    structureDescription = section.structureDescription
+    indexEntry = section.indexEntry
+    for emptyObjects in section.emptyReferencedObjects:
+        if len(emptyObjects) != 0:
+            raise Exception("Can't patch the %s section at offset %d since an empty list of it got filled" % (indexEntry.tag, indexEntry.offset))
+    if content is None or structureDescription.structureName == "CHAR" or isNumpyArray(content) or (isinstance(content, LazySectionList) and content.section is not None):
+        return []  # unmodifiable or not decoded
+    if structureDescription.structureName == "U8__":
+        if len(content) == indexEntry.repetitions and content == section.rawBytes[:len(content)]:
+            return []
+    elif not section.modified:
+        return []
+    if structureDescription.countInstances(content) != indexEntry.repetitions:
+        raise Exception("Can't patch the %s section at offset %d since its number of elements changed from %d to %d" % (indexEntry.tag, indexEntry.offset, indexEntry.repetitions, structureDescription.countInstances(content)))
+
+    if structureDescription.isPrimitive or section.modifiedRecords is None:
+        positions = [0]
+        recordSize = structureDescription.size * indexEntry.repetitions
+        objectLists = [content]
+    else:
+        if len(section.modifiedRecords) > 16:
+            recordIdToPositionMap = {id(record): position for position, record in enumerate(content)}
+            positions = sorted(recordIdToPositionMap[id(record)] for record in section.modifiedRecords)
+        else:
+            positions = sorted(content.index(record) for record in section.modifiedRecords)
+        recordSize = structureDescription.size
+        objectLists = [[content[position]] for position in positions]
+
+    patches = []
+    for position, objects in zip(positions, objectLists):
+        if not structureDescription.isPrimitive:
+            for record in objects:
+                if record.structureDescription is not structureDescription:
+                    raise Exception("Can't patch the %s section at offset %d since it would contain %sV%d records" % (indexEntry.tag, indexEntry.offset, record.structureDescription.structureName, record.structureDescription.structureVersion))
+        offset = position * structureDescription.size
+        buffer = bytearray(recordSize)
+        structureDescription.writeInstancesToBuffer(objects, buffer, 0, indexReferenceSource)
+        oldBytes = section.rawBytes[offset:offset + recordSize]
+        if structureDescription.hasReferences:
+            for recordOffset in range(0, recordSize, structureDescription.size):
+                if structureDescription.referenceStruct.unpack_from(oldBytes, recordOffset) != structureDescription.referenceStruct.unpack_from(buffer, recordOffset):
+                    raise Exception("Can't patch the %s section at offset %d since the references of a record changed" % (indexEntry.tag, indexEntry.offset))
+        for changedOffset, length in findChangedByteRanges(oldBytes, buffer):
+            patches.append((offset + changedOffset, buffer[changedOffset:changedOffset + length]))
+    return patches
+
+
+def patchModel(model, target, validation="full"):
+    """Writes the changes of a model loaded with trackChanges=True into a file with the content of the loaded file
+
+    target is the name of the loaded file or of a copy of it, or a writable buffer with the content of the file,
+    e.g. a bytearray or a mmap created with ACCESS_WRITE. Only the modified records get validated and encoded again
+    and only the bytes which changed get written at the offsets of the records in the file. So the needed time
+    depends on the number of edits and not on the size of the file.
+
+    Changes which would alter the size or the index of a section can't be patched, e.g. adding elements to a list or
+    replacing a list or string by another object. An exception gets raised for them before anything gets written
+    and saveModel has to be used instead.
+    Returns the number of written bytes."""
+    loadedSections = getLoadedSectionsOf(model)
+    if loadedSections is None:
+        raise Exception("Only models loaded with trackChanges=True can be patched")
+    indexReferenceSource = LoadedSectionIndexReferenceSource(loadedSections)
+    sectionPatches = []
+    for section in loadedSections:
+        if section.modified and not section.structureDescription.isPrimitive:
+            if section.modifiedRecords is None:
+                records = section.content
+            else:
+                records = section.modifiedRecords
+            for record in records:
+                instanceName = "%s at offset %d" % (section.indexEntry.tag, section.indexEntry.offset)
+                record.structureDescription.validateInstance(record, instanceName, validateReferencedObjects=False, level=validation)
+        patches = determinePatchesOfSection(section, indexReferenceSource)
+        if len(patches) > 0:
+            sectionPatches.append((section, patches))
+
+    if hasattr(target, "__setitem__"):
+        for section, patches in sectionPatches:
+            for offset, patch in patches:
+                fileOffset = section.indexEntry.offset + offset
+                target[fileOffset:fileOffset + len(patch)] = patch
+    else:
+        with open(target, "r+b") as fileObject:
+            for section, patches in sectionPatches:
+                for offset, patch in patches:
+                    fileObject.seek(section.indexEntry.offset + offset)
+                    fileObject.write(patch)
+
+    # The written content is the loaded content now:
+    for section in loadedSections:
+        section.modified = False
+        section.modifiedRecords = set()
+    for section, patches in sectionPatches:
+        rawBytes = bytearray(section.rawBytes)
+        for offset, patch in patches:
+            rawBytes[offset:offset + len(patch)] = patch
+        section.rawBytes = rawBytes
+    return sum(len(patch) for section, patches in sectionPatches for offset, patch in patches)
+
+
+def saveAndInvalidateModel(model, filename, validation="full"):
     '''Do not use the model object after calling this method since it gets modified'''
-    model.structureDescription.validateInstance(model, "model")
+    if profile is not None:
+        startTime = time.perf_counter()
+    model.structureDescription.validateInstance(model, "model", level=validation)
+    if profile is not None:
+        # The sections are not known yet, so the time of all structures gets recorded for the model
+        profile.add("validate", model.structureDescription.structureName, model.structureDescription.structureVersion, time.perf_counter() - startTime, 0, 1)
     sections = modelToSections(model)
     saveSections(sections, filename)
 
 
 def readStructures():
-    from os import path
-    directory = path.dirname(__file__)
-    structuresXmlPath = path.join(directory, "structures.xml")
-    return readStructureDefinitions(structuresXmlPath)
+    global structuresXmlHash
+    directory = os.path.dirname(__file__)
+    structuresXmlPath = os.path.join(directory, "structures.xml")
+    cachePath = os.path.join(directory, "structures.cache")
+    structuresXmlHash, schemaData = loadSchemaData(structuresXmlPath, cachePath)
+    return createStructuresFromSchemaData(schemaData)
+
+
+def determineUserCacheDirectory():
+    """Returns the directory for caches of the current user, e.g. ~/.cache/m3addon on Linux
+
+    Caches don't get written next to m3.py, since the addon might be installed in a directory which is not writable."""
+    if sys.platform == "win32":
+        baseDirectory = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        baseDirectory = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else:
+        baseDirectory = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(baseDirectory, "m3addon")
+
+
+def validateSchema(structuresToValidate=None):
+    """Creates the descriptions of all structure versions, so that errors in structures.xml get reported at once
+
+    Otherwise the structure descriptions get created and checked when they are needed for the first time."""
+    if structuresToValidate is None:
+        structuresToValidate = structures
+    for structureHistory in structuresToValidate.values():
+        structureHistory.validate()
 
 
+# Directory for the compiled generated functions, None disables the cache
+generatedCodeCacheDirectory = os.path.join(determineUserCacheDirectory(), "generated-code")
+generatedCodeCacheMaxSize = 32 * 1024 * 1024
+# The Profile which records the costs of loading and saving, see enableProfiling
+profile = None
+structuresXmlHash = None
 structures = readStructures()
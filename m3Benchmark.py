@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import m3
+import sys
+import argparse
+import os
+import io
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from createSyntheticModel import createSyntheticModel
+
+# The counts of the models which get created by createSyntheticModel for each tier
+tiers = {
+    "small": {"vertices": 2000, "regions": 1, "bones": 10, "sequences": 2, "stcsPerSequence": 1, "particleSystems": 1, "materials": 1},
+    "medium": {"vertices": 50000, "regions": 4, "bones": 60, "sequences": 10, "stcsPerSequence": 2, "particleSystems": 8, "materials": 6},
+    "large": {"vertices": 250000, "regions": 8, "bones": 150, "sequences": 30, "stcsPerSequence": 3, "particleSystems": 20, "materials": 16},
+}
+
+benchmarkNames = ["loadSections", "loadModel", "validateFull", "validateStructural", "modelToSections", "saveSections", "saveModel"]
+
+
+def measure(function, prepare, repeat):
+    """Calls function repeat times with the result of prepare and returns the durations in seconds
+
+    prepare gets called before each measurement, so that e.g. a model that gets modified can be loaded again."""
+    durations = []
+    for i in range(repeat):
+        argument = prepare()
+        gc.collect()
+        startTime = time.perf_counter()
+        function(argument)
+        durations.append(time.perf_counter() - startTime)
+        del argument
+    return durations
+
+
+def runBenchmarksOfFile(m3FilePath, repeat, outputDirectory):
+    """Returns a dict with the durations of each benchmark for a m3 file"""
+    def loadModel(validation="none"):
+        return m3.loadModel(m3FilePath, validation=validation)
+
+    outputFilePath = os.path.join(outputDirectory, "saved.m3")
+    benchmarks = {
+        "loadSections": (lambda path: m3.loadSections(path), lambda: m3FilePath),
+        "loadModel": (lambda path: m3.loadModel(path, validation="none"), lambda: m3FilePath),
+        "validateFull": (lambda model: model.structureDescription.validateInstance(model, "model", level="full"), loadModel),
+        "validateStructural": (lambda model: model.structureDescription.validateInstance(model, "model", level="structural"), loadModel),
+        "modelToSections": (lambda model: m3.modelToSections(model), loadModel),
+        "saveSections": (lambda sections: m3.saveSections(sections, outputFilePath), lambda: m3.modelToSections(loadModel())),
+        "saveModel": (lambda model: m3.saveModel(model, io.BytesIO()), loadModel),
+    }
+    results = {}
+    for benchmarkName in benchmarkNames:
+        function, prepare = benchmarks[benchmarkName]
+        durations = measure(function, prepare, repeat)
+        results[benchmarkName] = {"min": min(durations), "median": sorted(durations)[len(durations) // 2], "durations": durations}
+    return results
+
+
+def determineCommit():
+    """Returns the git commit of the directory of m3.py or None"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(m3.__file__)), stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runBenchmarks(tierNames, repeat, seed, outputDirectory):
+    results = {
+        "commit": determineCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": repeat,
+        "seed": seed,
+        "tiers": {}}
+    for tierName in tierNames:
+        counts = tiers[tierName]
+        m3FilePath = os.path.join(outputDirectory, "%s.m3" % tierName)
+        t0 = time.perf_counter()
+        model = createSyntheticModel(seed=seed, **counts)
+        m3.saveAndInvalidateModel(model, m3FilePath)
+        del model
+        t1 = time.perf_counter()
+        sys.stderr.write("Created %s model with %d bytes in %.2f s\n" % (tierName, os.path.getsize(m3FilePath), t1 - t0))
+        results["tiers"][tierName] = {
+            "counts": counts,
+            "fileSize": os.path.getsize(m3FilePath),
+            "sections": len(m3.loadSections(m3FilePath)),
+            "benchmarks": runBenchmarksOfFile(m3FilePath, repeat, outputDirectory)}
+    return results
+
+
+def formatResults(results, previousResults=None):
+    """Returns a table with the minimal durations and, if previous results are given, the ratio to them"""
+    lines = ["%-8s %-20s %10s %10s %8s" % ("tier", "benchmark", "min [s]", "previous", "ratio")]
+    for tierName, tierResults in results["tiers"].items():
+        previousTierResults = None
+        if previousResults is not None:
+            previousTierResults = previousResults["tiers"].get(tierName)
+            if previousTierResults is not None and previousTierResults["counts"] != tierResults["counts"]:
+                previousTierResults = None  # not comparable
+        for benchmarkName, benchmarkResults in tierResults["benchmarks"].items():
+            previous, ratio = "", ""
+            if previousTierResults is not None and benchmarkName in previousTierResults["benchmarks"]:
+                previousMin = previousTierResults["benchmarks"][benchmarkName]["min"]
+                previous = "%.4f" % previousMin
+                ratio = "%.2f" % (benchmarkResults["min"] / previousMin) if previousMin > 0 else ""
+            lines.append("%-8s %-20s %10.4f %10s %8s" % (tierName, benchmarkName, benchmarkResults["min"], previous, ratio))
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure how long loading, validating and saving synthetic m3 models of different sizes takes.')
+    parser.add_argument('--tiers', default="small,medium,large", help='Comma separated tiers to run out of %s (default: all)' % ", ".join(tiers))
+    parser.add_argument('--repeat', '-n', type=int, default=5, help='Number of measurements per benchmark, the minimum gets compared (default: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the content of the synthetic models (default: 0)')
+    parser.add_argument('--output', '-o', default="benchmark.json", help='JSON file to write the results to (default: benchmark.json)')
+    parser.add_argument('--compare', '-c', help='JSON file with results of a previous run, e.g. of another commit, to compare with')
+    parser.add_argument('--model-directory', help='Directory in which the synthetic models get kept, by default a temporary directory gets used')
+    args = parser.parse_args()
+
+    tierNames = [tierName.strip() for tierName in args.tiers.split(",")]
+    for tierName in tierNames:
+        if tierName not in tiers:
+            sys.stderr.write("Unknown tier %s, expected one of %s\n" % (tierName, ", ".join(tiers)))
+            sys.exit(2)
+    previousResults = None
+    if args.compare is not None:
+        with open(args.compare, "r") as previousResultsFile:
+            previousResults = json.load(previousResultsFile)
+
+    if args.model_directory is not None:
+        os.makedirs(args.model_directory, exist_ok=True)
+        results = runBenchmarks(tierNames, args.repeat, args.seed, args.model_directory)
+    else:
+        modelDirectory = tempfile.mkdtemp(prefix="m3Benchmark")
+        try:
+            results = runBenchmarks(tierNames, args.repeat, args.seed, modelDirectory)
+        finally:
+            shutil.rmtree(modelDirectory, ignore_errors=True)
+
+    with open(args.output, "w") as outputFile:
+        json.dump(results, outputFile, indent=2)
+        outputFile.write("\n")
+    sys.stdout.write(formatResults(results, previousResults))
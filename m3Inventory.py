@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import sys
+import m3
+import argparse
+import os
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+csvColumns = ["file", "fmagic", "fileSize", "sectionIndex", "tag", "version", "repetitions", "offset", "size", "known", "error"]
+
+
+def probeFile(filePath):
+    """Returns the file path, the result of m3.probe and an error message, one of the last two is None"""
+    try:
+        return filePath, m3.probe(filePath), None
+    except Exception as e:
+        return filePath, None, "%s: %s" % (type(e).__name__, e)
+
+
+def findFiles(path, recurse, extensions):
+    if os.path.isfile(path):
+        yield path
+        return
+    for directory, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(extensions):
+                yield os.path.join(directory, file)
+        if not recurse:
+            break
+
+
+def writeCsv(results, outputFile):
+    """Writes a row per section and returns the number of files which could not be probed"""
+    failed = 0
+    writer = csv.writer(outputFile, lineterminator="\n")
+    writer.writerow(csvColumns)
+    for filePath, description, error in results:
+        if description is None:
+            writer.writerow([filePath, "", "", "", "", "", "", "", "", "", error])
+            failed += 1
+            continue
+        fmagic = description["fmagic"]
+        fileSize = description["fileSize"]
+        writer.writerows(
+            [filePath, fmagic, fileSize, sectionIndex, section["tag"], section["version"], section["repetitions"], section["offset"], section["size"], section["known"], ""]
+            for sectionIndex, section in enumerate(description["sections"]))
+    return failed
+
+
+def writeJson(results, outputFile):
+    """Writes a JSON list with an object per file on its own line and returns the number of files which could not be probed"""
+    failed = 0
+    outputFile.write("[")
+    separator = "\n"
+    for filePath, description, error in results:
+        if description is None:
+            entry = {"file": filePath, "error": error}
+            failed += 1
+        else:
+            entry = {"file": filePath}
+            entry.update(description)
+        outputFile.write(separator)
+        outputFile.write(json.dumps(entry))
+        separator = ",\n"
+    outputFile.write("\n]\n")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write an inventory of the sections of m3 files as CSV or JSON, by reading only their headers and indices.')
+    parser.add_argument('path', nargs='+', help="Either a *.m3 file or a directory with *.m3 files")
+    parser.add_argument('--output', '-o', help='File to write the inventory to, by default it gets written to stdout')
+    parser.add_argument('--format', '-f', choices=["csv", "json"], help='Format of the inventory, by default determined by the extension of the output file or csv')
+    parser.add_argument('-r', '--recurse', action='store_true', default=False, help='Recurse the input directories.')
+    parser.add_argument('--extensions', default=".m3,.m3a", help='Comma separated file extensions of the files to probe (default: .m3,.m3a)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='Number of processes which probe the files (default: number of CPUs)')
+    args = parser.parse_args()
+
+    for path in args.path:
+        if not os.path.isdir(path) and not os.path.isfile(path):
+            sys.stderr.write("Path %s is not a valid directory or file\n" % path)
+            sys.exit(2)
+
+    outputFormat = args.format
+    if outputFormat is None:
+        outputFormat = "json" if args.output is not None and args.output.lower().endswith(".json") else "csv"
+    extensions = tuple(extension.strip().lower() for extension in args.extensions.split(","))
+
+    t0 = time.time()
+    filePaths = []
+    for path in args.path:
+        filePaths.extend(findFiles(path, args.recurse, extensions))
+
+    executor = None
+    if args.jobs > 1 and len(filePaths) > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        results = executor.map(probeFile, filePaths, chunksize=max(1, min(64, len(filePaths) // (args.jobs * 4))))
+    else:
+        results = map(probeFile, filePaths)
+
+    if args.output is not None:
+        outputFile = open(args.output, "w", newline="")
+    else:
+        outputFile = sys.stdout
+    try:
+        # The results get written in the order of the files while the other files get probed
+        if outputFormat == "json":
+            failed = writeJson(results, outputFile)
+        else:
+            failed = writeCsv(results, outputFile)
+    finally:
+        if outputFile is not sys.stdout:
+            outputFile.close()
+        if executor is not None:
+            executor.shutdown()
+
+    t1 = time.time()
+    sys.stderr.write("%d files probed, %d failed in %.2f s\n" % (len(filePaths), failed, (t1 - t0)))
+    if failed > 0:
+        sys.exit(1)
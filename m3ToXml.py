@@ -24,18 +24,29 @@ import m3
 import argparse
 import os.path
 import os
-import io
 import time
 import traceback
 import re
+import operator
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from xml.sax.saxutils import escape
 
 
+# Byte arrays which are longer get written in chunks of this size, so that their hex string doesn't need to be created at once
+hexChunkSize = 1024 * 1024
+nonAsciiCharacterPattern = re.compile('[^\x20-\x7F]')
+indentations = ["\t" * level for level in range(32)]
+
+
 def byteDataToHex(byteData):
-    return '0x' + ''.join(["%02x" % x for x in byteData])
+    return '0x' + bytes(byteData).hex()
 
 
 def indent(level):
+    if level < len(indentations):
+        return indentations[level]
     return "\t" * level
 
 
@@ -52,28 +63,77 @@ def openCloseTag(name):
 
 
 def printXmlElement(out, level, name, value):
-    out.write(indent(level) + openTag(name) + value + closeTag(name))
+    out.write("%s<%s>%s</%s>\n" % (indent(level), name, value, name))
+
+
+def printByteData(out, level, name, byteData):
+    if len(byteData) <= hexChunkSize:
+        printXmlElement(out, level, name, byteDataToHex(byteData))
+        return
+    out.write("%s<%s>0x" % (indent(level), name))
+    byteDataView = memoryview(byteData)
+    for offset in range(0, len(byteData), hexChunkSize):
+        out.write(byteDataView[offset:offset + hexChunkSize].hex())
+    out.write(closeTag(name))
+
+
+# With compact=True primitive lists get written as text with this many values per line
+valuesPerLine = 16
 
 
-def printObject(out, level, name, value):
+def printValueLines(out, level, values):
+    lineIndent = indent(level)
+    for offset in range(0, len(values), valuesPerLine):
+        out.write("%s%s\n" % (lineIndent, " ".join(values[offset:offset + valuesPerLine])))
+
+
+def printPrimitiveList(out, level, name, value):
+    """Writes the values of a list of numbers separated by spaces as text of one element"""
+    values = [m3.formatTableValue(entry) for entry in value]
+    if len(values) <= valuesPerLine:
+        printXmlElement(out, level, name, " ".join(values))
+        return
+    out.write("%s<%s>\n" % (indent(level), name))
+    printValueLines(out, level + 1, values)
+    out.write(indent(level) + closeTag(name))
+
+
+def printTable(out, level, name, value, columns):
+    """Writes a list of structures as text with a line per structure and the field values separated by spaces"""
+    structureDescription = value[0].structureDescription
+    out.write('%s<%s structureName="%s" structureVersion="%s" format="table" columns="%s" >\n' % (
+        indent(level), name, structureDescription.structureName, structureDescription.structureVersion, " ".join(columns)))
+    getValues = operator.attrgetter(*columns)
+    lineIndent = indent(level + 1)
+    for entry in value:
+        values = getValues(entry)
+        if len(columns) == 1:
+            values = (values,)
+        out.write("%s%s\n" % (lineIndent, " ".join([m3.formatTableValue(fieldValue) for fieldValue in values])))
+    out.write(indent(level) + closeTag(name))
+
+
+def printObject(out, level, name, value, compact=False):
+    """Writes a value as xml element
+
+    With compact=True lists of numbers get written as text of one element and lists of structures
+    without references as table, see printPrimitiveList and printTable."""
     valueType = type(value)
     if value is None:
         out.write(indent(level) + openCloseTag(name))
         return
 
     elif valueType == int:
-        value = hex(value)
-        printXmlElement(out, level, name, value)
+        printXmlElement(out, level, name, hex(value))
         return
 
     elif valueType == bytearray or valueType == bytes:
-        value = byteDataToHex(value)
-        printXmlElement(out, level, name, value)
+        printByteData(out, level, name, value)
         return
 
     elif valueType == str:
         # get rid of non ASCII characters
-        value = re.sub('[^\x20-\x7F]', '.', str(value))
+        value = nonAsciiCharacterPattern.sub('.', value)
         # escape special XML characters (such as "&" -> "&amp;")
         value = escape(value)
         printXmlElement(out, level, name, value)
@@ -81,27 +141,35 @@ def printObject(out, level, name, value):
 
     elif valueType == list:
         if len(value) == 0:
-            out.write(indent(level) + openTag(name) + closeTag(name))
+            out.write("%s<%s></%s>\n" % (indent(level), name, name))
             return
         firstObject = value[0]
+        if compact:
+            if not isinstance(firstObject, m3.M3Structure):
+                printPrimitiveList(out, level, name, value)
+                return
+            columns = m3.determineTableColumns(firstObject.structureDescription)
+            if columns is not None:
+                printTable(out, level, name, value, columns)
+                return
         if isinstance(firstObject, m3.M3Structure):
             structureName = firstObject.structureDescription.structureName
             structureVersion = firstObject.structureDescription.structureVersion
             out.write(('%s<%s structureName="%s" structureVersion="%s" >\n' % (indent(level), name, structureName, structureVersion)))
         else:
-            out.write(indent(level) + openTag(name) + "\n")
+            out.write("%s<%s>\n" % (indent(level), name))
+        elementName = name + "-element"
         for entry in value:
-            printObject(out, level + 1, name + "-element", entry)
+            printObject(out, level + 1, elementName, entry, compact)
 
         out.write(indent(level) + closeTag(name))
         return
 
-    elif valueType == m3.M3Structure:
-        out.write(indent(level) + openTag(name) + "\n")
+    elif isinstance(value, m3.M3Structure):
+        out.write("%s<%s>\n" % (indent(level), name))
 
         for field in value.structureDescription.fields:
-            v = getattr(value, field.name)
-            printObject(out, level + 1, field.name, v)
+            printObject(out, level + 1, field.name, getattr(value, field.name), compact)
 
         out.write(indent(level) + closeTag(name))
         return
@@ -111,29 +179,26 @@ def printObject(out, level, name, value):
         return
 
 
-def printModel(model, outputFilePath):
-    outputStream = io.StringIO()
-
-    outputFile = open(outputFilePath, "w")
-    modelDescription = model.structureDescription
-    outputStream.write('<model structureName="%s" structureVersion="%s" >\n' % (modelDescription.structureName, modelDescription.structureVersion))
+def printModel(model, outputFilePath, compact=False):
+    """Writes the model as xml file
 
-    for field in modelDescription.fields:
-        value = getattr(model, field.name)
-        printObject(outputStream, 0, field.name, value)
+    The xml gets written directly to the buffered file, so only the model needs to be held in memory.
+    See printObject for compact=True, xmlToM3.py can read both layouts."""
+    with open(outputFilePath, "w", buffering=1024 * 1024) as outputFile:
+        modelDescription = model.structureDescription
+        outputFile.write('<model structureName="%s" structureVersion="%s" >\n' % (modelDescription.structureName, modelDescription.structureVersion))
 
-    outputStream.write(closeTag("model"))
+        for field in modelDescription.fields:
+            value = getattr(model, field.name)
+            printObject(outputFile, 0, field.name, value, compact)
 
-    outputFile.write(outputStream.getvalue())
-    outputFile.close()
+        outputFile.write(closeTag("model"))
 
-    outputStream.close()
 
-
-def convertFile(inputFilePath, outputFilePath, continueAtErrors):
+def convertFile(inputFilePath, outputFilePath, continueAtErrors, compact=False, validation="full"):
     model = None
     try:
-        model = m3.loadModel(inputFilePath)
+        model = m3.loadModel(inputFilePath, validation=validation)
     except Exception as e:
         if continueAtErrors:
             sys.stderr.write("\nError: %s\n" % e)
@@ -143,47 +208,97 @@ def convertFile(inputFilePath, outputFilePath, continueAtErrors):
             raise e
         return False
 
-    printModel(model, outputFilePath)
+    printModel(model, outputFilePath, compact)
     return True
 
 
-def processFile(inputPath, outputDirectory, inputFilePath, continueAtErrors):
-    relativeInputPath = os.path.relpath(inputFilePath, inputPath)
-    relativeOutputPath = relativeInputPath + ".xml"
-
+def determineOutputFilePath(inputPath, outputDirectory, inputFilePath):
     if outputDirectory:
-        if outputDirectory and not os.path.exists(outputDirectory):
-            os.makedirs(outputDirectory)
-        outputFilePath = os.path.join(outputDirectory, relativeOutputPath)
-    else:
-        outputFilePath = inputFilePath + ".xml"
+        relativeOutputPath = os.path.relpath(inputFilePath, inputPath) + ".xml"
+        return os.path.join(outputDirectory, relativeOutputPath)
+    return inputFilePath + ".xml"
 
-    print("%s -> %s" % (inputFilePath, outputFilePath))
 
-    return convertFile(inputFilePath, outputFilePath, continueAtErrors)
+def hashFile(filePath):
+    fileHash = hashlib.sha1()
+    with open(filePath, "rb") as fileObject:
+        for block in iter(lambda: fileObject.read(1024 * 1024), b""):
+            fileHash.update(block)
+    return fileHash.hexdigest()
 
 
-def processDirectory(inputPath, outputPath, recurse, continueAtErrors):
+def loadManifest(manifestPath):
+    """Returns a dict which maps the absolute paths of converted m3 files to their hash, output file and duration"""
+    try:
+        with open(manifestPath, "r") as manifestFile:
+            return json.load(manifestFile)
+    except FileNotFoundError:
+        return {}
 
-    count, succeeded, failed = 0, 0, 0
 
-    for path, dirs, files in os.walk(inputPath):
+def saveManifest(manifest, manifestPath):
+    temporaryManifestPath = "%s.%d.tmp" % (manifestPath, os.getpid())
+    with open(temporaryManifestPath, "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+    os.replace(temporaryManifestPath, manifestPath)
 
-        for file in files:
-            if file.endswith(".m3"):
 
-                inputFilePath = os.path.join(path, file)
-                success = processFile(inputPath, outputPath, inputFilePath, continueAtErrors)
+def isUpToDate(manifestEntry, inputFilePath, outputFilePath, inputFileHash, compact):
+    """Tells if the xml file is newer than the m3 file and got created in the same layout from an m3 file with the same hash"""
+    if manifestEntry is None or manifestEntry["hash"] != inputFileHash or manifestEntry["output"] != os.path.abspath(outputFilePath) or manifestEntry.get("compact", False) != compact:
+        return False
+    try:
+        return os.path.getmtime(outputFilePath) >= os.path.getmtime(inputFilePath)
+    except OSError:
+        return False
+
+
+def processFile(inputFilePath, outputFilePath, continueAtErrors, compact=False, validation="full", returnProfile=False, hashInput=False, manifestEntry=None):
+    """Converts a file and returns whether it succeeded, its duration, the profile and the hash of the m3 file
+
+    The profile gets only returned with returnProfile and the hash only with hashInput. If a manifestEntry
+    is given and the file is up to date according to it, the file doesn't get converted and None gets
+    returned instead of whether it succeeded.
 
-                succeeded += success
-                failed += not success
-                count += 1
+    Gets called in the worker processes with --jobs, which import m3 and read the structures once, so
+    that the files get hashed in parallel too."""
+    inputFileHash = None
+    if hashInput:
+        inputFileHash = hashFile(inputFilePath)
+        if manifestEntry is not None and isUpToDate(manifestEntry, inputFilePath, outputFilePath, inputFileHash, compact):
+            return None, 0.0, None, inputFileHash
+    outputSubDirectory = os.path.dirname(outputFilePath)
+    if outputSubDirectory:
+        os.makedirs(outputSubDirectory, exist_ok=True)
+    startTime = time.perf_counter()
+    success = convertFile(inputFilePath, outputFilePath, continueAtErrors, compact, validation)
+    duration = time.perf_counter() - startTime
+    profile = None
+    if returnProfile:
+        # The profile of a worker process gets sent to the main process after each file
+        profile = m3.disableProfiling()
+        m3.enableProfiling()
+    return success, duration, profile, inputFileHash
 
+
+def processFileTask(task):
+    return processFile(*task)
+
+
+def enableProfilingInWorker():
+    m3.enableProfiling()
+
+
+def findFiles(inputPath, recurse):
+    """Yields the *.m3 files of a directory, including the ones in its sub directories if recurse is True"""
+    for path, dirs, files in os.walk(inputPath):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(".m3"):
+                yield os.path.join(path, file)
         if not recurse:
             break
 
-    return count, succeeded, failed
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert Starcraft II m3 models to xml format.')
@@ -200,6 +315,33 @@ if __name__ == "__main__":
         '-c', '--continue-at-errors',
         action='store_true', default=False,
         help='Continue if there are errors in the files')
+    parser.add_argument(
+        '--profile',
+        action='store_true', default=False,
+        help='Print the time spent per phase and structure while loading and saving the models')
+    parser.add_argument(
+        '--compact',
+        action='store_true', default=False,
+        help='Write lists of numbers as one text and lists of structures without references as tables, which makes the files a lot smaller')
+    parser.add_argument(
+        '--validation',
+        choices=m3.validationLevels, default="full",
+        help='How thoroughly the loaded models get validated, "none" is faster for trusted files (default: full)')
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int, default=1,
+        help='Number of processes which convert files (default: 1)')
+    parser.add_argument(
+        '--incremental', '--resume',
+        action='store_true', default=False,
+        help='Skip files whose xml file is newer and which did not change since they got converted according to the manifest')
+    parser.add_argument(
+        '--manifest',
+        help='JSON file in which the hashes of the converted files get stored, implied by --incremental (default: m3ToXml-manifest.json in the output directory or next to the first input)')
+    parser.add_argument(
+        '--slowest',
+        type=int, default=10,
+        help='Number of slowest files to list in the summary (default: 10)')
     args = parser.parse_args()
 
     outputDirectory = args.output_directory
@@ -216,22 +358,90 @@ if __name__ == "__main__":
 
     continueAtErrors = args.continue_at_errors
 
+    manifestPath = args.manifest
+    if manifestPath is None and args.incremental:
+        if outputDirectory is not None:
+            manifestDirectory = outputDirectory
+        elif os.path.isfile(args.path[0]):
+            manifestDirectory = os.path.dirname(args.path[0])
+        else:
+            manifestDirectory = args.path[0]
+        manifestPath = os.path.join(manifestDirectory, "m3ToXml-manifest.json")
+    manifest = None
+    if manifestPath is not None:
+        manifest = loadManifest(manifestPath)
+
+    if args.profile:
+        m3.enableProfiling()
+
     t0 = time.time()
     print("Converting files.. %d" % len(args.path))
+    tasks = []
     for path in args.path:
-        total, succeeded, failed = (0, 0, 0)
         if os.path.isfile(path):
-            inputFilePath = path
+            inputFilePaths = [path]
             path = os.path.dirname(path)
-            success = processFile(path, outputDirectory, inputFilePath, continueAtErrors)
-            totalDelta, succeededDelta, failedDelta = 1, success, not success
         else:
-            totalDelta, succeededDelta, failedDelta = processDirectory(path, outputDirectory, recurse, continueAtErrors)
-        total += totalDelta
-        succeeded += succeededDelta
-        failed += failedDelta
+            inputFilePaths = findFiles(path, recurse)
+        for inputFilePath in inputFilePaths:
+            outputFilePath = determineOutputFilePath(path, outputDirectory, inputFilePath)
+            manifestEntry = None
+            if args.incremental:
+                manifestEntry = manifest.get(os.path.abspath(inputFilePath))
+            # The files get hashed by the workers, right before they get converted
+            tasks.append([inputFilePath, outputFilePath, continueAtErrors, args.compact, args.validation, args.profile, manifest is not None, manifestEntry])
+
+    executor = None
+    if args.jobs > 1 and len(tasks) > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=enableProfilingInWorker if args.profile else None)
+        results = executor.map(processFileTask, tasks)
+    else:
+        for task in tasks:
+            task[5] = False  # the profile of the main process gets recorded directly
+        results = map(processFileTask, tasks)
+
+    succeeded, failed, skipped = 0, 0, 0
+    durations = []
+    lastManifestSaveTime = time.time()
+    try:
+        # The results arrive in the order of the files, while the workers convert the next ones
+        for task, (success, duration, profile, inputFileHash) in zip(tasks, results):
+            inputFilePath, outputFilePath = task[0], task[1]
+            if success is None:
+                skipped += 1
+                continue
+            print("%s -> %s (%.2f s)" % (inputFilePath, outputFilePath, duration))
+            if profile is not None:
+                m3.profile.merge(profile)
+            durations.append((duration, inputFilePath))
+            if success:
+                succeeded += 1
+            else:
+                failed += 1
+            if manifest is None:
+                continue
+            if success:
+                manifest[os.path.abspath(inputFilePath)] = {"hash": inputFileHash, "output": os.path.abspath(outputFilePath), "compact": args.compact, "seconds": round(duration, 3)}
+            else:
+                manifest.pop(os.path.abspath(inputFilePath), None)
+            if time.time() - lastManifestSaveTime > 10.0:
+                # So that an interrupted run can be resumed with --resume
+                saveManifest(manifest, manifestPath)
+                lastManifestSaveTime = time.time()
+    finally:
+        if manifest is not None:
+            saveManifest(manifest, manifestPath)
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     t1 = time.time()
-    print("%d files found, %d converted, %d failed in %.2f s" % (total, succeeded, failed, (t1 - t0)))
+    total = len(tasks)
+    print("%d files found, %d converted, %d skipped, %d failed in %.2f s" % (total, succeeded, skipped, failed, (t1 - t0)))
+    if len(durations) > 0:
+        print("%.2f s per file on average, slowest files:" % (sum(duration for duration, inputFilePath in durations) / len(durations)))
+        for duration, inputFilePath in sorted(durations, reverse=True)[:args.slowest]:
+            print("%8.2f s %s" % (duration, inputFilePath))
+    if args.profile:
+        sys.stderr.write(m3.disableProfiling().formatTable(10))
     if failed > 0:
         sys.exit(1)
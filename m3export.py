@@ -69,7 +69,7 @@ class Exporter:
         self.initMaterialNameToNewReferenceIndexMap()
 
         model = self.createModel(m3FileName)
-        m3.saveAndInvalidateModel(model, m3FileName)
+        m3.saveModel(model, m3FileName)
 
     def initStructureVersionMap(self):
         self.structureVersionMap = {}
@@ -963,7 +963,7 @@ class Exporter:
                 boundingsAnimRef.header.animFlags = shared.animFlagsForAnimatedProperty
 
         msec = self.createInstanceOf("MSEC")
-        msec.boundingsAnimation = boundingsAnimRef
+        msec.bounding = boundingsAnimRef
         model.divisions[0].msec.append(msec)
 
     def createBoneMatricesForStaticMeshBone(self, staticMeshBoneIndex):
@@ -1964,13 +1964,10 @@ class Exporter:
         isVideo = shared.isVideoFilePath(layer.imagePath)
         m3Layer.setNamedBit("flags", "isVideo", isVideo)
         if not isVideo:
-            m3Layer.vidoeFrameRate = 0
+            m3Layer.videoFrameRate = 0
             m3Layer.videoStartFrame = 0
             m3Layer.videoEndFrame = 0
             m3Layer.videoMode = 0
-        m3Layer.unknownbc0c14e5 = self.createNullUInt32AnimationReference(0)
-        m3Layer.unknowne740df12 = self.createNullFloatAnimationReference(0.0, interpolationType=1)
-        m3Layer.unknown39ade219 = self.createNullUInt16AnimationReference(0)
         m3Layer.unknowna4ec0796 = self.createNullUInt32AnimationReference(0, interpolationType=1)
         m3Layer.unknowna44bf452 = self.createNullFloatAnimationReference(1.0, interpolationType=1)
         return m3Layer
@@ -2221,7 +2218,7 @@ class Exporter:
 
     def createEmptyMSec(self, minX=0.0, minY=0.0, minZ=0.0, maxX=0.0, maxY=0.0, maxZ=0.0, radius=0.0):
         msec = self.createInstanceOf("MSEC")
-        msec.boundingsAnimation = self.createDummyBoundingsAnimation(minX, minY, minZ, maxX, maxY, maxZ, radius)
+        msec.bounding = self.createDummyBoundingsAnimation(minX, minY, minZ, maxX, maxY, maxZ, radius)
         return msec
 
     def createDummyBoundingsAnimation(self, minX=0.0, minY=0.0, minZ=0.0, maxX=0.0, maxY=0.0, maxZ=0.0, radius=0.0):
@@ -443,7 +443,7 @@ class Importer:
             self.rootDirectory = path.dirname(fileName)
         self.scene = scene
         # print('loadModel', timeit(lambda: m3.loadModel(fileName), number=1))
-        self.model = m3.loadModel(fileName)
+        self.model = m3.loadModel(fileName, fields=cm.contentImportPresetToModelFieldsMap.get(self.contentPreset))
         self.sequenceNameAndSTCIndexToAnimIdSet = {}
         self.armature: bpy.types.Armature = None
         self.armatureObject: bpy.types.Object = None
@@ -21,7 +21,10 @@
 
 
 import m3
+import sys
 import argparse
+import os
+import shutil
 
 
 if __name__ == "__main__":
@@ -29,10 +32,13 @@ if __name__ == "__main__":
     parser.add_argument('animIdFile', help="m3 with the wanted animation ids")
     parser.add_argument('modelToFix', help="m3 which has the wrong animation ids")
     parser.add_argument('outputFile', help="name of the new m3 file to create")
+    parser.add_argument('--profile', action='store_true', default=False, help='Print the time spent per phase and structure while loading and saving the models')
     args = parser.parse_args()
+    if args.profile:
+        m3.enableProfiling()
 
-    animIdModel = m3.loadModel(args.animIdFile)
-    modelToFix = m3.loadModel(args.modelToFix)
+    animIdModel = m3.loadModel(args.animIdFile, fields=["bones", "divisions"])
+    modelToFix = m3.loadModel(args.modelToFix, trackChanges=True, fields=["bones", "divisions", "sequenceTransformationCollections", "sts"])
     outputFile = args.outputFile
 
     boneNameToAnimIdBoneMap = {}
@@ -65,9 +71,9 @@ if __name__ == "__main__":
     assertModelContainsOneDivisionAndMSec(animIdModel)
     msecToFix = modelToFix.divisions[0].msec[0]
     msecWithAnimId = animIdModel.divisions[0].msec[0]
-    oldAnimId = msecToFix.boundingsAnimation.header.animId
-    newAnimId = msecWithAnimId.boundingsAnimation.header.animId
-    msecToFix.boundingsAnimation.header.animId = newAnimId
+    oldAnimId = msecToFix.bounding.header.animId
+    newAnimId = msecWithAnimId.bounding.header.animId
+    msecToFix.bounding.header.animId = newAnimId
     oldAnimIdToNewAnimIdMap[oldAnimId] = newAnimId
 
     for stc in modelToFix.sequenceTransformationCollections:
@@ -84,5 +90,10 @@ if __name__ == "__main__":
             if newAnimId is not None:
                 animIds[i] = newAnimId
 
-    m3.saveAndInvalidateModel(modelToFix, outputFile)
+    # Only animation ids change, so the changed bytes can be written into a copy of the model:
+    if not os.path.exists(outputFile) or not os.path.samefile(args.modelToFix, outputFile):
+        shutil.copyfile(args.modelToFix, outputFile)
+    m3.patchModel(modelToFix, outputFile)
+    if args.profile:
+        sys.stderr.write(m3.disableProfiling().formatTable(10))
 
@@ -30,10 +30,13 @@ if __name__ == "__main__":
     parser.add_argument('m3File', help="m3 file")
     parser.add_argument('m3aFile', help="m3a files with extra animations for the m3 file")
     parser.add_argument('outputFile', help="name of the new m3 file to create")
+    parser.add_argument('--profile', action='store_true', default=False, help='Print the time spent per phase and structure while loading and saving the models')
     args = parser.parse_args()
+    if args.profile:
+        m3.enableProfiling()
 
-    m3Model = m3.loadModel(args.m3File)
-    m3aModel = m3.loadModel(args.m3aFile)
+    m3Model = m3.loadModel(args.m3File, lazy=True, trackChanges=True)
+    m3aModel = m3.loadModel(args.m3aFile, fields=["sequences", "sequenceTransformationCollections", "sequenceTransformationGroups", "sts"])
     outputFile = args.outputFile
     sameFormat = True
 
@@ -93,5 +96,7 @@ if __name__ == "__main__":
         m3Model.sequences.append(sequence)
         m3Model.sequenceTransformationGroups.append(stg)
 
-    m3.saveAndInvalidateModel(m3Model, outputFile)
+    m3.saveModel(m3Model, outputFile)
+    if args.profile:
+        sys.stderr.write(m3.disableProfiling().formatTable(10))
 
@@ -21,147 +21,231 @@
 
 import sys
 import m3
-import xml.dom.minidom
-from xml.dom.minidom import Node
+import operator
+import xml.etree.ElementTree
 import argparse
 import os
 import time
 
 
-def forElementsIn(xmlNode):
-    for child in xmlNode.childNodes:
-        if type(child) == xml.dom.minidom.Text:
-            if not child.wholeText.isspace():
-                raise Exception("Unexpected content \"%s\" within element %s" % (child.wholeText, xmlNode.nodeName))
-        else:
-            yield child
-
-
-def createSingleStructureElement(xmlNode, structureDescription):
-    createdObject = structureDescription.createInstance()
-    fieldIndex = 0
-    for child in forElementsIn(xmlNode):
-        fieldName = child.nodeName
-        if fieldIndex >= len(structureDescription.fields):
+def checkWhitespace(text, xmlElement):
+    if text is not None and not text.isspace():
+        raise Exception("Unexpected content \"%s\" within element %s" % (text.strip(), xmlElement.tag))
+
+
+def childElementsOf(events, xmlElement):
+    """Yields the child elements of xmlElement as soon as their start tags got parsed
+
+    The caller has to consume the events of each child up to its end tag before asking for the next one.
+    Processed children get removed from xmlElement, so that only the elements of the path to the current
+    one are kept in memory."""
+    previousChild = None
+    for event, child in events:
+        if previousChild is not None:
+            checkWhitespace(previousChild.tail, xmlElement)
+            xmlElement.remove(previousChild)
+            previousChild = None
+        if event == "end":
+            checkWhitespace(xmlElement.text, xmlElement)
+            return
+        yield child
+        previousChild = child
+    raise Exception("XML file ended within element %s" % xmlElement.tag)
+
+
+def textOf(events, xmlElement):
+    """Consumes the events up to the end tag of xmlElement and returns its text or None if it's empty"""
+    event, child = next(events)
+    if event != "end":
+        raise Exception("Element %s contained the child element %s" % (xmlElement.tag, child.tag))
+    return xmlElement.text
+
+
+def skipElement(events, xmlElement):
+    depth = 1
+    for event, child in events:
+        depth += 1 if event == "start" else -1
+        if depth == 0:
+            xmlElement.clear()
+            return
+
+
+def createSingleStructureElement(events, xmlElement, structureDescription):
+    fields = structureDescription.fields
+    fieldValues = []
+    for child in childElementsOf(events, xmlElement):
+        fieldIndex = len(fieldValues)
+        if fieldIndex >= len(fields):
             raise Exception("XML file is incompatible: too many fields")
-        field = structureDescription.fields[fieldIndex]
-        if field.name != fieldName:
-            raise Exception("XML file is incompatible: Expected field %s but found field %s" % (field.name, fieldName))
-
-        fieldContent = createFieldContent(child, field)
-        setattr(createdObject, field.name, fieldContent)
-        fieldIndex += 1
+        field = fields[fieldIndex]
+        if field.name != child.tag:
+            raise Exception("XML file is incompatible: Expected field %s but found field %s" % (field.name, child.tag))
+        fieldValues.append(createFieldContent(events, child, field))
 
-    missingFields = len(structureDescription.fields) - fieldIndex
+    missingFields = len(fields) - len(fieldValues)
     if missingFields > 0:
         raise Exception("XML file is incompatible: %d fields are missing in %s" % (missingFields, structureDescription.structureName))
 
-    return createdObject
+    return m3.createStructureFromFieldValues(structureDescription, fieldValues)
 
 
 intTypeStrings = set(["int32", "int16", "int8", "uint32", "uint16", "uint8"])
 
 
-def createFieldContent(xmlNode, field):
+def createFieldContent(events, xmlElement, field):
     if isinstance(field, m3.ReferenceField):
         if field.historyOfReferencedStructures is None:
+            skipElement(events, xmlElement)
             return []  # TODO check if that's correct
         else:
             referencedStructureName = field.historyOfReferencedStructures.name
             if referencedStructureName == "CHAR":
-                if len(xmlNode.childNodes) == 0:
-                    return None
-                return stringContentOf(xmlNode)
+                return textOf(events, xmlElement)
             elif referencedStructureName == "U8__":
-                return bytearray(hexToBytes(stringContentOf(xmlNode), xmlNode))
+                return bytearray(hexToBytes(textOf(events, xmlElement), xmlElement))
             else:
-                if field.historyOfReferencedStructures is not None:
-                    return createElementList(xmlNode, field.name, field.historyOfReferencedStructures)
-                else:
-                    return createElementList(xmlNode, field.name, None)
+                return createElementList(events, xmlElement, field.name, field.historyOfReferencedStructures)
 
     elif isinstance(field, m3.UnknownBytesField):
-        return hexToBytes(stringContentOf(xmlNode), xmlNode)
+        return hexToBytes(textOf(events, xmlElement), xmlElement)
     elif isinstance(field, m3.PrimitiveField):
         if field.typeString == "float":
-            return float(stringContentOf(xmlNode))
+            return float(textOf(events, xmlElement))
         elif field.typeString in intTypeStrings:
-            return int(stringContentOf(xmlNode), 0)
+            return int(textOf(events, xmlElement), 0)
         else:
             raise Exception("Unsupported primtive: %s" % field.typeString)
     elif isinstance(field, m3.EmbeddedStructureField):
-        return createSingleStructureElement(xmlNode, field.structureDescription)
+        return createSingleStructureElement(events, xmlElement, field.structureDescription)
     else:  # TagField
         raise Exception("Unsupported field type %s" % type(field))
 
 
-def removeWhitespace(s):
-    return s.translate({ord(" "): None, ord("\t"): None, ord("\r"): None, ord("\n"): None})
-
-
-def hexToBytes(hexString, xmlNode):
-    hexString = removeWhitespace(hexString)
+def hexToBytes(hexString, xmlElement):
+    hexString = "" if hexString is None else hexString.strip()
     if hexString == "":
         return bytearray(0)
     if not hexString.startswith("0x"):
-        raise Exception('hex string "%s" of node %s does not start with 0x' % (hexString, xmlNode.nodeName))
-    hexString = hexString[2:]
-    return bytes([int(hexString[x: x + 2], 16) for x in range(0, len(hexString), 2)])
-
-
-def stringContentOf(xmlNode):
-    content = ""
-    for child in xmlNode.childNodes:
-        if child.nodeType == Node.TEXT_NODE:
-            content += child.data
-        else:
-            raise Exception("Element %s contained childs of xml node type %s." % (xmlNode.nodeName, type(xmlNode)))
-    return content
-
-
-def createListElement(xmlNode, structureDescription):
-    if structureDescription.structureName in ["I32_", "I16_", "I8__", "U32_", "U16_", "U8__", "FLAG"]:
-        return int(stringContentOf(xmlNode), 0)
-    elif structureDescription.structureName in ["REAL"]:
-        return float(stringContentOf(xmlNode))
-    else:
-        return createSingleStructureElement(xmlNode, structureDescription)
+        raise Exception('hex string "%s" of node %s does not start with 0x' % (hexString, xmlElement.tag))
+    return bytes.fromhex(hexString[2:])
+
+
+intListStructureNames = set(["I32_", "I16_", "I8__", "U32_", "U16_", "U8__", "FLAG"])
+
+
+def createPrimitiveList(text, structureName):
+    """Parses the values of a list of numbers written by m3ToXml.py --compact"""
+    if structureName == "REAL":
+        return [float(value) for value in text.split()]
+    return [int(value, 0) for value in text.split()]
+
+
+def fieldWithName(structureDescription, fieldName):
+    for field in structureDescription.fields:
+        if field.name == fieldName:
+            return field
+    raise Exception("%s has no field called %s" % (structureDescription.structureName, fieldName))
+
+
+def createTableColumnSetter(structureDescription, column):
+    """Returns a function which sets the field with the given path, e.g. "position.x", and the field itself"""
+    path = column.split(".")
+    for fieldName in path[:-1]:
+        structureDescription = fieldWithName(structureDescription, fieldName).structureDescription
+    field = fieldWithName(structureDescription, path[-1])
+    fieldName = field.name
+    if len(path) == 1:
+        return lambda instance, value: setattr(instance, fieldName, value), field
+    getParent = operator.attrgetter(".".join(path[:-1]))
+    return lambda instance, value: setattr(getParent(instance), fieldName, value), field
+
+
+def createElementsFromTable(events, xmlElement, parentName, structureDescription):
+    """Creates the structures of a list written as table by m3ToXml.py --compact"""
+    expectedColumns = m3.determineTableColumns(structureDescription)
+    columns = xmlElement.get("columns", "").split()
+    if expectedColumns is None:
+        raise Exception("XML file is incompatible: The list %s of %s structures can't be stored as table" % (parentName, structureDescription.structureName))
+    if columns != expectedColumns:
+        raise Exception("XML file is incompatible: Expected the columns %s for the list %s but found %s" % (" ".join(expectedColumns), parentName, " ".join(columns)))
+    setters = []
+    parsers = []
+    for column in columns:
+        setter, field = createTableColumnSetter(structureDescription, column)
+        setters.append(setter)
+        parsers.append(m3.createTableValueParser(field))
+    values = (textOf(events, xmlElement) or "").split()
+    if len(values) % len(columns) != 0:
+        raise Exception("The table %s has %d values, which is not a multiple of its %d columns" % (parentName, len(values), len(columns)))
+    createdList = []
+    columnsOfRow = list(zip(setters, parsers))
+    for rowOffset in range(0, len(values), len(columns)):
+        createdObject = structureDescription.createInstance()
+        for (setter, parser), value in zip(columnsOfRow, values[rowOffset:rowOffset + len(columns)]):
+            setter(createdObject, parser(value))
+        createdList.append(createdObject)
+    return createdList
 
 
-def childElementsOf(parentName, xmlNode):
+def listElementsOf(events, xmlElement, parentName):
     expectedChildNames = parentName + "-element"
-    for child in xmlNode.childNodes:
-        if type(child) == xml.dom.minidom.Text:
-            if not child.data.isspace():
-                raise Exception("Unexpected content \"%s\" within element %s" % (child.wholeText, xmlNode.nodeName))
-        else:
-            if (child.nodeName != expectedChildNames):
-                raise Exception("Unexpected child \"%s\" within element %s", (child.nodeName, xmlNode.nodeName))
-            yield child
-
-
-def createElementList(xmlNode, parentName, historyOfReferencedStructure):
-    xmlElements = list(childElementsOf(parentName, xmlNode))
-    if historyOfReferencedStructure.name in ["CHAR", "I32_", "I16_", "I8__", "U32_", "U16_", "U8__", "REAL", "FLAG"]:
-        structVersion = 0
-    else:
-        if len(xmlElements) == 0:
+    for child in childElementsOf(events, xmlElement):
+        if child.tag != expectedChildNames:
+            raise Exception("Unexpected child \"%s\" within element %s" % (child.tag, xmlElement.tag))
+        yield child
+
+
+def createPrimitiveElementList(events, xmlElement, parentName, structureName):
+    """Reads a list of numbers, which either got written as text by m3ToXml.py --compact or with an element per value"""
+    event, child = next(events)
+    if event == "end":
+        text = xmlElement.text
+        if text is None or text.isspace():
             return []
-
-        child = xmlNode.firstChild
-        structVersion = int(xmlNode.getAttribute("structureVersion"))
-        structName = xmlNode.getAttribute("structureName")
-        if structName == "" or structVersion == "":
-            raise Exception("Incompatible format: Require now a strutureName and structureVerson attribute for the list %s" % parentName)
-        if structName != historyOfReferencedStructure.name:
-            raise Exception("Expected a %s to have the structure name %s instead of %s" % (parentName, historyOfReferencedStructure.name, structName))
-    structureDescription = historyOfReferencedStructure.getVersion(structVersion)
-    createdList = []
-    for child in xmlElements:
-        o = createListElement(child, structureDescription)
-        createdList.append(o)
-
-    return createdList
+        return createPrimitiveList(text, structureName)
+    # The start event of the first child got consumed already, so it gets chained in front of the others
+    events = chainEvent((event, child), events)
+    parse = float if structureName == "REAL" else (lambda value: int(value, 0))
+    return [parse(textOf(events, child)) for child in listElementsOf(events, xmlElement, parentName)]
+
+
+def chainEvent(firstEvent, events):
+    yield firstEvent
+    yield from events
+
+
+def createElementList(events, xmlElement, parentName, historyOfReferencedStructure):
+    structureName = historyOfReferencedStructure.name
+    if structureName in intListStructureNames or structureName == "REAL":
+        return createPrimitiveElementList(events, xmlElement, parentName, structureName)
+    structName = xmlElement.get("structureName")
+    structVersion = xmlElement.get("structureVersion")
+    if structName is None or structVersion is None:
+        if textOf(events, xmlElement) is None or xmlElement.text.isspace():
+            return []
+        raise Exception("Incompatible format: Require now a strutureName and structureVerson attribute for the list %s" % parentName)
+    if structName != structureName:
+        raise Exception("Expected a %s to have the structure name %s instead of %s" % (parentName, structureName, structName))
+    structureDescription = historyOfReferencedStructure.getVersion(int(structVersion))
+    if xmlElement.get("format") == "table":
+        return createElementsFromTable(events, xmlElement, parentName, structureDescription)
+    return [createSingleStructureElement(events, child, structureDescription) for child in listElementsOf(events, xmlElement, parentName)]
+
+
+def loadModel(inputFile):
+    """Creates a model from a file written by m3ToXml.py
+
+    The xml gets parsed with iterparse and each structure gets created as soon as its end tag got
+    parsed. Converted elements get removed from the tree, so the memory needed doesn't grow with the
+    size of the xml file beyond the created model."""
+    events = iter(xml.etree.ElementTree.iterparse(inputFile, events=("start", "end")))
+    event, modelElement = next(events)
+    structVersion = int(modelElement.get("structureVersion"))
+    structName = modelElement.get("structureName")
+    modelDescription = m3.structures[structName].getVersion(structVersion)
+    model = createSingleStructureElement(events, modelElement, modelDescription)
+    modelElement.clear()
+    return model
 
 
 def convertFile(inputFilePath, outputDirectory):
@@ -171,13 +255,8 @@ def convertFile(inputFilePath, outputDirectory):
     else:
         outputFilePath = inputFilePath[:-4]
     print("Converting %s -> %s" % (inputFilePath, outputFilePath))
-    doc = xml.dom.minidom.parse(inputFilePath)
-    modelElement = doc.firstChild
-    structVersion = int(modelElement.getAttribute("structureVersion"))
-    structName = modelElement.getAttribute("structureName")
-    modelDescription = m3.structures[structName].getVersion(structVersion)
-    model = createSingleStructureElement(modelElement, modelDescription)
-    m3.saveAndInvalidateModel(model, outputFilePath)
+    model = loadModel(inputFilePath)
+    m3.saveModel(model, outputFilePath)
 
 
 if __name__ == "__main__":
@@ -185,6 +264,7 @@ if __name__ == "__main__":
     parser.add_argument('path', nargs='+', help="Either a *.m3.xml file or a directory with *.m3.xml files generated with m3ToXml.py")
     parser.add_argument('--output-directory', '-o', help='Directory in which m3 files will be placed')
     parser.add_argument('--watch', action='store_const', const=True, default=False)
+    parser.add_argument('--profile', action='store_true', default=False, help='Print the time spent per phase and structure while loading and saving the models')
     args = parser.parse_args()
     outputDirectory = args.output_directory
     if outputDirectory is not None and not os.path.isdir(outputDirectory):
@@ -194,6 +274,8 @@ if __name__ == "__main__":
         if not (filePath.endswith(".m3.xml") or os.path.isdir(filePath)):
             sys.stderr.write("%s neither a directory nor does it end with '.m3.xml'\n" % filePath)
             sys.exit(2)
+    if args.profile:
+        m3.enableProfiling()
 
     if args.watch:
         if ((len(args.path) == 0) or os.path.isdir(filePath)):
@@ -209,6 +291,9 @@ if __name__ == "__main__":
                 print("File modified at %s, converting again" % time.ctime(currentModelModificationTime))
                 convertFile(filePath, outputDirectory)
                 print("converted file")
+                if args.profile:
+                    sys.stderr.write(m3.disableProfiling().formatTable(10))
+                    m3.enableProfiling()
                 previousModelModiticationTime = currentModelModificationTime
             time.sleep(0.1)
     else:
@@ -227,3 +312,5 @@ if __name__ == "__main__":
             print("Converted %d file from .m3.xml to .m3" % counter)
         else:
             print("Converted %d files from .m3.xml to .m3" % counter)
+        if args.profile:
+            sys.stderr.write(m3.disableProfiling().formatTable(10))